@@ -0,0 +1,445 @@
+# -*- coding: utf-8 -*-
+"""
+Cálculos de las páginas como funciones sobre DataFrames, sin streamlit.
+
+Las páginas solo leen st.session_state, llaman a estas funciones a través de sus
+envoltorios cacheados (con los datos en parámetros '_' y la huella como clave, ver
+claves_cache.py) y dibujan el resultado. Así los cálculos se pueden medir, lanzar en
+lote o precalcular fuera de la interfaz:
+
+    import analitica
+    from carga_datos import carga_datos_base
+    datos_base = carga_datos_base(884)
+    flow_data, total, procesos = analitica.process_flows(datos_base['secuencias'], mascara)
+
+Los nombres son los de las funciones de las páginas. Las entradas son las de
+datos_base / datos_filtrados_rango (carga_datos.py): 'secuencias' (secuencias.py),
+'expedientes', 'tramites' y las máscaras de estados (filtro_estados.py). La carga de
+trabajo acumulada y los cubos diarios están en carga_trabajo.py, cubo_demanda.py y
+cubo_tramitacion.py, y se importan también desde aquí. Con CUADRO_MANDO_MOTOR=polars
+las agrupaciones pesadas de flujos, transiciones y evolución de la tramitación se
+calculan con Polars (motor_polars.py).
+"""
+import numpy as np
+import pandas as pd
+
+import motor_polars
+from secuencias import secuencias_a_listas, identifica_flujos, duraciones_medias_por_paso
+from transiciones import transiciones_secuencias, estadisticas_transiciones, build_dot
+from carga_trabajo import construye_acumulado, tabla_carga, unidades_con_carga
+from cubo_demanda import construye_cubo_demanda, serie_demanda, demanda_por_provincia
+from cubo_tramitacion import construye_cubo_tramitacion, mascara_firmas, evolucion_tramites
+
+# Porcentaje mínimo de expedientes de un flujo para mostrarlo
+MIN_PERCENTAGE_SHOW = 0.5
+
+
+# DATOS BÁSICOS
+###############
+
+def agg_tram_filtrado_tini_tfin_dur(secuencias, mascara_estados):
+    """Una fila por expediente con fechas, estados, unidad, duración en días y 'contains_selected'"""
+    tram_filtr_agg_tiempos = secuencias_a_listas(secuencias).drop(columns=['durations'])
+    tram_filtr_agg_tiempos['duration_days'] = (
+        tram_filtr_agg_tiempos['last_date'] - tram_filtr_agg_tiempos['first_date']
+    ).dt.total_seconds() / (3600 * 24)
+    # Máscara de los expedientes que alcanzan los estados finales (todos si no hay selección)
+    tram_filtr_agg_tiempos['contains_selected'] = mascara_estados
+    return tram_filtr_agg_tiempos
+
+
+# FLUJOS
+########
+
+def process_flows(secuencias, mascara_estados, min_percentage=MIN_PERCENTAGE_SHOW):
+    """
+    Flujos (secuencias de estados distintas) de los expedientes de la máscara.
+
+    Devuelve (flow_data, total_processes, filtered_processes): flow_data es una lista
+    de dicts con 'flow_id', 'sequence', 'count', 'percentage' y 'durations' (duración
+    media de cada paso) de los flujos con al menos min_percentage % de los expedientes,
+    de más a menos frecuente; filtered_processes tiene id_exp, unidad_tramitadora y
+    flow_id de los expedientes de la máscara, indexado por su posición en el almacén.
+    """
+    tram_filtr_agg_tiempos = secuencias['expedientes'][['id_exp', 'unidad_tramitadora']].copy()
+    # Cada secuencia se identifica una vez con un flow_id entero
+    motor = motor_polars if motor_polars.ACTIVO else None
+    flow_ids, flow_sequences = (motor.identifica_flujos if motor else identifica_flujos)(secuencias)
+    tram_filtr_agg_tiempos['flow_id'] = flow_ids
+    filtered_processes = tram_filtr_agg_tiempos[mascara_estados]
+    total_processes = len(filtered_processes)
+
+    seq_counts = filtered_processes['flow_id'].value_counts().reset_index()
+    seq_counts.columns = ['flow_id', 'count']
+    seq_counts['percentage'] = (seq_counts['count'] / total_processes * 100).round(1)
+    major_seqs = seq_counts[seq_counts['percentage'] >= min_percentage].sort_values(
+        ['count', 'flow_id'], ascending=[False, True]
+    )
+
+    # Duración media de cada paso de todos los flujos principales en una sola agrupación
+    major_processes = filtered_processes[filtered_processes['flow_id'].isin(major_seqs['flow_id'])]
+    avg_durations = (motor.duraciones_medias_por_paso if motor else duraciones_medias_por_paso)(
+        secuencias, major_processes[['flow_id']]
+    )
+    durations_by_flow = {
+        flow_id: group.tolist() for flow_id, group in avg_durations.groupby(level='flow_id')
+    }
+
+    flow_data = []
+    for flow_id, count, percentage in zip(major_seqs['flow_id'], major_seqs['count'], major_seqs['percentage']):
+        flow_data.append({
+            'flow_id': flow_id,
+            'sequence': list(flow_sequences[flow_id]),
+            'count': count,
+            'percentage': percentage,
+            'durations': durations_by_flow.get(flow_id, [])
+        })
+    return flow_data, total_processes, filtered_processes
+
+
+def generate_flow_info(flow, idx, nombres_estados):
+    """
+    Given a flow record, its index, and the mapping of state names,
+    return a tuple containing:
+      - code (e.g. "F01"),
+      - list of state names,
+      - full sequence as a string,
+      - label string for display.
+    """
+    code = f"F{idx:02d}"
+    states = [str(nombres_estados.get(s, f"S-{s}")) for s in flow['sequence']]
+    full_sequence = " → ".join(states)
+    label = f"({flow['percentage']}% - {sum(flow['durations']):.0f} días ) {full_sequence} "
+    return code, states, full_sequence, label
+
+
+def create_visualizations(flow_data, nombres_estados):
+    """
+    Build legend and visualization data frames using the helper function.
+    """
+    legend_data = []
+    viz_data = []
+
+    for idx, flow in enumerate(flow_data, 1):
+        code, states, full_sequence, _ = generate_flow_info(flow, idx, nombres_estados)
+        transitions = [f"{states[i]} → {states[i+1]}" for i in range(len(states) - 1)]
+
+        legend_data.append({
+            'Code': code,
+            'Sequence': full_sequence,
+            'Percentage': f"{flow['percentage']}%",
+            'Total': flow['count'],
+            'Avg Duration': f"{sum(flow['durations']):.0f} días"
+        })
+
+        for transition, duration in zip(transitions, flow['durations']):
+            viz_data.append({
+                'Flow': code,
+                'Transition': transition,
+                'Duration': duration,
+                'Percentage': flow['percentage']
+            })
+
+    return pd.DataFrame(legend_data), pd.DataFrame(viz_data)
+
+def create_office_visualizations(secuencias, filtered_processes, flow_data, nombres_estados):
+    """
+    Build DataFrames for office-level visualizations.
+    For each major flow (from flow_data) and for each unidad_tramitadora,
+    compute:
+      - The count and percentage (with respect to that office’s total)
+      - The average durations per transition.
+    We also assign an abbreviated office code (e.g. U1, U2) and create a y_label
+    in the form "Flow (OfficeCode)" so that the order is consistent with the overall chart.
+    """
+    # Work with the already filtered processes (which include 'unidad_tramitadora' and 'flow_id')
+    # and only keep the major flows (those present in flow_data)
+    df = filtered_processes[['unidad_tramitadora', 'flow_id']]
+    df = df[df['flow_id'].isin([flow['flow_id'] for flow in flow_data])]
+
+    # Build a mapping from flow_id to flow code (to match the global charts)
+    flow_code_mapping = {}
+    global_flow_order = []
+    transitions_mapping = {}
+    for idx, flow in enumerate(flow_data, 1):
+        flow_code = f"F{idx:02d}"
+        flow_code_mapping[flow['flow_id']] = flow_code
+        global_flow_order.append(flow_code)
+        # Get transitions labels from state names
+        states = [str(nombres_estados.get(s, f"S-{s}")) for s in flow['sequence']]
+        transitions_mapping[flow['flow_id']] = [f"{states[i]} → {states[i+1]}" for i in range(len(states)-1)]
+
+    # For each (unidad_tramitadora, flow) group, compute counts and percentages
+    totals_by_office = df.groupby('unidad_tramitadora').size()
+    perc_df = df.groupby(['unidad_tramitadora', 'flow_id']).size().reset_index(name='count')
+    perc_df['percentage'] = (
+        perc_df['count'] / perc_df['unidad_tramitadora'].map(totals_by_office) * 100
+    ).round(1)
+
+    # Average durations per transition for every (office, flow) in a single grouped pass
+    dur_df = duraciones_medias_por_paso(secuencias, df).reset_index()
+    total_durations = dur_df.groupby(['unidad_tramitadora', 'flow_id'])['duration'].sum()
+    perc_df['total_duration'] = perc_df.set_index(['unidad_tramitadora', 'flow_id']).index.map(
+        total_durations
+    ).fillna(0).to_numpy()
+
+    perc_df['Flow'] = perc_df['flow_id'].map(flow_code_mapping)
+    perc_df = perc_df.rename(columns={'unidad_tramitadora': 'Office'})[
+        ['Flow', 'Office', 'percentage', 'count', 'total_duration']
+    ]
+    dur_df = pd.DataFrame({
+        'Flow': dur_df['flow_id'].map(flow_code_mapping),
+        'Office': dur_df['unidad_tramitadora'],
+        'Transition': [transitions_mapping[f][i] for f, i in zip(dur_df['flow_id'], dur_df['paso'])],
+        'Duration': dur_df['duration'],
+        'transition_index': dur_df['paso']
+    })
+
+    # Create abbreviated office codes (so full names don’t clutter the chart)
+    offices_sorted = sorted(df['unidad_tramitadora'].unique())
+    office_code_mapping = {name: f"U{i+1}" for i, name in enumerate(offices_sorted)}
+    perc_df['OfficeCode'] = perc_df['Office'].map(office_code_mapping)
+    dur_df['OfficeCode'] = dur_df['Office'].map(office_code_mapping)
+
+    # Create a y_label for plotting: "Flow (OfficeCode)"
+    perc_df['y_label'] = perc_df['Flow'] + " (" + perc_df['OfficeCode'] + ")"
+    dur_df['y_label'] = dur_df['Flow'] + " (" + dur_df['OfficeCode'] + ")"
+
+    # Order the rows by the global flow order and then by OfficeCode
+    perc_df['Flow_order'] = pd.Categorical(perc_df['Flow'], categories=global_flow_order, ordered=True)
+    perc_df = perc_df.sort_values(['Flow_order', 'OfficeCode'])
+    dur_df['Flow_order'] = pd.Categorical(dur_df['Flow'], categories=global_flow_order, ordered=True)
+    dur_df = dur_df.sort_values(['Flow_order', 'OfficeCode', 'transition_index'])
+
+    return perc_df, dur_df, office_code_mapping
+
+
+def build_dot_for_expedientes(secuencias, id_exps, nombres_estados):
+    """Grafo DOT de las transiciones (número y duración media) de los expedientes indicados"""
+    mascara = secuencias['expedientes']['id_exp'].isin(id_exps).to_numpy()
+    stats = estadisticas_transiciones(transiciones_secuencias(secuencias, mascara))
+    return build_dot(stats, nombres_estados)
+
+
+# TRANSICIONES
+##############
+
+def transition_labels(df, nombres_estados):
+    """Etiqueta "origen → destino" de cada fila con columnas src y tgt"""
+    src_label = df['src'].map(nombres_estados).fillna('S-' + df['src'].astype(str))
+    tgt_label = df['tgt'].map(nombres_estados).fillna('S-' + df['tgt'].astype(str))
+    return src_label.astype(str) + " → " + tgt_label.astype(str)
+
+
+def calculate_transition_stats(secuencias, mascara_estados):
+    """Estadísticas de las transiciones de los expedientes de la máscara: globales y por unidad"""
+    if motor_polars.ACTIVO:
+        return motor_polars.calculate_transition_stats(secuencias, mascara_estados)
+    transiciones = transiciones_secuencias(secuencias, mascara_estados)
+    transition_stats = estadisticas_transiciones(transiciones)
+    transition_stats_grouped = estadisticas_transiciones(transiciones, por_unidad=True)
+    return transition_stats, transition_stats_grouped
+
+
+def build_transition_dataframes(transition_stats, transition_stats_grouped, nombres_estados):
+    """Tablas de barras (duraciones), dispersión global y dispersión por unidad, por src descendente"""
+    df_transitions = pd.DataFrame({
+        'src': transition_stats['src'],
+        'Transition': transition_labels(transition_stats, nombres_estados),
+        'Mean Duration': transition_stats['mean'],
+        'Median Duration': transition_stats['median'],
+        'P90 Duration': transition_stats['p90'],
+        'Count': transition_stats['count']
+    }).sort_values("src", ascending=False, kind='stable')
+
+    df_scatter_global = pd.DataFrame({
+        'src': transition_stats['src'],
+        'Transition': transition_labels(transition_stats, nombres_estados),
+        'Mean Duration': transition_stats['mean'],
+        'Total Processes': transition_stats['count'],
+        'Total Days': transition_stats['sum']
+    }).sort_values("src", ascending=False, kind='stable')
+
+    df_scatter_grouped = pd.DataFrame({
+        'src': transition_stats_grouped['src'],
+        'Transition': transition_labels(transition_stats_grouped, nombres_estados),
+        'Unidad': transition_stats_grouped['unidad'],
+        'Mean Duration': transition_stats_grouped['mean'],
+        'Total Processes': transition_stats_grouped['count'],
+        'Total Days': transition_stats_grouped['sum']
+    }).sort_values("src", ascending=False, kind='stable')
+
+    return df_transitions, df_scatter_global, df_scatter_grouped
+
+
+# ORIGEN GEOGRÁFICO
+###################
+
+def aggregate_data(expedientes):
+    """Totales, online y empresas (con sus porcentajes) por provincia y por municipio"""
+    df = expedientes[['id_exp', 'codine_provincia', 'codine',
+                      'es_online', 'es_empresa',
+                      'provincia', 'municipio']].copy()
+
+    # Agregación por provincia (manteniendo el nombre)
+    df_prov = df.groupby('codine_provincia', observed=True).agg(
+        provincia=('provincia', 'first'),
+        total=('id_exp', 'count'),
+        online=('es_online', 'sum'),
+        empresas=('es_empresa', 'sum')
+    ).reset_index()
+
+    # Agregación por municipio (manteniendo el nombre)
+    df_mun = df.groupby(['codine_provincia', 'codine'], observed=True).agg(
+        municipio=('municipio', 'first'),
+        provincia=('provincia', 'first'),
+        total=('id_exp', 'count'),
+        online=('es_online', 'sum'),
+        empresas=('es_empresa', 'sum')
+    ).reset_index()
+
+    for df_agg in [df_prov, df_mun]:
+        anade_porcentajes(df_agg)
+
+    return df_prov, df_mun
+
+
+def anade_porcentajes(df_agg):
+    """Porcentajes relativos a cada área ('total', 'online' y 'empresas'), en el propio DataFrame"""
+    total_nacional = df_agg['total'].sum()
+    df_agg['%_total'] = (df_agg['total'] / total_nacional * 100).round(1)
+    df_agg['%_online'] = (df_agg['online'] / df_agg['total'] * 100).round(1)
+    df_agg['%_empresas'] = (df_agg['empresas'] / df_agg['total'] * 100).round(1)
+    df_agg['total'] = df_agg['total'].astype('int32')
+
+
+# EVOLUCIÓN DE LA DEMANDA
+#########################
+
+def compute_agregado(cubo_demanda, regla):
+    """Expedientes por periodo ('D', 'W-MON', 'MS') con columnas fecha_registro_exp y total_exp"""
+    return serie_demanda(cubo_demanda, regla).reset_index()
+
+
+def compute_provincia(cubo_demanda, regla):
+    """Expedientes por periodo y provincia, con las provincias ordenadas de más a menos expedientes"""
+    df = demanda_por_provincia(cubo_demanda, regla)
+    province_totals = df.groupby('provincia', observed=True)['total_exp'].sum().sort_values(ascending=False)
+    df['provincia'] = pd.Categorical(
+        df['provincia'],
+        categories=province_totals.index.tolist(),
+        ordered=True
+    )
+    return df
+
+
+def compute_heatmap_data(cubo_demanda):
+    """Serie semanal, matriz año ISO x semana ISO de expedientes y su customdata (inicio, mes)"""
+    df_week = serie_demanda(cubo_demanda, 'W-MON')
+    # Año y semana ISO para no mezclar semanas entre años naturales
+    iso_calendar = df_week.index.isocalendar()
+    df_week['year'] = iso_calendar['year']
+    df_week['week'] = iso_calendar['week']
+    df_week['start_date'] = df_week.index.strftime('%Y-%m-%d')
+    df_week['month'] = df_week.index.strftime('%B')
+
+    heatmap_data = df_week.groupby(['year', 'week'])['total_exp'].sum().unstack(fill_value=0)
+    start_date_pivot = df_week.groupby(['year', 'week'])['start_date'].first().unstack()
+    month_pivot = df_week.groupby(['year', 'week'])['month'].first().unstack()
+    custom_data = np.dstack([start_date_pivot.values, month_pivot.values])
+
+    return df_week, heatmap_data, custom_data
+
+
+# EVOLUCIÓN DE LA TRAMITACIÓN
+#############################
+
+def process_starts_vs_completed(tramites_df, ids_completados, hay_seleccion, freq):
+    """
+    Inicios y completados por periodo, y el índice periodo -> inicios no completados
+    para el detalle: 'periods' (ordenados), 'offsets' y 'positions' (posiciones en
+    tramites_df de los trámites de inicio de cada periodo, en el orden de la tabla).
+    """
+    if motor_polars.ACTIVO and freq in motor_polars.FRECUENCIAS:
+        return motor_polars.process_starts_vs_completed(tramites_df, ids_completados, hay_seleccion, freq)
+    starts_df = tramites_df[tramites_df['num_tramite'] == 0].copy()
+    starts_df['position'] = np.flatnonzero(tramites_df['num_tramite'].to_numpy() == 0)
+
+    starts_df['fecha'] = starts_df['fecha_tramite'].dt.to_period(freq).dt.to_timestamp()
+    monthly_starts = starts_df.groupby('fecha')['id_exp'].nunique().reset_index(name='total_starts')
+
+    if hay_seleccion:
+        completed_procs = ids_completados
+        completed_starts = starts_df[
+            starts_df['id_exp'].isin(completed_procs)
+        ].groupby('fecha')['id_exp'].nunique().reset_index(name='completed')
+        merged = monthly_starts.merge(completed_starts, on='fecha', how='left')
+    else:
+        completed_procs = []
+        merged = monthly_starts.assign(completed=0)
+
+    # Inicios no completados agrupados por periodo, en su orden original dentro de cada uno
+    not_completed = starts_df[~starts_df['id_exp'].isin(completed_procs)].sort_values('fecha', kind='stable')
+    periods, counts = np.unique(not_completed['fecha'].to_numpy(), return_counts=True)
+    offsets = np.zeros(len(periods) + 1, dtype='int64')
+    np.cumsum(counts, out=offsets[1:])
+    period_index = {'periods': periods, 'offsets': offsets, 'positions': not_completed['position'].to_numpy()}
+
+    return merged.fillna(0), period_index
+
+
+def period_rows(period_index, period):
+    """Tramo [start, stop) del periodo en el índice (vacío si el periodo no tiene filas)"""
+    i = np.searchsorted(period_index['periods'], np.datetime64(period, 'ns'))
+    if i == len(period_index['periods']) or period_index['periods'][i] != np.datetime64(period, 'ns'):
+        return 0, 0
+    return period_index['offsets'][i], period_index['offsets'][i + 1]
+
+
+def build_state_sequences(tramites_df, id_exps, nombres_estados):
+    """Texto 'Secuencia' "(AAAA-MM-DD) Estado → ..." solo de los expedientes indicados"""
+    tramites_exp = tramites_df[tramites_df['id_exp'].isin(id_exps)].sort_values(
+        ['id_exp', 'num_tramite'], kind='stable'
+    )
+    estado = tramites_exp['num_tramite'].map(nombres_estados).astype(object)
+    estado = estado.fillna(tramites_exp['num_tramite'].astype(str))
+    pasos = '(' + tramites_exp['fecha_tramite'].dt.strftime('%Y-%m-%d') + ') ' + estado.astype(str)
+    return pasos.groupby(tramites_exp['id_exp'], sort=False).agg(' → '.join).reset_index(name='Secuencia')
+
+
+def get_not_completed_expedientes(tramites_df, expedientes, period_index, period, page, rows_per_page,
+                                  nombres_estados):
+    """Página 'page' (de rows_per_page filas) de los expedientes no completados iniciados en el periodo"""
+    start, stop = period_rows(period_index, period)
+    start = min(start + page * rows_per_page, stop)
+    positions = period_index['positions'][start:min(start + rows_per_page, stop)]
+    not_completed = tramites_df.iloc[positions].copy()
+    not_completed['fecha'] = period
+    not_completed_expedientes = not_completed.merge(expedientes, on='id_exp', how='left')
+
+    not_completed_expedientes = not_completed_expedientes[['fecha', 'id_exp', 'unidad_tramitadora', 'fecha_registro_exp',
+                                                           'municipio_x', 'provincia_x', 'es_online_x', 'es_empresa_x']]
+    not_completed_expedientes['fecha_registro_exp'] = pd.to_datetime(
+        not_completed_expedientes['fecha_registro_exp']
+    ).dt.strftime('%Y-%m-%d')
+
+    # Secuencias de estados solo de los expedientes de esta página
+    state_sequences = build_state_sequences(tramites_df, not_completed_expedientes['id_exp'].unique(), nombres_estados)
+    not_completed_expedientes = not_completed_expedientes.merge(state_sequences, on='id_exp', how='left')
+
+    return not_completed_expedientes.rename(columns={
+        'id_exp': 'ID Expediente',
+        'unidad_tramitadora': 'Unidad Tramitadora',
+        'fecha_registro_exp': 'Fecha Registro',
+        'municipio_x': 'Municipio',
+        'provincia_x': 'Provincia',
+        'es_online_x': 'Online',
+        'es_empresa_x': 'Empresa'
+    })
+
+
+def process_tramites_data(cubo_tramitacion, estados_finales_selecc, freq, nombres_estados):
+    """Trámites por periodo, estado y unidad de los expedientes que pasan por los estados finales"""
+    grouped = evolucion_tramites(cubo_tramitacion, mascara_firmas(cubo_tramitacion, estados_finales_selecc), freq)
+    grouped['estado'] = grouped['num_tramite'].map(nombres_estados)
+    return grouped
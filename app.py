@@ -9,6 +9,12 @@ import streamlit as st
 import pandas as pd
 import datetime
 
+from carga_datos import FECHA_MINIMA, carga_datos_base, filtra_datos_fechas
+from claves_cache import huella_seleccion
+from filtro_estados import mascara_indice, clave_mascara
+from registro_datos import registro, id_sesion
+from instrumentacion import ACTIVA as INSTRUMENTACION_ACTIVA, cache_data, registro_medido
+
 # 1. Set page configuration as early as possible
 st.set_page_config(
     page_title="Análisis de proceso",
@@ -28,9 +34,15 @@ if 'proced_seleccionado' not in st.session_state:
     st.session_state.proced_seleccionado = None
 if 'estados' not in st.session_state:
     st.session_state.estados = None
+if 'mascara_estados' not in st.session_state:
+    st.session_state.mascara_estados = None
+if 'clave_mascara_estados' not in st.session_state:
+    st.session_state.clave_mascara_estados = None
+if 'huella_seleccion' not in st.session_state:
+    st.session_state.huella_seleccion = None
 
 # 3. Cache functions for loading and filtering data
-@st.cache_data
+@cache_data
 def carga_codigos_procedimientos():
     df = pd.read_csv(
         "data/codigos_procedimientos.csv",
@@ -40,99 +52,6 @@ def carga_codigos_procedimientos():
     # Convert the DataFrame into a dictionary mapping code -> description
     return df.set_index("codigo_procedimiento")["descripcion"].to_dict()
 
-FECHA_MINIMA = pd.Timestamp("2015-01-01")
-
-@st.cache_data(show_spinner="Cargando datos de procedimiento")
-def carga_datos_base(codigo):
-    base_path = f"data/tratados/{codigo}"
-    
-    # EXPEDIENTES
-    #############
-    # Lista de columnas a cargar (incluyendo 'nif' para 'es_empresa')
-    columnas_expedientes = [
-        'id_exp',
-        'fecha_registro_exp',
-        'codine_provincia',
-        'codine',
-        'municipio',
-        'provincia',
-        'es_telematica',
-        'nif'        
-    ]
-
-    expedientes = pd.read_parquet(
-        f"{base_path}/expedientes.parquet",
-        columns=columnas_expedientes  # Filtrado de columnas
-    )
-    
-    # Creación de nuevas columnas
-    expedientes['es_online'] = expedientes['es_telematica'].fillna(False)
-    expedientes['es_empresa'] = expedientes['nif'].notnull()
-    # Eliminar 'nif' del DataFrame
-    expedientes = expedientes.drop(columns=['nif','es_telematica'])
-    
-    # 1. Filtrar expedientes con fecha_registro_exp > fecha_minima
-    expedientes = expedientes[expedientes['fecha_registro_exp'] > FECHA_MINIMA].copy()
-    
-    
-    # TRAMITES
-    ###########
-    columnas_tramites = [
-        'id_exp',
-        'es_telematica',
-        'nif',
-        'unidad_tramitadora',
-        'denominacion',
-        'descripcion',
-        'consejeria',
-        'org_instructor',
-        'municipio',
-        'provincia',
-        'fecha_tramite',
-        'num_tramite' 
-    ]   
-    tramites = pd.read_parquet(
-        f"{base_path}/tramites.parquet",
-        columns=columnas_tramites  # Filtrado de columnas
-    )
-    
-    # Creación de nuevas columnas
-    tramites['es_online'] = tramites['es_telematica'].fillna(False)
-    tramites['es_empresa'] = tramites['nif'].notnull()  
-    # Eliminar 'nif' del DataFrame
-    tramites = tramites.drop(columns=['nif','es_telematica'])
-    
-    # 2. Quedarse solo con tramites de los expedientes filtrados
-    tramites = tramites[tramites['id_exp'].isin(expedientes['id_exp'])].copy()
-    
-    # 3. Identificar expedientes que tengan algún tramite con fecha_tramite < fecha_minima
-    expedientes_a_eliminar = tramites.loc[tramites['fecha_tramite'] < FECHA_MINIMA, 'id_exp'].unique()
-    
-    # 4. Eliminar de ambos DataFrames los expedientes identificados
-    expedientes = expedientes[~expedientes['id_exp'].isin(expedientes_a_eliminar)].copy()
-    tramites = tramites[~tramites['id_exp'].isin(expedientes_a_eliminar)].copy()
-    
-    
-    return {
-        'expedientes': expedientes,
-        'tramites': tramites,
-        'estados': pd.read_csv(f"{base_path}/estados_finales.csv", sep=";", encoding='utf-8')
-    }
-
-@st.cache_data(show_spinner="Filtrando datos para el rango de fechas seleccionado")
-def filtra_datos_fechas(_expedientes, _tramites, rango_fechas):
-    start_date, end_date = rango_fechas
-    mask = (
-        (_expedientes['fecha_registro_exp'].dt.date >= start_date) &
-        (_expedientes['fecha_registro_exp'].dt.date <= end_date)
-    )
-    filtered_exp = _expedientes[mask].copy()
-    expediente_ids = filtered_exp['id_exp'].unique()
-    return {
-        'expedientes': filtered_exp,
-        'tramites': _tramites[_tramites['id_exp'].isin(expediente_ids)]
-    }
-
 # 4. Sidebar: Group all interactive controls
 with st.sidebar:
     
@@ -162,23 +81,15 @@ with st.sidebar:
     # Map the selected description back to its code
     selected_codigo = [k for k, v in processes.items() if v == selected_desc][0]
 
-    # Load data for the selected procedure
-    datos_base = carga_datos_base(selected_codigo)
+    # Load data for the selected procedure (shared with other sessions through the registry)
+    with st.spinner("Cargando datos de procedimiento"):
+        datos_base = registro_medido(registro().adquiere, selected_codigo, id_sesion(), carga_datos_base)
 
-    # Store estados in session state
+    # Store estados and procedure texts in session state
     st.session_state.estados = datos_base['estados'] 
-
-    # Check if the stored texts do not exist or the selected procedure has changed.
-    if ("textos_procedimiento" not in st.session_state) or (st.session_state.get("proced_seleccionado") != selected_codigo):
-        # Extract the values (assuming all rows have the same values, so we take the first row)
-        textos_procedimiento = datos_base["tramites"][["denominacion", "descripcion", "consejeria", "org_instructor"]].iloc[0].to_dict()
-        # Store them in session state for reuse on other pages
-        st.session_state.textos_procedimiento = textos_procedimiento
-    
-    # Remove these columns from the 'tramites' DataFrame to save memory
-    datos_base["tramites"] = datos_base["tramites"].drop(columns=["denominacion", "descripcion", "consejeria", "org_instructor"])
+    st.session_state.textos_procedimiento = datos_base['textos_procedimiento']
     
-    # In main page after loading datos_base:
+    # In main page after loading datos_base (a reference, not a copy):
     st.session_state.datos_base = datos_base
     
     
@@ -219,12 +130,19 @@ with st.sidebar:
 
     # Update session state with new values
     ######################################
-    st.session_state.datos_filtrados_rango = filtra_datos_fechas(
-        datos_base['expedientes'],
-        datos_base['tramites'],
-        rango_fechas
-    )
+    with st.spinner("Filtrando datos para el rango de fechas seleccionado"):
+        st.session_state.datos_filtrados_rango = registro_medido(
+            registro().rango, selected_codigo, datos_base, rango_fechas, filtra_datos_fechas
+        )
     st.session_state.estados_finales_selecc = estados_finales_selecc
+    # Máscara de expedientes que alcanzan los estados seleccionados (alineada con 'secuencias')
+    # y su hash, que las páginas usan como clave de caché en lugar de la lista de estados
+    mascara_estados = mascara_indice(st.session_state.datos_filtrados_rango['indice_estados'], estados_finales_selecc)
+    st.session_state.mascara_estados = mascara_estados
+    st.session_state.clave_mascara_estados = clave_mascara(mascara_estados)
+    st.session_state.huella_seleccion = huella_seleccion(
+        st.session_state.datos_filtrados_rango['huella'], st.session_state.clave_mascara_estados
+    )
 
 
 
@@ -240,8 +158,15 @@ temporal_demanda = st.Page("temporal_demanda.py", title="Evolucion demanda", ico
 temporal_tramitacion = st.Page("temporal_tramitacion.py", title="Evolución tramitación", icon="🗓️")
 temporal_acumulado = st.Page("temporal_acumulado.py",  title="Carga de trabajo acumulada", icon="🛠️")
 
-nav = st.navigation({
+paginas = {
     "Análisis estático": [datos_basicos, flujo, estados, geografico],
     "Análisis dinámico": [temporal_demanda,temporal_tramitacion,  temporal_acumulado],
-})
+}
+# Hidden page (only by URL, /rendimiento) with the timings of instrumentacion.py
+if INSTRUMENTACION_ACTIVA:
+    paginas["Análisis dinámico"].append(
+        st.Page("rendimiento.py", title="Rendimiento", icon="⏱️", url_path="rendimiento", visibility="hidden")
+    )
+
+nav = st.navigation(paginas)
 nav.run()
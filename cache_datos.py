@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Caché en disco de los datos base ya limpios de cada procedimiento.
+
+carga_datos_base (carga_datos.py) guarda en data/cache/<codigo> los expedientes y trámites
+tras el filtrado por FECHA_MINIMA, ordenados por fecha de registro del expediente y
+con tipos compactos (id_exp int32, num_tramite int16, textos como categorías). La clave de la caché es la fecha de modificación y
+el tamaño de los ficheros fuente, así que cualquier cambio en ellos la invalida y
+en el siguiente arranque se vuelve a limpiar.
+"""
+import json
+import os
+
+import pandas as pd
+
+RUTA_CACHE = "data/cache"
+VERSION_CACHE = 2
+
+# Tipos compactos de las columnas de expedientes y trámites
+TIPOS_COLUMNAS = {
+    'id_exp': 'int32',
+    'num_tramite': 'int16',
+    'es_online': 'bool',
+    'es_empresa': 'bool',
+    'codine_provincia': 'category',
+    'codine': 'category',
+    'municipio': 'category',
+    'provincia': 'category',
+    'unidad_tramitadora': 'category',
+    'denominacion': 'category',
+    'descripcion': 'category',
+    'consejeria': 'category',
+    'org_instructor': 'category'
+}
+
+
+def optimiza_tipos(df):
+    """Convierte las columnas conocidas a sus tipos compactos"""
+    tipos = {col: tipo for col, tipo in TIPOS_COLUMNAS.items() if col in df.columns}
+    return df.astype(tipos)
+
+
+def _clave(fuentes, parametros):
+    clave = {'version': VERSION_CACHE, 'parametros': parametros, 'fuentes': {}}
+    for ruta in fuentes:
+        estado = os.stat(ruta)
+        clave['fuentes'][ruta] = [estado.st_mtime_ns, estado.st_size]
+    return clave
+
+
+def clave_fuentes(fuentes, parametros):
+    """Clave (fecha de modificación y tamaño de las fuentes, parámetros) que identifica unos datos limpios"""
+    return _clave(fuentes, parametros)
+
+
+def lee_cache(codigo, fuentes, parametros):
+    """Devuelve {nombre: DataFrame} si la caché del procedimiento está al día, si no None"""
+    ruta = f"{RUTA_CACHE}/{codigo}"
+    try:
+        with open(f"{ruta}/clave.json", encoding='utf-8') as f:
+            clave_guardada = json.load(f)
+        tablas = clave_guardada.pop('tablas')
+        if clave_guardada != _clave(fuentes, parametros):
+            return None
+        return {
+            nombre: pd.read_parquet(f"{ruta}/{nombre}.parquet")
+            for nombre in tablas
+        }
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def guarda_cache(codigo, fuentes, parametros, tablas):
+    """Guarda las tablas limpias de un procedimiento; si no se puede escribir se ignora"""
+    ruta = f"{RUTA_CACHE}/{codigo}"
+    clave = _clave(fuentes, parametros)
+    clave['tablas'] = list(tablas)
+    try:
+        os.makedirs(ruta, exist_ok=True)
+        for nombre, df in tablas.items():
+            df.to_parquet(f"{ruta}/{nombre}.parquet", index=False)
+        # La clave se escribe al final: si algo falla antes, la caché queda inválida
+        with open(f"{ruta}/clave.json", "w", encoding='utf-8') as f:
+            json.dump(clave, f)
+    except OSError:
+        pass
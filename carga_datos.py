@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+Carga de los datos de un procedimiento, sin streamlit.
+
+- carga_datos_base(codigo): expedientes y trámites limpios (desde la caché en disco,
+  cache_datos.py, si las fuentes no han cambiado), almacén de secuencias, índice de
+  estados, textos del procedimiento, estados finales y huella de contenido. Con
+  rango_fechas solo se leen los expedientes registrados en el rango y sus trámites.
+  Los filtros de fechas se resuelven en el lector de parquet (filtros_expedientes):
+  con ficheros ordenados (particiones.py) no se leen los grupos de filas ni las
+  particiones mensuales fuera del rango.
+  prepara_datos_base hace lo mismo con datos ya en memoria (p. ej. datos sintéticos).
+- filtra_datos_fechas(datos_base, rango_fechas): tramo de un rango de fechas, sin copias.
+
+En la aplicación los datos base y sus filtrados se comparten entre sesiones a través
+del registro (registro_datos.py): son de solo lectura y no se copian a cada sesión.
+Fuera de ella (análisis en lote, pruebas de rendimiento) se usan directamente con las
+funciones de analitica.py.
+"""
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from cache_datos import lee_cache, guarda_cache, optimiza_tipos, clave_fuentes
+from claves_cache import huella_datos_base, huella_rango
+from particiones import ficheros, lee_tabla
+from secuencias import carga_secuencias, secuencias_en_memoria, ordena_secuencias, corta_secuencias
+from filtro_estados import construye_indice_estados, corta_indice_estados
+
+FECHA_MINIMA = pd.Timestamp("2015-01-01")
+
+# Columnas a cargar (incluyendo 'nif' para 'es_empresa')
+COLUMNAS_EXPEDIENTES = [
+    'id_exp',
+    'fecha_registro_exp',
+    'codine_provincia',
+    'codine',
+    'municipio',
+    'provincia',
+    'es_telematica',
+    'nif'
+]
+
+COLUMNAS_TRAMITES = [
+    'id_exp',
+    'es_telematica',
+    'nif',
+    'unidad_tramitadora',
+    'denominacion',
+    'descripcion',
+    'consejeria',
+    'org_instructor',
+    'municipio',
+    'provincia',
+    'fecha_tramite',
+    'num_tramite'
+]
+
+def filtros_expedientes(rango_fechas=None):
+    """Filtros de lee_tabla de los expedientes: posteriores a FECHA_MINIMA y, opcionalmente, en el rango (días completos)"""
+    filtros = [('fecha_registro_exp', '>', FECHA_MINIMA)]
+    if rango_fechas is not None:
+        start_date, end_date = rango_fechas
+        filtros += [
+            ('fecha_registro_exp', '>=', pd.Timestamp(start_date)),
+            ('fecha_registro_exp', '<', pd.Timestamp(end_date) + pd.Timedelta(days=1))
+        ]
+    return filtros
+
+def filtros_tramites(id_exps):
+    """Filtros de lee_tabla de los trámites de unos expedientes"""
+    id_exps = pd.unique(np.asarray(id_exps))
+    filtros = [('id_exp', 'in', id_exps)]
+    if len(id_exps):
+        # Arrow solo descarta grupos de filas con 'in' si hay pocos valores: el intervalo
+        # de id_exp permite descartarlos siempre
+        filtros = [('id_exp', '>=', id_exps.min()), ('id_exp', '<=', id_exps.max())] + filtros
+    return filtros
+
+def limpia_datos_base(ficheros_expedientes, ficheros_tramites, rango_fechas=None):
+    # EXPEDIENTES
+    #############
+    # 1. Expedientes con fecha_registro_exp > fecha_minima (y en el rango), filtrados al leer
+    expedientes = lee_tabla(
+        ficheros_expedientes,
+        columns=COLUMNAS_EXPEDIENTES,  # Filtrado de columnas
+        filters=filtros_expedientes(rango_fechas)
+    )
+    
+    # Creación de nuevas columnas
+    expedientes['es_online'] = expedientes['es_telematica'].fillna(False)
+    expedientes['es_empresa'] = expedientes['nif'].notnull()
+    # Eliminar 'nif' del DataFrame
+    expedientes = expedientes.drop(columns=['nif','es_telematica'])
+    
+    
+    # TRAMITES
+    ###########
+    # 2. Solo los trámites de los expedientes filtrados, también al leer. La fecha del
+    # trámite no sirve de filtro: hay trámites anteriores al registro del expediente y
+    # la regla de FECHA_MINIMA (paso 3) elimina expedientes completos
+    tramites = lee_tabla(
+        ficheros_tramites,
+        columns=COLUMNAS_TRAMITES,  # Filtrado de columnas
+        filters=filtros_tramites(expedientes['id_exp'])
+    )
+    
+    # Creación de nuevas columnas
+    tramites['es_online'] = tramites['es_telematica'].fillna(False)
+    tramites['es_empresa'] = tramites['nif'].notnull()  
+    # Eliminar 'nif' del DataFrame
+    tramites = tramites.drop(columns=['nif','es_telematica'])
+    
+    # La unidad sin especificar se etiqueta aquí para que sea una categoría más
+    tramites['unidad_tramitadora'] = tramites['unidad_tramitadora'].fillna('No especificada')
+    
+    # 3. Identificar expedientes que tengan algún tramite con fecha_tramite < fecha_minima
+    expedientes_a_eliminar = tramites.loc[tramites['fecha_tramite'] < FECHA_MINIMA, 'id_exp'].unique()
+    
+    # 4. Eliminar de ambos DataFrames los expedientes identificados
+    expedientes = expedientes[~expedientes['id_exp'].isin(expedientes_a_eliminar)].copy()
+    tramites = tramites[~tramites['id_exp'].isin(expedientes_a_eliminar)].copy()
+    
+    # 5. Expedientes ordenados por fecha de registro y trámites agrupados por expediente en ese
+    # mismo orden: cualquier rango de fechas es un tramo contiguo de ambas tablas
+    expedientes, tramites = ordena_por_registro(expedientes, tramites)
+    
+    # 6. Tipos compactos (enteros pequeños y textos como categorías)
+    return {
+        'expedientes': optimiza_tipos(expedientes),
+        'tramites': optimiza_tipos(tramites)
+    }
+
+def ordena_por_registro(expedientes, tramites):
+    """Expedientes por fecha de registro y trámites agrupados por expediente en ese orden"""
+    expedientes = expedientes.sort_values('fecha_registro_exp', kind='stable').reset_index(drop=True)
+    posicion_exp = pd.Index(expedientes['id_exp']).get_indexer(tramites['id_exp'])
+    tramites = tramites.iloc[np.argsort(posicion_exp, kind='stable')].reset_index(drop=True)
+    return expedientes, tramites
+
+def carga_datos_limpios(codigo, rango_fechas=None):
+    """
+    Expedientes y trámites limpios de un procedimiento y la clave de sus ficheros fuente.
+    Con rango_fechas solo los registrados en el rango (ver carga_datos_base).
+    """
+    ficheros_expedientes = ficheros(codigo, 'expedientes', rango_fechas)
+    ficheros_tramites = ficheros(codigo, 'tramites', rango_fechas)
+    fuentes = ficheros_expedientes + ficheros_tramites
+    parametros = {'fecha_minima': str(FECHA_MINIMA)}
+    if rango_fechas is not None:
+        # La caché en disco es de las tablas completas: las lecturas parciales no la usan
+        parametros['rango_fechas'] = [str(fecha) for fecha in rango_fechas]
+        return (limpia_datos_base(ficheros_expedientes, ficheros_tramites, rango_fechas),
+                clave_fuentes(fuentes, parametros))
+    
+    # Datos limpios desde la caché en disco si los ficheros fuente no han cambiado
+    datos_limpios = lee_cache(codigo, fuentes, parametros)
+    if datos_limpios is None:
+        datos_limpios = limpia_datos_base(ficheros_expedientes, ficheros_tramites)
+        guarda_cache(codigo, fuentes, parametros, datos_limpios)
+    return datos_limpios, clave_fuentes(fuentes, parametros)
+
+def carga_datos_base(codigo, rango_fechas=None):
+    """
+    Datos base de un procedimiento. Con rango_fechas (inicio, fin) solo se leen los
+    expedientes registrados en el rango y sus trámites (de las particiones mensuales que
+    lo solapan, si las hay, y de los grupos de filas que pueden contenerlos) y las
+    secuencias se construyen en memoria.
+    """
+    datos_limpios, clave = carga_datos_limpios(codigo, rango_fechas)
+    return prepara_datos_base(
+        datos_limpios['expedientes'],
+        datos_limpios['tramites'],
+        carga_secuencias(codigo) if rango_fechas is None else secuencias_en_memoria(datos_limpios['tramites']),
+        pd.read_csv(f"data/tratados/{codigo}/estados_finales.csv", sep=";", encoding='utf-8'),
+        # Huella del contenido para las claves de caché de las páginas (claves_cache.py)
+        huella_datos_base(codigo, clave)
+    )
+
+def prepara_datos_base(expedientes, tramites, secuencias, estados, huella):
+    """
+    Datos base a partir de los datos limpios (ordenados con ordena_por_registro), el
+    almacén de secuencias en cualquier orden y la tabla de estados finales
+    """
+    # Inicio de los trámites de cada expediente (los trámites vienen agrupados por
+    # expediente en el orden de fecha de registro, ver limpia_datos_base)
+    posicion_exp = pd.Index(expedientes['id_exp']).get_indexer(tramites['id_exp'])
+    offsets_tramites = np.searchsorted(posicion_exp, np.arange(len(expedientes) + 1))
+    
+    # SECUENCIAS
+    #############
+    # Secuencias de estados y duraciones por expediente (secuencias.py), en el mismo
+    # orden que los expedientes
+    secuencias, con_secuencia = ordena_secuencias(secuencias, expedientes['id_exp'])
+    # Posición en el almacén del primer expediente con secuencia desde cada expediente
+    offsets_secuencias = np.zeros(len(expedientes) + 1, dtype='int64')
+    np.cumsum(con_secuencia, out=offsets_secuencias[1:])
+    # Índice NUMTRAM -> bitmap de expedientes para resolver al instante el filtro de estados finales
+    indice_estados = construye_indice_estados(secuencias)
+    
+    # Textos del procedimiento (iguales en todas las filas): se guardan aparte y se
+    # eliminan de 'tramites' para ahorrar memoria
+    columnas_textos = ["denominacion", "descripcion", "consejeria", "org_instructor"]
+    textos_procedimiento = (tramites[columnas_textos].iloc[0].to_dict() if len(tramites)
+                            else dict.fromkeys(columnas_textos))
+    
+    return {
+        'expedientes': expedientes,
+        'tramites': tramites.drop(columns=columnas_textos),
+        'textos_procedimiento': textos_procedimiento,
+        'secuencias': secuencias,
+        'indice_estados': indice_estados,
+        'offsets_tramites': offsets_tramites,
+        'offsets_secuencias': offsets_secuencias,
+        'huella': huella,
+        'estados': estados
+    }
+
+def filtra_datos_fechas(datos_base, rango_fechas):
+    # Los expedientes están ordenados por fecha de registro: el rango [start_date, end_date]
+    # (días completos) se resuelve con dos búsquedas binarias en un tramo [inicio, fin)
+    start_date, end_date = rango_fechas
+    fechas = datos_base['expedientes']['fecha_registro_exp'].to_numpy()
+    limites = np.array([start_date, end_date + datetime.timedelta(days=1)], dtype='datetime64[D]').astype(fechas.dtype)
+    inicio, fin = np.searchsorted(fechas, limites, side='left')
+    
+    # Los trámites y el almacén de secuencias siguen el mismo orden, así que sus tramos
+    # también son contiguos
+    offsets_tramites = datos_base['offsets_tramites']
+    inicio_sec, fin_sec = datos_base['offsets_secuencias'][[inicio, fin]]
+    return {
+        'expedientes': datos_base['expedientes'].iloc[inicio:fin],
+        'tramites': datos_base['tramites'].iloc[offsets_tramites[inicio]:offsets_tramites[fin]],
+        'secuencias': corta_secuencias(datos_base['secuencias'], inicio_sec, fin_sec),
+        'indice_estados': corta_indice_estados(datos_base['indice_estados'], inicio_sec, fin_sec),
+        'huella': huella_rango(datos_base['huella'], inicio, fin)
+    }
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Carga de trabajo acumulada: expedientes que hay en cada estado, por día y unidad.
+
+Se calcula a partir del registro de trámites. Cada trámite es una entrada (+1) en
+su estado el día del trámite y, si el expediente tenía un trámite anterior, una
+salida (-1) del estado anterior ese mismo día. El último estado de cada expediente
+queda abierto. La carga de cada día es la suma acumulada de los deltas por
+(unidad, estado): los expedientes que siguen en cada estado al final del día, sin
+contar los que salen de él ese mismo día.
+
+El resultado es un dict con:
+- 'fechas': días consecutivos (datetime64[D]).
+- 'unidades' y 'estados': etiquetas de los ejes.
+- 'deltas' y 'carga': arrays int32 con forma (días, unidades, estados).
+- 'abiertos': DataFrame indexado por id_exp con el último trámite de cada expediente.
+
+Con 'abiertos' se pueden añadir trámites nuevos (anade_tramites) sin recalcular el
+histórico: solo se acumulan de nuevo los días desde el primer día afectado.
+
+tabla_acumulado y tabla_acumulado_semanal generan las tablas de
+data/tratados/<codigo>/tramites_acumulado*.parquet (construccion.py).
+"""
+import numpy as np
+import pandas as pd
+
+UNIDAD_NO_ESPECIFICADA = 'No especificada'
+
+
+def acumulado_vacio():
+    return {
+        'fechas': np.array([], dtype='datetime64[D]'),
+        'unidades': np.array([], dtype=object),
+        'estados': np.array([], dtype='int16'),
+        'deltas': np.zeros((0, 0, 0), dtype='int32'),
+        'carga': np.zeros((0, 0, 0), dtype='int32'),
+        'abiertos': pd.DataFrame(
+            {'dia': np.array([], dtype='datetime64[D]'), 'num_tramite': np.array([], dtype='int16'),
+             'unidad_tramitadora': np.array([], dtype=object)},
+            index=pd.Index([], name='id_exp')
+        )
+    }
+
+
+def construye_acumulado(tramites):
+    """Carga acumulada de un registro de trámites completo"""
+    return anade_tramites(acumulado_vacio(), tramites)
+
+
+def _eje(actual, nuevos):
+    """Eje ampliado con las etiquetas nuevas (al final) y posición de cada etiqueta nueva"""
+    nuevas = pd.Index(pd.unique(nuevos)).difference(pd.Index(actual), sort=False)
+    eje = np.concatenate([np.asarray(actual), np.asarray(nuevas, dtype=np.asarray(actual).dtype)])
+    return eje, pd.Index(eje).get_indexer(nuevos)
+
+
+def anade_tramites(acumulado, tramites):
+    """
+    Devuelve un acumulado nuevo con los trámites añadidos. Los trámites de un expediente
+    ya abierto deben ser posteriores (o del mismo día) a su último trámite registrado.
+    """
+    tramites = tramites[['id_exp', 'fecha_tramite', 'num_tramite', 'unidad_tramitadora']].sort_values(
+        ['id_exp', 'fecha_tramite'], kind='stable'
+    )
+    if tramites.empty:
+        return acumulado
+    ids = tramites['id_exp'].to_numpy()
+    dias = tramites['fecha_tramite'].to_numpy().astype('datetime64[D]')
+    estados = tramites['num_tramite'].to_numpy().astype('int16')
+    unidades = tramites['unidad_tramitadora'].astype(object).fillna(UNIDAD_NO_ESPECIFICADA).to_numpy()
+
+    # Trámite anterior de cada fila: la fila previa del mismo expediente o, para la
+    # primera fila de un expediente ya abierto, su último trámite registrado
+    es_inicio = np.ones(len(ids), dtype=bool)
+    es_inicio[1:] = ids[1:] != ids[:-1]
+    estado_prev = np.empty(len(ids), dtype='int16')
+    unidad_prev = np.empty(len(ids), dtype=object)
+    estado_prev[1:], unidad_prev[1:] = estados[:-1], unidades[:-1]
+    tiene_prev = ~es_inicio
+
+    abiertos = acumulado['abiertos']
+    inicios = np.flatnonzero(es_inicio)
+    previos = abiertos.reindex(ids[inicios])
+    con_abierto = previos['num_tramite'].notna().to_numpy()
+    if (previos['dia'].to_numpy()[con_abierto] > dias[inicios][con_abierto]).any():
+        raise ValueError("Solo se pueden añadir trámites posteriores al último trámite de cada expediente")
+    filas_abiertas = inicios[con_abierto]
+    estado_prev[filas_abiertas] = previos['num_tramite'].to_numpy()[con_abierto]
+    unidad_prev[filas_abiertas] = previos['unidad_tramitadora'].to_numpy()[con_abierto]
+    tiene_prev[filas_abiertas] = True
+
+    # Ejes ampliados con los días, unidades y estados nuevos
+    dia_min = dias.min() if not len(acumulado['fechas']) else min(dias.min(), acumulado['fechas'][0])
+    dia_max = dias.max() if not len(acumulado['fechas']) else max(dias.max(), acumulado['fechas'][-1])
+    fechas = np.arange(dia_min, dia_max + 1, dtype='datetime64[D]')
+    eje_unidades, pos_unidad = _eje(acumulado['unidades'], np.concatenate([unidades, unidad_prev[tiene_prev]]))
+    eje_estados, pos_estado = _eje(acumulado['estados'], np.concatenate([estados, estado_prev[tiene_prev]]))
+
+    # Deltas existentes colocados en los ejes ampliados
+    forma = (len(fechas), len(eje_unidades), len(eje_estados))
+    deltas = np.zeros(forma, dtype='int32')
+    n_dias, n_unidades, n_estados = acumulado['deltas'].shape
+    desplazamiento = int((acumulado['fechas'][0] - dia_min).astype(int)) if n_dias else 0
+    deltas[desplazamiento:desplazamiento + n_dias, :n_unidades, :n_estados] = acumulado['deltas']
+
+    # Entradas (+1) y salidas (-1) de los trámites nuevos
+    pos_dia = (np.concatenate([dias, dias[tiene_prev]]) - dia_min).astype(int)
+    valor = np.concatenate([np.ones(len(dias), dtype='int32'), -np.ones(tiene_prev.sum(), dtype='int32')])
+    np.add.at(deltas, (pos_dia, pos_unidad, pos_estado), valor)
+
+    # Solo se vuelve a acumular desde el primer día afectado
+    carga = np.zeros(forma, dtype='int32')
+    carga[desplazamiento:desplazamiento + n_dias, :n_unidades, :n_estados] = acumulado['carga']
+    if n_dias:
+        carga[desplazamiento + n_dias:] = carga[desplazamiento + n_dias - 1]
+    primero = int(pos_dia.min())
+    base = carga[primero - 1] if primero > 0 else 0
+    carga[primero:] = base + np.cumsum(deltas[primero:], axis=0, dtype='int32')
+
+    # Último trámite de cada expediente
+    ultimos = np.append(inicios[1:] - 1, len(ids) - 1)
+    nuevos_abiertos = pd.DataFrame(
+        {'dia': dias[ultimos], 'num_tramite': estados[ultimos], 'unidad_tramitadora': unidades[ultimos]},
+        index=pd.Index(ids[ultimos], name='id_exp')
+    )
+    abiertos = pd.concat([abiertos[~abiertos.index.isin(ids[ultimos])], nuevos_abiertos])
+
+    return {
+        'fechas': fechas,
+        'unidades': eje_unidades,
+        'estados': eje_estados,
+        'deltas': deltas,
+        'carga': carga,
+        'abiertos': abiertos
+    }
+
+
+def _tramo(fechas, inicio, fin):
+    """Posiciones [desde, hasta) de los días entre inicio y fin (incluidos), por búsqueda binaria"""
+    desde = 0 if inicio is None else np.searchsorted(fechas, np.datetime64(inicio, 'D'), side='left')
+    hasta = len(fechas) if fin is None else np.searchsorted(fechas, np.datetime64(fin, 'D'), side='right')
+    return desde, hasta
+
+
+def tabla_carga(acumulado, inicio=None, fin=None, unidad=None):
+    """
+    Carga diaria entre inicio y fin (incluidos) como DataFrame con 'fecha_tramite' y una
+    columna por estado (nombre = str(num_tramite)). Suma todas las unidades salvo que se
+    indique una.
+    """
+    desde, hasta = _tramo(acumulado['fechas'], inicio, fin)
+    carga = acumulado['carga'][desde:hasta]
+    if unidad is None:
+        carga = carga.sum(axis=1)
+    else:
+        carga = carga[:, list(acumulado['unidades']).index(unidad), :]
+    orden = np.argsort(acumulado['estados'], kind='stable')
+    df = pd.DataFrame(carga[:, orden], columns=[str(e) for e in acumulado['estados'][orden]])
+    df.insert(0, 'fecha_tramite', acumulado['fechas'][desde:hasta].astype('datetime64[ns]'))
+    return df
+
+
+def unidades_con_carga(acumulado, inicio=None, fin=None):
+    """Unidades con algún expediente abierto entre inicio y fin"""
+    desde, hasta = _tramo(acumulado['fechas'], inicio, fin)
+    con_carga = acumulado['carga'][desde:hasta].any(axis=(0, 2))
+    return sorted(acumulado['unidades'][con_carga])
+
+
+def tabla_acumulado(tramites):
+    """
+    Tabla de tramites_acumulado.parquet: por día y unidad, expedientes que han estado en
+    cada estado en algún momento del día (la carga al final del día más las salidas de ese
+    día), con una columna por estado. Solo los (día, unidad) con algún expediente.
+    """
+    acumulado = construye_acumulado(tramites)
+    # Las salidas de cada día son las entradas menos los deltas
+    entradas = np.zeros(acumulado['deltas'].shape, dtype='int32')
+    if len(tramites):
+        dias = tramites['fecha_tramite'].to_numpy().astype('datetime64[D]')
+        unidades = tramites['unidad_tramitadora'].astype(object).fillna(UNIDAD_NO_ESPECIFICADA)
+        np.add.at(entradas, (
+            (dias - acumulado['fechas'][0]).astype(int),
+            pd.Index(acumulado['unidades']).get_indexer(unidades),
+            pd.Index(acumulado['estados']).get_indexer(tramites['num_tramite'].to_numpy().astype('int16'))
+        ), 1)
+    en_el_dia = acumulado['carga'] + entradas - acumulado['deltas']
+
+    # Filas por día y unidad (en orden alfabético) y columnas por estado (en orden numérico)
+    n_dias, n_unidades, n_estados = en_el_dia.shape
+    orden_unidades = np.argsort(acumulado['unidades'].astype(str), kind='stable')
+    orden_estados = np.argsort(acumulado['estados'], kind='stable')
+    valores = en_el_dia[:, orden_unidades][:, :, orden_estados].reshape(n_dias * n_unidades, n_estados)
+    df = pd.DataFrame(valores.astype('int64'), columns=[str(e) for e in acumulado['estados'][orden_estados]])
+    df.insert(0, 'unidad_tramitadora', pd.array(np.tile(acumulado['unidades'][orden_unidades], n_dias), dtype='string'))
+    df.insert(0, 'fecha_tramite', np.repeat(acumulado['fechas'].astype('datetime64[ns]'), n_unidades))
+    return df[valores.any(axis=1)].reset_index(drop=True)
+
+
+def tabla_acumulado_semanal(diario):
+    """Tabla de tramites_acumulado_semanal.parquet: último día con datos de cada semana (de lunes a domingo) y unidad"""
+    fechas = diario['fecha_tramite']
+    semana = fechas - pd.to_timedelta(fechas.dt.weekday, unit='D')
+    return (
+        diario.drop(columns='fecha_tramite')
+        .assign(semana=semana)
+        .groupby(['semana', 'unidad_tramitadora'], sort=True)
+        .last()
+        .reset_index()
+    )
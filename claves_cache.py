@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+Claves de caché de las funciones de las páginas.
+
+Las funciones cacheadas reciben los datos con parámetros '_' (que streamlit no hashea)
+y una huella de su contenido como clave, en lugar de parámetros que no usan
+(rango_fechas, proced_seleccionado) o de leer st.session_state dentro de la función:
+
+- huella de los datos base: código del procedimiento y estado de sus ficheros fuente
+  (carga_datos_base, carga_datos.py).
+- huella del rango: huella base + tramo [inicio, fin) de expedientes que resulta del
+  rango de fechas, así que dos rangos con los mismos expedientes comparten entradas.
+- huella de la selección: huella del rango + hash de la máscara de estados finales.
+
+Con la misma huella, el resultado es el mismo en cualquier página y sesión. Todas las
+entradas caducan a los TTL_CACHE segundos y cada función guarda como mucho
+MAX_ENTRADAS_CACHE resultados.
+"""
+import hashlib
+import json
+
+TTL_CACHE = 3600
+MAX_ENTRADAS_CACHE = 32
+
+
+def huella_datos_base(codigo, clave_fuentes):
+    """Huella de los datos base a partir de la clave de sus ficheros fuente (cache_datos.py)"""
+    contenido = json.dumps({'codigo': str(codigo), 'fuentes': clave_fuentes}, sort_keys=True)
+    return hashlib.sha1(contenido.encode()).hexdigest()
+
+
+def huella_rango(huella_base, inicio, fin):
+    """Huella del tramo [inicio, fin) de expedientes de unos datos base"""
+    return f"{huella_base}:{int(inicio)}:{int(fin)}"
+
+
+def huella_seleccion(huella_rango, clave_mascara_estados):
+    """Huella de un tramo junto con la selección de estados finales"""
+    return f"{huella_rango}:{clave_mascara_estados}"
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+Construcción de los ficheros derivados de cada procedimiento de data/tratados.
+
+Cada fichero derivado es la salida de un nodo de un grafo de dependencias (NODOS) cuyas
+entradas son los ficheros en bruto (expedientes.parquet, tramites.parquet, o sus
+particiones mensuales, particiones.py) o las salidas de otros nodos:
+
+    expedientes.parquet, tramites.parquet
+      -> datos_limpios       data/cache/<codigo>/{expedientes,tramites}.parquet (cache_datos.py)
+           -> acumulado          tramites_acumulado.parquet (carga_trabajo.py)
+                -> acumulado_semanal  tramites_acumulado_semanal.parquet
+    tramites.parquet
+      -> secuencias          secuencias.parquet, secuencias_pasos.parquet (secuencias.py)
+      -> estados_finales     estados_finales.csv, solo si falta (plantilla con FINAL = 0
+                             que se completa a mano; si existe no se toca)
+
+Un nodo se reconstruye si falta alguna salida o si han cambiado, desde la última
+construcción, el hash del contenido de sus entradas o de sus salidas o la versión del
+nodo. Las salidas solo se reescriben si su contenido cambia, así que los nodos que
+dependen de ellas no se reconstruyen sin necesidad. Los hashes se guardan en
+data/cache/construccion/<codigo>.json junto con la fecha de modificación y el tamaño de
+cada fichero, para no volver a leer los que no han cambiado.
+
+Cada procedimiento se construye en un proceso aparte (los más grandes primero):
+
+    python construccion.py                  # todos los procedimientos
+    python construccion.py 884 1033         # solo los indicados
+    python construccion.py --plan           # nodos pendientes (los que dependen de ellos se
+                                            # deciden al construir, según cambien sus salidas)
+    python construccion.py --forzar         # reconstruye todos los nodos
+    python construccion.py --procesos 4     # número de procesos (por defecto, uno por CPU)
+"""
+import argparse
+import concurrent.futures
+import graphlib
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+
+import pandas as pd
+
+from cache_datos import RUTA_CACHE, VERSION_CACHE
+from carga_datos import FECHA_MINIMA, carga_datos_limpios
+from carga_trabajo import tabla_acumulado, tabla_acumulado_semanal
+from particiones import ficheros, lee_tabla
+from secuencias import RUTA_TRATADOS, FICHERO_EXPEDIENTES, FICHERO_PASOS, construye_secuencias
+
+RUTA_MANIFIESTOS = f"{RUTA_CACHE}/construccion"
+BLOQUE_HASH = 1 << 20
+
+
+# CONSTRUCTORES
+###############
+# Reciben las rutas de entrada y de salida del nodo y devuelven {ruta de salida: DataFrame}
+# con las tablas a escribir (las que escriben ellos mismos no se devuelven)
+
+def _construye_datos_limpios(codigo, entradas, salidas):
+    # carga_datos_limpios guarda la caché en disco si no está al día
+    carga_datos_limpios(codigo)
+    return {}
+
+
+def _construye_secuencias(codigo, entradas, salidas):
+    tramites = lee_tabla(entradas, columns=['id_exp', 'fecha_tramite', 'num_tramite', 'unidad_tramitadora'])
+    return dict(zip(salidas, construye_secuencias(tramites)))
+
+
+def _construye_acumulado(codigo, entradas, salidas):
+    datos_limpios, _ = carga_datos_limpios(codigo)
+    return {salidas[0]: tabla_acumulado(datos_limpios['tramites'])}
+
+
+def _construye_acumulado_semanal(codigo, entradas, salidas):
+    return {salidas[0]: tabla_acumulado_semanal(pd.read_parquet(entradas[0]))}
+
+
+def _construye_estados_finales(codigo, entradas, salidas):
+    estados = (
+        lee_tabla(entradas, columns=['num_tramite', 'desc_tramite'])
+        .dropna()
+        .drop_duplicates()
+        .sort_values(['num_tramite', 'desc_tramite'])
+    )
+    # "10-2-Requerimiento documentación" -> "Requerimiento documentación"
+    denominacion = estados['desc_tramite'].astype(str).map(lambda d: re.sub(r"^\d+-\d+-", "", d))
+    return {salidas[0]: pd.DataFrame({
+        'NUMTRAM': estados['num_tramite'].astype(int).to_numpy(),
+        'DENOMINACION': denominacion.to_numpy(),
+        'FINAL': 0,
+        'DENOMINACION_SIMPLE': denominacion.to_numpy()
+    }).drop_duplicates()}
+
+
+# Rutas con {tratados} = data/tratados/<codigo> y {cache} = data/cache/<codigo>; {expedientes}
+# y {tramites} son todos los ficheros de la tabla (el único o las particiones)
+NODOS = {
+    'datos_limpios': {
+        'entradas': ["{expedientes}", "{tramites}"],
+        'salidas': ["{cache}/expedientes.parquet", "{cache}/tramites.parquet"],
+        'version': f"{VERSION_CACHE}:{FECHA_MINIMA.date()}",
+        'construye': _construye_datos_limpios
+    },
+    'secuencias': {
+        'entradas': ["{tramites}"],
+        'salidas': [f"{{tratados}}/{FICHERO_EXPEDIENTES}", f"{{tratados}}/{FICHERO_PASOS}"],
+        'version': "1",
+        'construye': _construye_secuencias
+    },
+    'acumulado': {
+        'entradas': ["{cache}/expedientes.parquet", "{cache}/tramites.parquet"],
+        'salidas': ["{tratados}/tramites_acumulado.parquet"],
+        'version': "1",
+        'construye': _construye_acumulado
+    },
+    'acumulado_semanal': {
+        'entradas': ["{tratados}/tramites_acumulado.parquet"],
+        'salidas': ["{tratados}/tramites_acumulado_semanal.parquet"],
+        'version': "1",
+        'construye': _construye_acumulado_semanal
+    },
+    'estados_finales': {
+        'entradas': ["{tramites}"],
+        'salidas': ["{tratados}/estados_finales.csv"],
+        'version': "1",
+        'construye': _construye_estados_finales,
+        'solo_si_falta': True
+    },
+}
+
+
+def orden_nodos(nodos=NODOS):
+    """Nodos en orden topológico: cada uno después de los que producen sus entradas"""
+    productor = {salida: nombre for nombre, nodo in nodos.items() for salida in nodo['salidas']}
+    grafo = {
+        nombre: {productor[e] for e in nodo['entradas'] if e in productor}
+        for nombre, nodo in nodos.items()
+    }
+    return list(graphlib.TopologicalSorter(grafo).static_order())
+
+
+def _rutas(plantillas, codigo):
+    rutas = []
+    for plantilla in plantillas:
+        if plantilla in ("{expedientes}", "{tramites}"):
+            rutas += ficheros(codigo, plantilla.strip("{}"))
+        else:
+            rutas.append(plantilla.format(tratados=f"{RUTA_TRATADOS}/{codigo}", cache=f"{RUTA_CACHE}/{codigo}"))
+    return rutas
+
+
+# HASHES Y MANIFIESTO
+#####################
+
+def _ruta_manifiesto(codigo):
+    return f"{RUTA_MANIFIESTOS}/{codigo}.json"
+
+
+def lee_manifiesto(codigo):
+    """{'ficheros': {ruta: [mtime_ns, tamaño, hash]}, 'nodos': {nombre: {...}}} de la última construcción"""
+    try:
+        with open(_ruta_manifiesto(codigo), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'ficheros': {}, 'nodos': {}}
+
+
+def _guarda_manifiesto(codigo, manifiesto):
+    ruta = _ruta_manifiesto(codigo)
+    os.makedirs(RUTA_MANIFIESTOS, exist_ok=True)
+    with open(f"{ruta}.tmp", "w", encoding='utf-8') as f:
+        json.dump(manifiesto, f, indent=1)
+    os.replace(f"{ruta}.tmp", ruta)
+
+
+def hash_fichero(ruta, ficheros):
+    """SHA-256 del contenido; se reutiliza el de 'ficheros' si la fecha y el tamaño no han cambiado"""
+    estado = os.stat(ruta)
+    guardado = ficheros.get(ruta)
+    if guardado is not None and guardado[:2] == [estado.st_mtime_ns, estado.st_size]:
+        return guardado[2]
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(BLOQUE_HASH), b""):
+            h.update(bloque)
+    ficheros[ruta] = [estado.st_mtime_ns, estado.st_size, h.hexdigest()]
+    return ficheros[ruta][2]
+
+
+def _escribe(ruta, df):
+    """Escribe la tabla si su contenido cambia; devuelve si se ha escrito"""
+    if ruta.endswith(".csv"):
+        if os.path.exists(ruta):
+            return False
+        df.to_csv(f"{ruta}.tmp", sep=";", index=False, encoding='utf-8-sig')
+    else:
+        if os.path.exists(ruta):
+            try:
+                if pd.read_parquet(ruta).equals(df):
+                    # Se actualiza la fecha para quien compara fechas con las fuentes (carga_secuencias)
+                    os.utime(ruta)
+                    return False
+            except (OSError, ValueError):
+                pass
+        df.to_parquet(f"{ruta}.tmp", index=False)
+    os.replace(f"{ruta}.tmp", ruta)
+    return True
+
+
+# CONSTRUCCIÓN
+##############
+
+def construye_procedimiento(codigo, forzar=False, plan=False):
+    """
+    Reconstruye los nodos pendientes de un procedimiento, en orden.
+    Devuelve [(nodo, estado, segundos)] con estado 'al día', 'pendiente' (con plan),
+    'construido', 'sin cambios' (se ejecutó pero ninguna salida cambió) o 'sin entradas'.
+    """
+    manifiesto = lee_manifiesto(codigo)
+    ficheros = manifiesto['ficheros']
+    resultado = []
+    for nombre in orden_nodos():
+        nodo = NODOS[nombre]
+        entradas, salidas = _rutas(nodo['entradas'], codigo), _rutas(nodo['salidas'], codigo)
+        inicio = time.perf_counter()
+        if not entradas or not all(os.path.exists(r) for r in entradas):
+            resultado.append((nombre, 'sin entradas', 0.0))
+            continue
+        faltan = not all(os.path.exists(r) for r in salidas)
+        if nodo.get('solo_si_falta') and not faltan:
+            resultado.append((nombre, 'al día', 0.0))
+            continue
+
+        hashes_entradas = {r: hash_fichero(r, ficheros) for r in entradas}
+        previo = manifiesto['nodos'].get(nombre)
+        pendiente = (
+            forzar or faltan or previo is None
+            or previo['version'] != nodo['version']
+            or previo['entradas'] != hashes_entradas
+            or previo['salidas'] != {r: hash_fichero(r, ficheros) for r in salidas}
+        )
+        if not pendiente:
+            resultado.append((nombre, 'al día', time.perf_counter() - inicio))
+            continue
+        if plan:
+            resultado.append((nombre, 'pendiente', time.perf_counter() - inicio))
+            continue
+
+        escritas = [_escribe(r, df) for r, df in nodo['construye'](codigo, entradas, salidas).items()]
+        hashes_salidas = {r: hash_fichero(r, ficheros) for r in salidas if os.path.exists(r)}
+        # Los nodos que escriben sus salidas por su cuenta cambian si cambian sus hashes
+        cambia = any(escritas) if escritas else (previo or {}).get('salidas') != hashes_salidas
+        manifiesto['nodos'][nombre] = {
+            'version': nodo['version'],
+            'entradas': hashes_entradas,
+            'salidas': hashes_salidas
+        }
+        # Se guarda tras cada nodo: si algo falla después, lo construido no se repite
+        _guarda_manifiesto(codigo, manifiesto)
+        resultado.append((nombre, 'construido' if cambia else 'sin cambios', time.perf_counter() - inicio))
+    return resultado
+
+
+def procedimientos():
+    """Procedimientos de data/tratados, de mayor a menor tamaño de los ficheros de trámites"""
+    def tamano(codigo):
+        return sum(os.path.getsize(r) for r in ficheros(codigo, 'tramites') if os.path.exists(r))
+    codigos = [c for c in os.listdir(RUTA_TRATADOS) if os.path.isdir(f"{RUTA_TRATADOS}/{c}")]
+    return sorted(codigos, key=tamano, reverse=True)
+
+
+def construye(codigos, forzar=False, plan=False, procesos=None):
+    """
+    Construye los procedimientos en paralelo; genera (codigo, resultado, error) según
+    terminan. Un error en un procedimiento no detiene los demás.
+    """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=procesos) as ejecutor:
+        futuros = {ejecutor.submit(construye_procedimiento, c, forzar, plan): c for c in codigos}
+        for futuro in concurrent.futures.as_completed(futuros):
+            try:
+                yield futuros[futuro], futuro.result(), None
+            except Exception as e:
+                yield futuros[futuro], [], e
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Construcción de los ficheros derivados de data/tratados")
+    parser.add_argument("codigos", nargs="*", help="procedimientos (por defecto todos los de data/tratados)")
+    parser.add_argument("--plan", action="store_true", help="solo lista los nodos pendientes")
+    parser.add_argument("--forzar", action="store_true", help="reconstruye todos los nodos")
+    parser.add_argument("--procesos", type=int, default=None, help="procesos en paralelo (por defecto, uno por CPU)")
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    errores = []
+    contador = {}
+    for codigo, resultado, error in construye(args.codigos or procedimientos(), args.forzar, args.plan, args.procesos):
+        if error is not None:
+            errores.append(codigo)
+            print(f"{codigo:>6}  ERROR: {error!r}", file=sys.stderr, flush=True)
+        for nombre, estado, segundos in resultado:
+            contador[estado] = contador.get(estado, 0) + 1
+            if estado not in ('al día', 'sin entradas'):
+                print(f"{codigo:>6}  {nombre:<20}{estado:<14}{segundos:>8.2f} s", flush=True)
+    resumen = ", ".join(f"{n} {estado}" for estado, n in sorted(contador.items()))
+    print(f"{resumen or 'nada que construir'} en {time.perf_counter() - inicio:.1f} s")
+    sys.exit(1 if errores else 0)
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Consultas de las páginas por procedimiento y rango de fechas, con dos motores:
+
+- 'pandas': carga el procedimiento (carga_datos_base, con la caché en disco o solo el
+  rango) y calcula con analitica.py, como la aplicación. Siempre está disponible.
+- 'duckdb': SQL de DuckDB directamente sobre los parquet (consultas_duckdb.py), en
+  varios hilos y sin cargar el procedimiento: solo se traen a pandas los agregados.
+  Sirve para análisis en lote y para procedimientos que no caben en memoria.
+
+El motor se elige con la variable de entorno CUADRO_MANDO_CONSULTAS (por defecto
+'pandas') o con el parámetro motor de cada función. Si duckdb no está instalado se usa
+pandas. Ambos devuelven lo mismo que las funciones de analitica.py equivalentes:
+
+    import consultas
+    flow_data, total = consultas.flujos(884, rango_fechas, [41, 42], motor='duckdb')
+    transition_stats, transition_stats_grouped = consultas.transiciones(884, rango_fechas, [41, 42])
+    df_prov, df_mun = consultas.geografico(884, rango_fechas)
+    df = consultas.demanda(884, rango_fechas, 'W-MON')      # también demanda_provincia
+    df = consultas.carga(884, inicio, fin, unidad)          # analitica.tabla_carga
+
+    python consultas.py 884 216 --motores pandas duckdb     # tiempos de cada consulta
+    python consultas.py 884 216 --compara                   # duckdb frente a pandas
+    python consultas.py 216 --compara --rango 2023-03-01 2023-08-31
+
+rango_fechas es (inicio, fin) con días completos o None para todo el procedimiento;
+estados_finales es la lista de NUMTRAM seleccionados (vacía: todos los expedientes).
+"""
+import argparse
+import os
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+import analitica
+import consultas_duckdb
+from carga_datos import carga_datos_base, filtra_datos_fechas
+from filtro_estados import mascara_indice
+
+MOTORES = ("pandas", "duckdb")
+MOTOR = os.environ.get("CUADRO_MANDO_CONSULTAS", "pandas")
+
+
+def elige_motor(nombre=None):
+    """Motor a usar: el indicado o el de CUADRO_MANDO_CONSULTAS, y pandas si duckdb no está instalado"""
+    nombre = nombre or MOTOR
+    if nombre not in MOTORES:
+        raise ValueError(f"Motor de consultas desconocido: {nombre} (posibles: {', '.join(MOTORES)})")
+    if nombre == "duckdb" and not consultas_duckdb.DISPONIBLE:
+        warnings.warn("duckdb no está instalado: las consultas usan pandas")
+        return "pandas"
+    return nombre
+
+
+def _datos(codigo, rango_fechas):
+    """Datos base (solo el rango, si lo hay) y su tramo del rango"""
+    if rango_fechas is None:
+        datos_base = carga_datos_base(codigo)
+        return datos_base, datos_base
+    datos_base = carga_datos_base(codigo, rango_fechas)
+    return datos_base, filtra_datos_fechas(datos_base, rango_fechas)
+
+
+def flujos(codigo, rango_fechas=None, estados_finales=(), min_percentage=analitica.MIN_PERCENTAGE_SHOW,
+           motor=None):
+    """(flow_data, total_processes) de analitica.process_flows"""
+    if elige_motor(motor) == "pandas":
+        _, filtrados = _datos(codigo, rango_fechas)
+        mascara = mascara_indice(filtrados['indice_estados'], list(estados_finales))
+        flow_data, total_processes, _ = analitica.process_flows(filtrados['secuencias'], mascara, min_percentage)
+        return flow_data, total_processes
+
+    df = consultas_duckdb.flujos(codigo, rango_fechas, estados_finales)
+    total_processes = int(df['count'].sum())
+    df['percentage'] = (df['count'] / total_processes * 100).round(1)
+    df = df[df['percentage'] >= min_percentage]
+    flow_data = [{
+        'flow_id': flow_id,
+        'sequence': [int(s) for s in sequence],
+        'count': count,
+        'percentage': percentage,
+        'durations': list(durations)
+    } for flow_id, sequence, count, percentage, durations in zip(
+        df['flow_id'], df['sequence'], df['count'], df['percentage'], df['durations']
+    )]
+    return flow_data, total_processes
+
+
+def transiciones(codigo, rango_fechas=None, estados_finales=(), motor=None):
+    """(transition_stats, transition_stats_grouped) de analitica.calculate_transition_stats"""
+    if elige_motor(motor) == "pandas":
+        _, filtrados = _datos(codigo, rango_fechas)
+        mascara = mascara_indice(filtrados['indice_estados'], list(estados_finales))
+        return analitica.calculate_transition_stats(filtrados['secuencias'], mascara)
+    return (consultas_duckdb.transiciones(codigo, rango_fechas, estados_finales),
+            consultas_duckdb.transiciones(codigo, rango_fechas, estados_finales, por_unidad=True))
+
+
+def geografico(codigo, rango_fechas=None, motor=None):
+    """(df_prov, df_mun) de analitica.aggregate_data"""
+    if elige_motor(motor) == "pandas":
+        _, filtrados = _datos(codigo, rango_fechas)
+        return analitica.aggregate_data(filtrados['expedientes'])
+    df_prov, df_mun = consultas_duckdb.agregados_geograficos(codigo, rango_fechas)
+    for df_agg in [df_prov, df_mun]:
+        analitica.anade_porcentajes(df_agg)
+    return df_prov, df_mun
+
+
+def cubo_demanda(codigo, rango_fechas=None, motor=None):
+    """Cubo diario de demanda (analitica.construye_cubo_demanda)"""
+    if elige_motor(motor) == "pandas":
+        _, filtrados = _datos(codigo, rango_fechas)
+        return analitica.construye_cubo_demanda(filtrados['expedientes'])
+    return consultas_duckdb.cubo_demanda(codigo, rango_fechas)
+
+
+def demanda(codigo, rango_fechas=None, regla='D', motor=None):
+    """Expedientes por periodo (analitica.compute_agregado), agregando el cubo diario"""
+    return analitica.compute_agregado(cubo_demanda(codigo, rango_fechas, motor), regla)
+
+
+def demanda_provincia(codigo, rango_fechas=None, regla='D', motor=None):
+    """Expedientes por periodo y provincia (analitica.compute_provincia), agregando el cubo diario"""
+    return analitica.compute_provincia(cubo_demanda(codigo, rango_fechas, motor), regla)
+
+
+def carga(codigo, inicio=None, fin=None, unidad=None, motor=None):
+    """
+    Carga de trabajo diaria entre inicio y fin (analitica.tabla_carga) de todo el
+    procedimiento, sumando las unidades salvo que se indique una
+    """
+    if elige_motor(motor) == "pandas":
+        datos_base, _ = _datos(codigo, None)
+        return analitica.tabla_carga(analitica.construye_acumulado(datos_base['tramites']), inicio, fin, unidad)
+
+    deltas = consultas_duckdb.deltas_carga(codigo)
+    # Días consecutivos y estados (en orden numérico) de todo el procedimiento, como en el acumulado
+    fechas = pd.date_range(deltas['dia'].min(), deltas['dia'].max(), freq='D') if len(deltas) else pd.DatetimeIndex([])
+    estados = np.sort(deltas['estado'].unique())
+    if unidad is not None:
+        deltas = deltas[deltas['unidad'] == unidad]
+    carga_diaria = (
+        deltas.pivot_table(index='dia', columns='estado', values='delta', aggfunc='sum', fill_value=0)
+        .reindex(index=fechas, columns=estados, fill_value=0)
+        .cumsum()
+        # Mismos tipos que tabla_carga: la suma de las unidades es int64
+        .astype('int64' if unidad is None else 'int32')
+    )
+    desde = None if inicio is None else pd.Timestamp(inicio)
+    hasta = None if fin is None else pd.Timestamp(fin)
+    carga_diaria = carga_diaria.loc[desde:hasta]
+    df = pd.DataFrame(carga_diaria.to_numpy(), columns=[str(e) for e in estados])
+    df.insert(0, 'fecha_tramite', carga_diaria.index.to_numpy().astype('datetime64[ns]'))
+    return df
+
+
+def _diferencia(esperado, obtenido):
+    """Primera diferencia entre el resultado de pandas y el de duckdb (None si son iguales)"""
+    try:
+        if isinstance(esperado, pd.DataFrame):
+            # Las categorías de pandas son 'str' o 'string' según vengan de la caché o no: se comparan sus valores
+            pd.testing.assert_frame_equal(esperado.reset_index(drop=True), obtenido.reset_index(drop=True),
+                                          check_categorical=False, rtol=1e-6)
+        elif isinstance(esperado, list) and (len(esperado) != len(obtenido) or not esperado):
+            return None if len(esperado) == len(obtenido) else f"{len(esperado)} flujos != {len(obtenido)}"
+        elif isinstance(esperado, list):
+            # flow_data: las duraciones medias son de float32 sumados en otro orden
+            esperado, obtenido = pd.DataFrame(esperado), pd.DataFrame(obtenido)
+            pd.testing.assert_frame_equal(esperado.drop(columns='durations'), obtenido.drop(columns='durations'),
+                                          check_dtype=False)
+            for flow_id, d_esperado, d_obtenido in zip(esperado['flow_id'], esperado['durations'], obtenido['durations']):
+                np.testing.assert_allclose(d_obtenido, d_esperado, rtol=1e-5, err_msg=f"durations del flujo {flow_id}")
+        elif isinstance(esperado, tuple):
+            return next(filter(None, map(_diferencia, esperado, obtenido)), None)
+        elif esperado != obtenido:
+            return f"{esperado} != {obtenido}"
+    except AssertionError as e:
+        return str(e).strip()
+    return None
+
+
+def compara_motores(codigo, rango_fechas=None, estados_finales=()):
+    """
+    Comprueba que el motor duckdb devuelve lo mismo que pandas en cada consulta:
+    [(consulta, diferencia o None)]. Sin duckdb instalado no compara nada (lista vacía).
+    """
+    if not consultas_duckdb.DISPONIBLE:
+        return []
+    return [
+        (consulta, _diferencia(funcion(motor='pandas'), funcion(motor='duckdb')))
+        for consulta, funcion in (
+            ('flujos', lambda motor: flujos(codigo, rango_fechas, estados_finales, motor=motor)),
+            ('flujos_todos', lambda motor: flujos(codigo, rango_fechas, (), motor=motor)),
+            ('transiciones', lambda motor: transiciones(codigo, rango_fechas, estados_finales, motor=motor)),
+            ('geografico', lambda motor: geografico(codigo, rango_fechas, motor=motor)),
+            ('cubo_demanda', lambda motor: cubo_demanda(codigo, rango_fechas, motor=motor)),
+            ('demanda', lambda motor: demanda(codigo, rango_fechas, 'W-MON', motor=motor)),
+            ('carga', lambda motor: carga(codigo, motor=motor)),
+        )
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tiempos de las consultas con cada motor")
+    parser.add_argument("codigos", nargs="+", help="procedimientos")
+    parser.add_argument("--motores", nargs="+", choices=MOTORES, default=list(MOTORES))
+    parser.add_argument("--compara", action="store_true", help="comprueba que duckdb devuelve lo mismo que pandas")
+    parser.add_argument("--rango", nargs=2, metavar=("INICIO", "FIN"), help="rango de fechas de --compara")
+    args = parser.parse_args()
+
+    if args.compara and not consultas_duckdb.DISPONIBLE:
+        print("duckdb no está instalado: no se compara")
+        raise SystemExit(0)
+
+    hay_diferencias = False
+    for codigo in args.codigos:
+        estados = pd.read_csv(f"data/tratados/{codigo}/estados_finales.csv", sep=";", encoding='utf-8')
+        estados_finales = estados.loc[estados['FINAL'] == 1, 'NUMTRAM'].drop_duplicates().astype(int).tolist()
+        if args.compara:
+            rango_fechas = tuple(pd.Timestamp(fecha) for fecha in args.rango) if args.rango else None
+            for consulta, diferencia in compara_motores(codigo, rango_fechas, estados_finales):
+                hay_diferencias |= diferencia is not None
+                print(f"{codigo:>6} {consulta:<14}{'ok' if diferencia is None else diferencia}", flush=True)
+            continue
+        for nombre in args.motores:
+            for consulta, funcion in (
+                ('flujos', lambda: flujos(codigo, None, estados_finales, motor=nombre)),
+                ('transiciones', lambda: transiciones(codigo, None, estados_finales, motor=nombre)),
+                ('geografico', lambda: geografico(codigo, motor=nombre)),
+                ('demanda', lambda: demanda(codigo, None, 'W-MON', motor=nombre)),
+                ('carga', lambda: carga(codigo, motor=nombre)),
+            ):
+                inicio = time.perf_counter()
+                funcion()
+                print(f"{codigo:>6} {elige_motor(nombre):<8}{consulta:<14}{time.perf_counter() - inicio:>9.3f} s", flush=True)
+    raise SystemExit(1 if hay_diferencias else 0)
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+Motor DuckDB de consultas.py: SQL directamente sobre los parquet de un procedimiento
+(data/tratados/<codigo>, ficheros únicos o particiones mensuales), sin cargarlo en
+memoria.
+
+DuckDB es opcional (pip install duckdb): si no está instalado DISPONIBLE es False y
+consultas.py usa el motor pandas. Las consultas se ejecutan en el proceso, en varios
+hilos (HILOS, por defecto todos los núcleos) y, si no caben en memoria, con ficheros
+temporales en RUTA_TEMPORAL.
+
+Cada consulta parte de las mismas reglas de limpieza que carga_datos.limpia_datos_base
+(_fuentes) y del mismo orden de los trámites que el almacén de secuencias: por fecha
+del trámite y, a igualdad de fecha, por su posición en el fichero. Devuelven tablas
+pequeñas (agregados) con las columnas de las funciones de analitica.py equivalentes;
+consultas.py termina en pandas lo que depende del redondeo o del formato.
+"""
+import os
+import threading
+
+import pandas as pd
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+from cache_datos import optimiza_tipos
+from carga_datos import FECHA_MINIMA
+from carga_trabajo import UNIDAD_NO_ESPECIFICADA
+from particiones import ficheros
+
+DISPONIBLE = duckdb is not None
+HILOS = int(os.environ.get("CUADRO_MANDO_DUCKDB_HILOS", 0)) or os.cpu_count()
+RUTA_TEMPORAL = "data/cache/duckdb"
+
+_bloqueo = threading.Lock()
+_conexion = None
+
+
+def conexion():
+    """Cursor propio (cada hilo necesita el suyo) de una base de datos en memoria única para el proceso"""
+    global _conexion
+    if not DISPONIBLE:
+        raise ImportError("duckdb no está instalado")
+    with _bloqueo:
+        if _conexion is None:
+            _conexion = duckdb.connect(config={'threads': HILOS, 'temp_directory': RUTA_TEMPORAL})
+    return _conexion.cursor()
+
+
+def _lista(rutas):
+    """Lista de rutas como literal SQL"""
+    if not rutas:
+        raise FileNotFoundError("No hay particiones para el rango indicado")
+    return "[" + ", ".join("'" + ruta.replace("'", "''") + "'" for ruta in rutas) + "]"
+
+
+def _fuentes(codigo, rango_fechas=None):
+    """
+    (sql, parámetros): CTE 'expedientes' y 'tramites' limpios, con 'orden' (posición del
+    expediente en la carga de pandas) y 'fila' (posición del trámite en su fichero)
+    """
+    condiciones = ["fecha_registro_exp > $fecha_minima"]
+    parametros = {'fecha_minima': FECHA_MINIMA.to_pydatetime()}
+    if rango_fechas is not None:
+        start_date, end_date = rango_fechas
+        condiciones += ["fecha_registro_exp >= $inicio", "fecha_registro_exp < $fin"]
+        parametros['inicio'] = pd.Timestamp(start_date).to_pydatetime()
+        parametros['fin'] = (pd.Timestamp(end_date) + pd.Timedelta(days=1)).to_pydatetime()
+    sql = f"""
+    expedientes_leidos AS (
+        SELECT id_exp, fecha_registro_exp, codine_provincia, codine, municipio, provincia,
+               coalesce(es_telematica, false) AS es_online,
+               nif IS NOT NULL AS es_empresa,
+               row_number() OVER (ORDER BY fecha_registro_exp, filename, file_row_number) AS orden
+        FROM read_parquet({_lista(ficheros(codigo, 'expedientes', rango_fechas))},
+                          filename = true, file_row_number = true)
+        WHERE {' AND '.join(condiciones)}
+    ),
+    tramites_leidos AS (
+        SELECT id_exp, fecha_tramite, num_tramite,
+               coalesce(unidad_tramitadora, '{UNIDAD_NO_ESPECIFICADA}') AS unidad_tramitadora,
+               file_row_number AS fila
+        FROM read_parquet({_lista(ficheros(codigo, 'tramites', rango_fechas))}, file_row_number = true)
+        WHERE id_exp IN (SELECT id_exp FROM expedientes_leidos)
+    ),
+    -- Expedientes con algún trámite anterior a FECHA_MINIMA: fuera completos
+    excluidos AS (
+        SELECT DISTINCT id_exp FROM tramites_leidos WHERE fecha_tramite < $fecha_minima
+    ),
+    expedientes AS (
+        SELECT * FROM expedientes_leidos WHERE id_exp NOT IN (SELECT id_exp FROM excluidos)
+    ),
+    tramites AS (
+        SELECT * FROM tramites_leidos WHERE id_exp NOT IN (SELECT id_exp FROM excluidos)
+    )"""
+    return sql, parametros
+
+
+# Pasos de las secuencias (secuencias.construye_secuencias): estado, unidad del
+# expediente (la de su primer trámite), siguiente estado y duración en días hasta él
+_PASOS = """
+    pasos AS (
+        SELECT id_exp, num_tramite,
+               first_value(unidad_tramitadora) OVER w AS unidad_exp,
+               row_number() OVER w - 1 AS paso,
+               lead(num_tramite) OVER w AS siguiente,
+               CAST(coalesce((epoch_us(lead(fecha_tramite) OVER w) - epoch_us(fecha_tramite)) / 86400e6, 0)
+                    AS FLOAT) AS duration
+        FROM tramites
+        WINDOW w AS (PARTITION BY id_exp ORDER BY fecha_tramite, fila)
+    )"""
+
+
+def _seleccionados(estados_finales):
+    """CTE de los expedientes que alcanzan alguno de los estados (todos si no hay selección)"""
+    if not estados_finales:
+        return "seleccionados AS (SELECT DISTINCT id_exp FROM tramites)"
+    lista = ", ".join(str(int(e)) for e in estados_finales)
+    return f"""seleccionados AS (
+        SELECT id_exp FROM tramites GROUP BY id_exp HAVING bool_or(num_tramite IN ({lista}))
+    )"""
+
+
+def _consulta(codigo, rango_fechas, ctes, select):
+    """DataFrame de una consulta sobre las fuentes limpias y otras CTE"""
+    sql, parametros = _fuentes(codigo, rango_fechas)
+    consulta = "WITH " + ",\n".join([sql] + ctes) + "\n" + select
+    return conexion().execute(consulta, parametros).df()
+
+
+def flujos(codigo, rango_fechas, estados_finales):
+    """
+    Una fila por flujo de los expedientes seleccionados: flow_id (por orden de primera
+    aparición entre todos los expedientes, como identifica_flujos), sequence, count y
+    durations (duración media de cada paso salvo el último)
+    """
+    ctes = [_PASOS, _seleccionados(estados_finales), """
+    flujos_exp AS (
+        SELECT p.id_exp, list(p.num_tramite ORDER BY p.paso) AS sequence, min(e.orden) AS orden
+        FROM pasos p JOIN expedientes e USING (id_exp)
+        GROUP BY p.id_exp
+    ),
+    flujos AS (
+        SELECT sequence, row_number() OVER (ORDER BY min(orden)) - 1 AS flow_id
+        FROM flujos_exp GROUP BY sequence
+    ),
+    seleccion AS (
+        SELECT x.id_exp, f.flow_id, f.sequence
+        FROM flujos_exp x JOIN flujos f USING (sequence)
+        WHERE x.id_exp IN (SELECT id_exp FROM seleccionados)
+    ),
+    conteos AS (
+        SELECT flow_id, any_value(sequence) AS sequence, count(*) AS "count" FROM seleccion GROUP BY flow_id
+    ),
+    duraciones AS (
+        SELECT s.flow_id, p.paso, avg(p.duration) AS media
+        FROM pasos p JOIN seleccion s USING (id_exp)
+        WHERE p.siguiente IS NOT NULL
+        GROUP BY s.flow_id, p.paso
+    )"""]
+    return _consulta(codigo, rango_fechas, ctes, """
+    SELECT c.flow_id, c.sequence, c."count",
+           -- Los flujos de un solo paso no tienen duraciones: lista vacía, no NULL
+           coalesce(list(d.media ORDER BY d.paso) FILTER (WHERE d.paso IS NOT NULL), []::DOUBLE[]) AS durations
+    FROM conteos c LEFT JOIN duraciones d USING (flow_id)
+    GROUP BY c.flow_id, c.sequence, c."count"
+    ORDER BY c."count" DESC, c.flow_id
+    """)
+
+
+def transiciones(codigo, rango_fechas, estados_finales, por_unidad=False):
+    """Estadísticas de las transiciones (transiciones.estadisticas_transiciones)"""
+    claves = "src, tgt, unidad" if por_unidad else "src, tgt"
+    ctes = [_PASOS, _seleccionados(estados_finales), """
+    transiciones AS (
+        SELECT CAST(num_tramite AS SMALLINT) AS src, CAST(siguiente AS SMALLINT) AS tgt,
+               unidad_exp AS unidad, CAST(duration AS DOUBLE) AS duration
+        FROM pasos
+        WHERE siguiente IS NOT NULL AND id_exp IN (SELECT id_exp FROM seleccionados)
+    )"""]
+    return _consulta(codigo, rango_fechas, ctes, f"""
+    SELECT {claves}, count(*) AS "count", sum(duration) AS "sum", avg(duration) AS "mean",
+           quantile_cont(duration, 0.5) AS "median", quantile_cont(duration, 0.9) AS p90
+    FROM transiciones
+    GROUP BY {claves}
+    ORDER BY {claves}
+    """)
+
+
+def agregados_geograficos(codigo, rango_fechas):
+    """
+    (df_prov, df_mun) de analitica.aggregate_data sin los porcentajes: nombre (el primero
+    no nulo), total, online y empresas por provincia y por municipio
+    """
+    def agrega(claves, nombres):
+        columnas_nombres = ",\n".join(
+            f"arg_min({n}, orden) FILTER (WHERE {n} IS NOT NULL) AS {n}" for n in nombres
+        )
+        return optimiza_tipos(_consulta(codigo, rango_fechas, [], f"""
+        SELECT {', '.join(claves)},
+               {columnas_nombres},
+               count(id_exp) AS total,
+               -- count_if devuelve HUGEINT, que llega a pandas como float
+               CAST(count_if(es_online) AS BIGINT) AS online,
+               CAST(count_if(es_empresa) AS BIGINT) AS empresas
+        FROM expedientes
+        WHERE {' AND '.join(f'{c} IS NOT NULL' for c in claves)}
+        GROUP BY {', '.join(claves)}
+        ORDER BY {', '.join(claves)}
+        """))
+
+    return (agrega(['codine_provincia'], ['provincia']),
+            agrega(['codine_provincia', 'codine'], ['municipio', 'provincia']))
+
+
+def cubo_demanda(codigo, rango_fechas):
+    """Cubo diario de demanda (cubo_demanda.construye_cubo_demanda)"""
+    return optimiza_tipos(_consulta(codigo, rango_fechas, [], """
+    SELECT CAST(date_trunc('day', fecha_registro_exp) AS TIMESTAMP) AS fecha,
+           provincia, es_online, es_empresa, count(*) AS total_exp
+    FROM expedientes
+    GROUP BY ALL
+    ORDER BY ALL
+    """))
+
+
+def deltas_carga(codigo):
+    """
+    Entradas menos salidas de cada (día, unidad, estado) de todos los trámites del
+    procedimiento (carga_trabajo.anade_tramites): columnas dia, unidad, estado y delta
+    """
+    ctes = ["""
+    pasos_carga AS (
+        SELECT CAST(fecha_tramite AS DATE) AS dia, num_tramite AS estado, unidad_tramitadora AS unidad,
+               lag(num_tramite) OVER w AS estado_previo, lag(unidad_tramitadora) OVER w AS unidad_previa
+        FROM tramites
+        WINDOW w AS (PARTITION BY id_exp ORDER BY fecha_tramite, fila)
+    ),
+    movimientos AS (
+        SELECT dia, unidad, estado, 1 AS delta FROM pasos_carga
+        UNION ALL
+        SELECT dia, unidad_previa, estado_previo, -1 FROM pasos_carga WHERE estado_previo IS NOT NULL
+    )"""]
+    return _consulta(codigo, None, ctes, """
+    SELECT CAST(dia AS TIMESTAMP) AS dia, unidad, CAST(estado AS SMALLINT) AS estado,
+           CAST(sum(delta) AS INTEGER) AS delta
+    FROM movimientos
+    GROUP BY ALL
+    ORDER BY ALL
+    """)
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""
+Cubo diario de demanda: número de expedientes registrados por día, provincia,
+es_online y es_empresa.
+
+Se construye una vez por procedimiento y rango de fechas; las series diarias,
+semanales y mensuales (totales o por provincia) se obtienen agregando el cubo, sin
+volver a recorrer la tabla de expedientes.
+"""
+import pandas as pd
+
+DIMENSIONES = ['provincia', 'es_online', 'es_empresa']
+
+
+def construye_cubo_demanda(expedientes):
+    """Una fila por (fecha, provincia, es_online, es_empresa) con expedientes, y su número en 'total_exp'"""
+    dia = expedientes['fecha_registro_exp'].dt.normalize().rename('fecha')
+    return expedientes.groupby(
+        [dia] + [expedientes[c] for c in DIMENSIONES], observed=True, dropna=False
+    ).size().rename('total_exp').reset_index()
+
+
+def serie_demanda(cubo, regla):
+    """Total de expedientes por periodo ('D', 'W-MON', 'MS'...), con los periodos vacíos a cero"""
+    diario = cubo.groupby('fecha')['total_exp'].sum()
+    return diario.resample(regla).sum().rename_axis('fecha_registro_exp').to_frame('total_exp')
+
+
+def demanda_por_provincia(cubo, regla):
+    """Expedientes por periodo y provincia (sin los de provincia desconocida)"""
+    return cubo[cubo['provincia'].notna()].groupby(
+        [pd.Grouper(key='fecha', freq=regla), 'provincia'], observed=True
+    )['total_exp'].sum().rename_axis(['fecha_registro_exp', 'provincia']).reset_index()
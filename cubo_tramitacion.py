@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Cubo de trámites: número de trámites por día, num_tramite, unidad tramitadora y
+firma del expediente.
+
+La firma identifica el conjunto de estados por los que pasa cada expediente (hay
+pocas firmas distintas, como ocurre con los flujos). Así el filtro por estados
+finales, que depende del expediente y no del trámite, se resuelve como una máscara
+sobre las firmas: una firma se selecciona si contiene alguno de los estados
+elegidos. Las vistas diaria, semanal y mensual son agregaciones del cubo.
+"""
+import numpy as np
+import pandas as pd
+
+import motor_polars
+
+
+def construye_cubo_tramitacion(tramites):
+    """
+    Devuelve {'cubo', 'firmas'}: 'cubo' tiene una fila por (fecha, num_tramite,
+    unidad_tramitadora, firma) con trámites y su número en 'count'; 'firmas' es la
+    tupla ordenada de estados de cada firma.
+    """
+    # Conjunto de estados de cada expediente como bitmap (palabras de 64 estados)
+    codigo_estado, estados = pd.factorize(tramites['num_tramite'], sort=True)
+    codigo_exp, _ = pd.factorize(tramites['id_exp'])
+    n_palabras = max(1, -(-len(estados) // 64))
+    bits = np.zeros((codigo_exp.max() + 1 if len(codigo_exp) else 0, n_palabras), dtype='uint64')
+    for palabra in range(n_palabras):
+        en_palabra = codigo_estado // 64 == palabra
+        valores = np.left_shift(np.uint64(1), (codigo_estado[en_palabra] % 64).astype('uint64'))
+        np.bitwise_or.at(bits[:, palabra], codigo_exp[en_palabra], valores)
+    firmas_bits, firma_exp = np.unique(bits, axis=0, return_inverse=True)
+    firma = firma_exp.reshape(-1)[codigo_exp]
+    presentes = np.unpackbits(firmas_bits.astype('<u8').view('uint8'), axis=1, bitorder='little')
+    firmas = [tuple(estados[fila[:len(estados)].astype(bool)].tolist()) for fila in presentes]
+
+    if motor_polars.ACTIVO:
+        return {'cubo': motor_polars.cuenta_tramites(tramites, firma), 'firmas': np.asarray(firmas, dtype=object)}
+    cubo = tramites.groupby(
+        [tramites['fecha_tramite'].dt.normalize().rename('fecha'), 'num_tramite', 'unidad_tramitadora',
+         pd.Series(firma, index=tramites.index, name='firma')],
+        observed=True
+    ).size().rename('count').reset_index()
+    return {'cubo': cubo, 'firmas': np.asarray(firmas, dtype=object)}
+
+
+def mascara_firmas(cubo_tramitacion, estados_finales_selecc):
+    """Firmas que alcanzan alguno de los estados seleccionados (todas si no hay selección)"""
+    firmas = cubo_tramitacion['firmas']
+    if not estados_finales_selecc:
+        return np.ones(len(firmas), dtype=bool)
+    seleccion = set(estados_finales_selecc)
+    return np.fromiter((not seleccion.isdisjoint(f) for f in firmas), dtype=bool, count=len(firmas))
+
+
+def evolucion_tramites(cubo_tramitacion, mascara, freq):
+    """Trámites por periodo (to_period(freq)), num_tramite y unidad de las firmas de la máscara"""
+    cubo = cubo_tramitacion['cubo']
+    cubo = cubo[mascara[cubo['firma'].to_numpy()]]
+    periodo = cubo['fecha'].dt.to_period(freq).dt.to_timestamp().rename('fecha')
+    return cubo.groupby(
+        [periodo, 'num_tramite', 'unidad_tramitadora'], observed=True
+    )['count'].sum().reset_index()
@@ -8,44 +8,22 @@ Created on Thu Jan 30 19:19:20 2025
 import streamlit as st
 import pandas as pd
 import numpy as np
-import plotly.express as px
+from plotly.colors import qualitative
 import plotly.graph_objects as go
 
-@st.cache_data
-def get_nombre_estados(estados_df, proced_seleccionado):
-    return estados_df.set_index('NUMTRAM')['DENOMINACION_SIMPLE'].astype('category').to_dict()
+import analitica
+from filtro_estados import mascara_indice
+from claves_cache import TTL_CACHE, MAX_ENTRADAS_CACHE
+from instrumentacion import cache_data, plotly_chart
 
-@st.cache_data
-def agg_tram_filtrado_tini_tfin_dur(_tramites, estados_finales_selecc, rango_fechas, proced_seleccionado):
-    _tramites = _tramites.copy()
-    _tramites['num_tramite'] = _tramites['num_tramite'].astype('int16')
-    
-    _tramites_sorted = _tramites.sort_values(['id_exp', 'fecha_tramite'])
-    _tramites_sorted['unidad_tramitadora'] = _tramites_sorted['unidad_tramitadora'].fillna('No especificada')
+@cache_data(ttl=TTL_CACHE, max_entries=MAX_ENTRADAS_CACHE)
+def get_nombre_estados(estados_df):
+    return estados_df.set_index('NUMTRAM')['DENOMINACION_SIMPLE'].astype('category').to_dict()
 
-    tram_filtr_agg_tiempos = _tramites_sorted.groupby('id_exp').agg(
-        first_date=('fecha_tramite', 'min'),
-        last_date=('fecha_tramite', 'max'),
-        all_states=('num_tramite', lambda x: x.astype('int16').tolist()),
-        unidad_tramitadora=('unidad_tramitadora', 'first')
-    ).reset_index()
-    
-    tram_filtr_agg_tiempos['duration_days'] = (
-        tram_filtr_agg_tiempos['last_date'] - tram_filtr_agg_tiempos['first_date']
-    ).dt.total_seconds() / (3600 * 24)
-    
-    # tram_filtr_agg_tiempos['contains_selected'] = tram_filtr_agg_tiempos['all_states'].apply(
-    #     lambda states: any(s in estados_finales_selecc for s in states)
-    # )
-    # If no final states are selected, mark all rows as True.
-    if not estados_finales_selecc:
-        tram_filtr_agg_tiempos['contains_selected'] = True
-    else:
-        tram_filtr_agg_tiempos['contains_selected'] = tram_filtr_agg_tiempos['all_states'].apply(
-            lambda states: any(s in estados_finales_selecc for s in states)
-        )
-    
-    return tram_filtr_agg_tiempos
+@cache_data(ttl=TTL_CACHE, max_entries=MAX_ENTRADAS_CACHE)
+def agg_tram_filtrado_tini_tfin_dur(_secuencias, _mascara_estados, huella_seleccion):
+    # Mask computed in app.py from the states index (all True if no final states are selected)
+    return analitica.agg_tram_filtrado_tini_tfin_dur(_secuencias, _mascara_estados)
 
 # Page initialization
 if "datos_filtrados_rango" not in st.session_state:
@@ -62,18 +40,15 @@ if "textos_procedimiento" not in st.session_state:
     st.stop()
 
 # Get required session state values
-proced_seleccionado = st.session_state.proced_seleccionado
-rango_fechas = st.session_state.get('rango_fechas', (None, None))
-nombres_estados = get_nombre_estados(st.session_state.estados, proced_seleccionado)
+nombres_estados = get_nombre_estados(st.session_state.estados)
 estados_finales_selecc = [int(s) for s in st.session_state.estados_finales_selecc]
 textos_procedimiento = st.session_state.textos_procedimiento
 
 # Process filtered data
 tram_filtr_agg_t = agg_tram_filtrado_tini_tfin_dur(
-    st.session_state.datos_filtrados_rango['tramites'],
-    estados_finales_selecc,
-    rango_fechas,
-    proced_seleccionado
+    st.session_state.datos_filtrados_rango['secuencias'],
+    st.session_state.mascara_estados,
+    st.session_state.huella_seleccion
 )
 
 # Header section
@@ -109,7 +84,7 @@ with st.container(border=True):
         for state_num in estados_finales_selecc:
             state_name = nombres_estados.get(state_num, f"State {state_num}")
             
-            mask = tram_filtr_agg_t['all_states'].apply(lambda x: state_num in x)
+            mask = mascara_indice(st.session_state.datos_filtrados_rango['indice_estados'], [state_num])
             state_count = mask.sum()
             state_percent = (state_count / total_processes * 100) if total_processes > 0 else 0
             state_mean = tram_filtr_agg_t[mask]['duration_days'].mean()
@@ -127,7 +102,7 @@ if 'unidad_tramitadora' in tram_filtr_agg_t.columns:
     unique_unidades = unidades_series.unique()
     
     # Create color mapping based on original names
-    color_sequence = px.colors.qualitative.Plotly
+    color_sequence = qualitative.Plotly
     color_mapping = {unidad: color_sequence[i % len(color_sequence)] 
                      for i, unidad in enumerate(sorted(unique_unidades))}
     
@@ -182,7 +157,7 @@ if 'unidad_tramitadora' in tram_filtr_agg_t.columns:
                     )
                 )
                 #fig_pie.update_traces(traceorder='normal')
-                st.plotly_chart(fig_pie, use_container_width=True, key="global-number")
+                plotly_chart(fig_pie, use_container_width=True, key="global-number")
             
             # Bar Chart: Average Duration of Finalization
             with col3:
@@ -215,7 +190,7 @@ if 'unidad_tramitadora' in tram_filtr_agg_t.columns:
                     height=450,
                     showlegend=False  # No legend on bar chart
                 )
-                st.plotly_chart(fig_bar, use_container_width=True, key="global-time")
+                plotly_chart(fig_bar, use_container_width=True, key="global-time")
             
             st.markdown("")    
             st.markdown("") 
@@ -1,142 +1,41 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
+import plotly.express as px
+from plotly.colors import qualitative
+
+import analitica
+from claves_cache import TTL_CACHE, MAX_ENTRADAS_CACHE
+from instrumentacion import cache_data, plotly_chart
 
 if "datos_filtrados_rango" not in st.session_state:
     st.error("Cargue los datos desde la página principal primero.")
     st.stop()
 
 # Get parameters from session state
-rango_fechas = st.session_state.get('rango_fechas', (None, None))
-proced_seleccionado = st.session_state.get('proced_seleccionado', None)
 estados_finales_selecc = [int(s) for s in st.session_state.estados_finales_selecc]
+huella_seleccion = st.session_state.huella_seleccion
 nombres_estados = st.session_state.estados.set_index('NUMTRAM')['DENOMINACION_SIMPLE'].to_dict()
 
-@st.cache_data(show_spinner="Calculando transiciones de estados")
-def process_flows_for_transitions(tramites, estados_finales_selecc, rango_fechas, proced_seleccionado):
-    tramites_sorted = tramites.sort_values(['id_exp', 'fecha_tramite'])
-    tramites_sorted['next_fecha'] = tramites_sorted.groupby('id_exp')['fecha_tramite'].shift(-1)
-    tramites_sorted['duration'] = (
-        (tramites_sorted['next_fecha'] - tramites_sorted['fecha_tramite'])
-        .dt.total_seconds() / 86400
-    ).fillna(0)
-    tramites_sorted['unidad_tramitadora'] = tramites_sorted['unidad_tramitadora'].fillna('No especificada')
-    
-    tram_filtr_agg_tiempos = tramites_sorted.groupby('id_exp').agg(
-        all_states=('num_tramite', lambda x: list(x.astype(int))),
-        durations=('duration', list),
-        unidad_tramitadora=('unidad_tramitadora', 'first')
-    ).reset_index()
-    if not estados_finales_selecc:
-        filtered_processed = tram_filtr_agg_tiempos
-    else:
-        filtered_processed = tram_filtr_agg_tiempos[tram_filtr_agg_tiempos['all_states'].apply(
-            lambda x: any(s in estados_finales_selecc for s in x)
-        )]
-    # filtered_processed = tram_filtr_agg_tiempos[tram_filtr_agg_tiempos['all_states'].apply(
-    #     lambda x: any(s in estados_finales_selecc for s in x))]
-    
-    return filtered_processed
-
-@st.cache_data
-def calculate_transition_stats(filtered_processes, estados_finales_selecc, rango_fechas, proced_seleccionado):
-    transition_stats = {}
-    transition_stats_grouped = {}
-    
-    for _, row in filtered_processes.iterrows():
-        #exp_id = row['id_exp']
-        states = row['all_states']
-        durations = row['durations']
-        unidad = row['unidad_tramitadora']
-        
-        for i in range(len(states) - 1):
-            src, tgt = states[i], states[i+1]
-            duration = durations[i]
-            
-            # Global stats
-            if (src, tgt) not in transition_stats:
-                transition_stats[(src, tgt)] = {'sum_duration': 0.0, 'count': 0}
-            transition_stats[(src, tgt)]['sum_duration'] += duration
-            transition_stats[(src, tgt)]['count'] += 1
-            
-            # Grouped stats
-            key = (src, tgt, unidad)
-            if key not in transition_stats_grouped:
-                transition_stats_grouped[key] = {'sum_duration': 0.0, 'count': 0}
-            transition_stats_grouped[key]['sum_duration'] += duration
-            transition_stats_grouped[key]['count'] += 1
-    
-    return transition_stats, transition_stats_grouped
-
+@cache_data(ttl=TTL_CACHE, max_entries=MAX_ENTRADAS_CACHE, show_spinner="Calculando transiciones de estados")
+def calculate_transition_stats(_secuencias, _mascara_estados, huella_seleccion):
+    # Transiciones de los expedientes que alcanzan los estados finales (analitica.py)
+    return analitica.calculate_transition_stats(_secuencias, _mascara_estados)
 
-@st.cache_data
-def build_transition_dataframes(transition_stats, transition_stats_grouped):
-    # Create main transitions dataframe
-    data = []
-    for (src, tgt), stats in transition_stats.items():
-        avg_duration = stats['sum_duration'] / stats['count'] if stats['count'] > 0 else 0
-        src_label = nombres_estados.get(src, f"S-{src}")
-        tgt_label = nombres_estados.get(tgt, f"S-{tgt}")
-        data.append({
-            'src': src,  # added column for ordering
-            'Transition': f"{src_label} → {tgt_label}",
-            'Mean Duration': avg_duration,
-            'Count': stats['count']
-        })
-    # Now sorting by the 'src' column
-    df_transitions = pd.DataFrame(data).sort_values("src", ascending=False)
 
-    # Prepare scatter data
-    data_scatter_global = []
-    for (src, tgt), stats in transition_stats.items():
-        mean_duration = stats['sum_duration'] / stats['count'] if stats['count'] > 0 else 0
-        total_days = stats['sum_duration']
-        count = stats['count']
-        src_label = nombres_estados.get(src, f"S-{src}")
-        tgt_label = nombres_estados.get(tgt, f"S-{tgt}")
-        transition_label = f"{src_label} → {tgt_label}"
-        data_scatter_global.append({
-            'src': src,  # added column for ordering
-            'Transition': transition_label,
-            'Mean Duration': mean_duration,
-            'Total Processes': count,
-            'Total Days': total_days
-        })
-    df_scatter_global = pd.DataFrame(data_scatter_global).sort_values("src", ascending=False)
-
-    # Grouped scatter data
-    data_scatter_grouped = []
-    for (src, tgt, unidad), stats in transition_stats_grouped.items():
-        mean_duration = stats['sum_duration'] / stats['count'] if stats['count'] > 0 else 0
-        total_days = stats['sum_duration']
-        count = stats['count']
-        src_label = nombres_estados.get(src, f"S-{src}")
-        tgt_label = nombres_estados.get(tgt, f"S-{tgt}")
-        transition_label = f"{src_label} → {tgt_label}"
-        data_scatter_grouped.append({
-            'src': src,  # added column for ordering
-            'Transition': transition_label,
-            'Unidad': unidad,
-            'Mean Duration': mean_duration,
-            'Total Processes': count,
-            'Total Days': total_days
-        })
-    df_scatter_grouped = pd.DataFrame(data_scatter_grouped).sort_values("src", ascending=False)
-
-    return df_transitions, df_scatter_global, df_scatter_grouped
+@cache_data(ttl=TTL_CACHE, max_entries=MAX_ENTRADAS_CACHE)
+def build_transition_dataframes(_transition_stats, _transition_stats_grouped, huella_seleccion):
+    return analitica.build_transition_dataframes(_transition_stats, _transition_stats_grouped, nombres_estados)
 
 
 # Main processing pipeline
-tramites_data = st.session_state.datos_filtrados_rango['tramites']
-filtered_processes = process_flows_for_transitions(
-    tramites_data, estados_finales_selecc, rango_fechas, proced_seleccionado
-)
+secuencias_data = st.session_state.datos_filtrados_rango['secuencias']
+mascara_estados = st.session_state.mascara_estados
 transition_stats, transition_stats_grouped = calculate_transition_stats(
-    filtered_processes, estados_finales_selecc, rango_fechas, proced_seleccionado
+    secuencias_data, mascara_estados, huella_seleccion
 )
 df_transitions, df_scatter_global, df_scatter_grouped = build_transition_dataframes(
-    transition_stats, transition_stats_grouped
+    transition_stats, transition_stats_grouped, huella_seleccion
 )
 
 # Tab definitions remain the same
@@ -162,9 +61,11 @@ with tab_bar:
         hovertemplate=(
             "<b>%{y}</b><br>"
             "Duración: %{x:.1f} días<br>"
-            "Procesos: %{customdata}<extra></extra>"
+            "Mediana: %{customdata[1]:.1f} días<br>"
+            "Percentil 90: %{customdata[2]:.1f} días<br>"
+            "Procesos: %{customdata[0]}<extra></extra>"
         ),
-        customdata=df_transitions["Count"]
+        customdata=df_transitions[["Count", "Median Duration", "P90 Duration"]].values
     ))
     max_x = df_transitions["Mean Duration"].max() * 1.2
     fig_global.update_layout(
@@ -195,28 +96,21 @@ with tab_bar:
         yaxis=dict(showgrid=False, gridcolor='rgba(0,0,0,0.1)', gridwidth=1),
         xaxis=dict(showgrid=True, gridcolor='rgba(0,0,0,0.1)', gridwidth=1)
     )
-    st.plotly_chart(fig_global, use_container_width=True)
+    plotly_chart(fig_global, use_container_width=True)
 
     # Grouped bar chart if multiple unidades
-    unique_unidades = filtered_processes['unidad_tramitadora'].nunique()
+    unique_unidades = secuencias_data['expedientes']['unidad_tramitadora'][mascara_estados].nunique()
     if unique_unidades > 1:
         st.subheader("Tiempos medios de cada Unidad Tramitadora")
         st.info("Puede haber grandes diferencias en el tiempo que se tarda en cada Unidad en ejecutar ciertos trámites",icon='😱')
-        # Create grouped dataframe
-        grouped_data = []
-        for (src, tgt, unidad), stats in transition_stats_grouped.items():
-            avg_duration = stats['sum_duration'] / stats['count'] if stats['count'] > 0 else 0
-            src_label = nombres_estados.get(src, f"S-{src}")
-            tgt_label = nombres_estados.get(tgt, f"S-{tgt}")
-            grouped_data.append({
-                'Transition': f"{src_label} → {tgt_label}",
-                'Unidad': unidad,
-                'Mean Duration': avg_duration,
-                'Count': stats['count']
-            })
         # Create grouped dataframe with same order
         transition_order = df_transitions['Transition'].tolist()
-        df_grouped = pd.DataFrame(grouped_data)
+        df_grouped = pd.DataFrame({
+            'Transition': analitica.transition_labels(transition_stats_grouped, nombres_estados),
+            'Unidad': transition_stats_grouped['unidad'],
+            'Mean Duration': transition_stats_grouped['mean'],
+            'Count': transition_stats_grouped['count']
+        })
         df_grouped['Transition'] = pd.Categorical(
             df_grouped['Transition'], 
             categories=transition_order, 
@@ -237,7 +131,7 @@ with tab_bar:
             color="Unidad",
             orientation="h",
             barmode="group",
-            color_discrete_sequence=px.colors.qualitative.Plotly,
+            color_discrete_sequence=qualitative.Plotly,
             text=df_grouped["Mean Duration"].round(1).astype(str) + " días",
             category_orders={"Transition": transition_order},
             custom_data=["Unidad", "Count"]
@@ -293,7 +187,7 @@ with tab_bar:
             yaxis=dict(showgrid=False, gridcolor='rgba(0,0,0,0.1)', gridwidth=1),
             xaxis=dict(showgrid=True, gridcolor='rgba(0,0,0,0.1)', gridwidth=1)
         )
-        st.plotly_chart(fig_grouped, use_container_width=True)
+        plotly_chart(fig_grouped, use_container_width=True)
 
 # Create scatter plots in second tab
 with tab_scatter:
@@ -336,7 +230,7 @@ with tab_scatter:
             yaxis=dict(showgrid=True, gridcolor='rgba(0,0,0,0.1)', gridwidth=1),
             xaxis=dict(showgrid=True, gridcolor='rgba(0,0,0,0.1)', gridwidth=1)
         )
-        st.plotly_chart(fig_global, use_container_width=True)
+        plotly_chart(fig_global, use_container_width=True)
     else:
         st.warning("No hay datos disponibles para el gráfico global")
 
@@ -353,7 +247,7 @@ with tab_scatter:
             hover_name='Transition',
             custom_data=['Unidad', 'Total Days'],
             size_max=40,
-            color_discrete_sequence=px.colors.qualitative.Plotly,
+            color_discrete_sequence=qualitative.Plotly,
             labels={
                 'Mean Duration': 'Duración Media (días)',
                 'Total Processes': 'Número de Procesos',
@@ -388,7 +282,7 @@ with tab_scatter:
             yaxis=dict(showgrid=True, gridcolor='rgba(0,0,0,0.1)', gridwidth=1),
             xaxis=dict(showgrid=True, gridcolor='rgba(0,0,0,0.1)', gridwidth=1)
         )
-        st.plotly_chart(fig_grouped, use_container_width=True)
+        plotly_chart(fig_grouped, use_container_width=True)
     elif unique_unidades > 1:
         st.warning("No hay datos suficientes para comparar unidades")
         
\ No newline at end of file
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Filtro de expedientes por estados finales alcanzados.
+
+Un expediente "alcanza" la selección de estados finales si alguno de sus trámites
+tiene un num_tramite de la selección. Si no hay ningún estado seleccionado se
+consideran todos los expedientes. Todas las páginas usan estas funciones para
+decidir 'contains_selected' en lugar de recorrer las listas de estados fila a fila.
+
+Para que cambiar la selección en la barra lateral sea inmediato, al cargar un
+procedimiento se construye un índice que asocia cada NUMTRAM con el bitmap de los
+expedientes que lo alcanzan. Cualquier selección se resuelve como el OR de sus
+bitmaps, y las funciones cacheadas de las páginas usan como clave el hash de la
+máscara resultante en lugar de la lista de estados.
+"""
+import hashlib
+
+import numpy as np
+
+
+def construye_indice_estados(secuencias):
+    """Índice NUMTRAM -> bitmap (np.packbits) de los expedientes del almacén que lo alcanzan"""
+    n_expedientes = len(secuencias['expedientes'])
+    posicion_exp = np.repeat(np.arange(n_expedientes), np.diff(secuencias['offsets']))
+    bitmaps = {}
+    for estado in np.unique(secuencias['num_tramite']):
+        alcanza = np.zeros(n_expedientes, dtype=bool)
+        alcanza[posicion_exp[secuencias['num_tramite'] == estado]] = True
+        bitmaps[int(estado)] = np.packbits(alcanza)
+    return {
+        'id_exp': secuencias['expedientes']['id_exp'].to_numpy(),
+        'bitmaps': bitmaps
+    }
+
+
+def corta_indice_estados(indice, inicio, fin):
+    """Tramo [inicio, fin) de expedientes del índice"""
+    return {
+        'id_exp': indice['id_exp'][inicio:fin],
+        'bitmaps': {
+            estado: np.packbits(np.unpackbits(bitmap, count=fin)[inicio:])
+            for estado, bitmap in indice['bitmaps'].items()
+        }
+    }
+
+
+def mascara_indice(indice, estados_finales_selecc):
+    """Máscara por expediente resuelta como OR de los bitmaps de los estados seleccionados"""
+    n_expedientes = len(indice['id_exp'])
+    if not estados_finales_selecc:
+        return np.ones(n_expedientes, dtype=bool)
+    bitmaps = [indice['bitmaps'][e] for e in estados_finales_selecc if e in indice['bitmaps']]
+    if not bitmaps:
+        return np.zeros(n_expedientes, dtype=bool)
+    return np.unpackbits(np.bitwise_or.reduce(bitmaps), count=n_expedientes).astype(bool)
+
+
+def clave_mascara(mascara):
+    """Hash de una máscara, para usarlo como clave de caché en lugar de la selección de estados"""
+    return hashlib.sha1(np.packbits(mascara).tobytes() + str(len(mascara)).encode()).hexdigest()
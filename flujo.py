@@ -7,64 +7,20 @@ Created on Thu Jan 30 19:19:18 2025
 
 import streamlit as st
 import pandas as pd
-import plotly.express as px
+from plotly.colors import qualitative
 import plotly.graph_objects as go
-import numpy as np
+import plotly.express as px
 
-# Global constant for the minimum percentage to show a flow
-MIN_PERCENTAGE_SHOW = 0.5
+import analitica
+from analitica import (MIN_PERCENTAGE_SHOW, build_dot_for_expedientes, generate_flow_info,
+                       create_visualizations, create_office_visualizations)
+from claves_cache import TTL_CACHE, MAX_ENTRADAS_CACHE
+from instrumentacion import cache_data, plotly_chart
 
 # ------------------------------------------
 # Helper Functions
 # ------------------------------------------
 
-# Helper function to build a DOT string for a given office's processes
-def build_dot_for_office(office_df, nombres_estados):
-    """
-    Given a DataFrame (office_df) containing filtered expedients for one office,
-    build a DOT string that aggregates transitions (count and average duration).
-    """
-    nodes_set = set()
-    link_counts = {}
-    link_durations = {}
-    
-    # Loop over each process (expediente) for the office
-    for _, row in office_df.iterrows():
-        seq = row['all_states']
-        durations = row['durations']
-        for i in range(len(seq) - 1):
-            source = seq[i]
-            target = seq[i + 1]
-            d = durations[i] if i < len(durations) else 0
-            nodes_set.update([source, target])
-            key = (source, target)
-            link_counts[key] = link_counts.get(key, 0) + 1
-            link_durations[key] = link_durations.get(key, 0) + d
-    
-    # Build DOT lines
-    dot_lines = []
-    dot_lines.append("digraph ProcessFlow {")
-    dot_lines.append("  rankdir=TB;")
-    
-    # Create node IDs
-    sorted_nodes = sorted(nodes_set)
-    node_ids = {node: f"node{idx}" for idx, node in enumerate(sorted_nodes)}
-    
-    # Define nodes with their labels (using nombres_estados mapping)
-    for node in sorted_nodes:
-        node_label = nombres_estados.get(node, f"S-{node}")
-        dot_lines.append(f'  {node_ids[node]} [label="{node_label}"];')
-    
-    # Define edges with aggregated counts and average durations
-    for (source, target), count in link_counts.items():
-        avg_duration = link_durations[(source, target)] / count if count else 0
-        edge_label = f"Exp: {count}\\nDur: {avg_duration:.1f} días"
-        dot_lines.append(f'  {node_ids[source]} -> {node_ids[target]} [label="{edge_label}"];')
-    
-    dot_lines.append("}")
-    return "\n".join(dot_lines)
-
-
 def plot_legend_table(legend_df, unique_key):
     """
     Render a Plotly table with the legend information.
@@ -103,202 +59,15 @@ def plot_legend_table(legend_df, unique_key):
         margin=dict(l=20, r=20, t=0, b=10)
     )
 
-    st.plotly_chart(fig, use_container_width=False, key=unique_key)
-
-def generate_flow_info(flow, idx, nombres_estados):
-    """
-    Given a flow record, its index, and the mapping of state names,
-    return a tuple containing:
-      - code (e.g. "F01"),
-      - list of state names,
-      - full sequence as a string,
-      - label string for display.
-    """
-    code = f"F{idx:02d}"
-    states = [str(nombres_estados.get(s, f"S-{s}")) for s in flow['sequence']]
-    full_sequence = " → ".join(states)
-    label = f"({flow['percentage']}% - {sum(flow['durations']):.0f} días ) {full_sequence} "
-    return code, states, full_sequence, label
-
-@st.cache_data
-def process_flows(_tramites, estados_finales_selecc, proced_seleccionado, rango_fechas):
-    """
-    Process the tramites data (which has already been filtered by proced_seleccionado,
-    rango_fechas, and estados_finales_selecc) and compute flows.
-    
-    This version also carries the 'unidad_tramitadora' column (the office that processes
-    each expediente) so that later we can group office-level metrics.
-    """
-    # Sort by expedition and date
-    tramites_sorted = _tramites.sort_values(['id_exp', 'fecha_tramite'])
-    
-    # Calculate duration between steps (in days)
-    tramites_sorted['next_fecha'] = tramites_sorted.groupby('id_exp')['fecha_tramite'].shift(-1)
-    tramites_sorted['duration'] = (
-        (tramites_sorted['next_fecha'] - tramites_sorted['fecha_tramite'])
-        .dt.total_seconds() / 86400
-    ).fillna(0)
-    tramites_sorted['unidad_tramitadora'] = tramites_sorted['unidad_tramitadora'].fillna('No especificada')
-    # Group by expedition. Because all rows for an id_exp share the same office,
-    # we take the first value of 'unidad_tramitadora'.
-    tram_filtr_agg_tiempos = tramites_sorted.groupby('id_exp').agg(
-        all_states=('num_tramite', lambda x: list(x.astype(int))),
-        durations=('duration', list),
-        unidad_tramitadora=('unidad_tramitadora', 'first')
-    ).reset_index()
-    
-    # Filter processes that include at least one of the selected states
-    # filtered_processes = tram_filtr_agg_tiempos[tram_filtr_agg_tiempos['all_states'].apply(
-    #     lambda x: any(s in estados_finales_selecc for s in x)
-    # )]
-    # Filter processes that include at least one of the selected states,
-    # or include all processes if no states are selected.
-    if not estados_finales_selecc:
-        filtered_processes = tram_filtr_agg_tiempos
-    else:
-        filtered_processes = tram_filtr_agg_tiempos[tram_filtr_agg_tiempos['all_states'].apply(
-            lambda x: any(s in estados_finales_selecc for s in x)
-        )]
-        
-    total_processes = len(filtered_processes)
-    
-    # Count the frequency of each sequence (convert lists to tuples to hash them)
-    seq_counts = filtered_processes['all_states'].apply(tuple).value_counts().reset_index()
-    seq_counts.columns = ['sequence', 'count']
-    seq_counts['percentage'] = (seq_counts['count'] / total_processes * 100).round(1)
-    
-    # Keep only flows that pass the minimum percentage threshold
-    major_seqs = seq_counts[seq_counts['percentage'] >= MIN_PERCENTAGE_SHOW].sort_values('count', ascending=False)
-    
-    # Calculate per-transition average durations for each major flow
-    flow_data = []
-    for seq_tuple in major_seqs['sequence']:
-        seq = list(seq_tuple)
-        seq_len = len(seq)
-        seq_durations = filtered_processes[filtered_processes['all_states'].apply(tuple) == seq_tuple]['durations']
-        aligned_durations = [d[:seq_len - 1] for d in seq_durations]
-        avg_durations = np.nanmean(aligned_durations, axis=0).tolist() if aligned_durations else []
-        matching_row = major_seqs[major_seqs['sequence'] == seq_tuple].iloc[0]
-        flow_data.append({
-            'sequence': seq,
-            'count': matching_row['count'],
-            'percentage': matching_row['percentage'],
-            'durations': avg_durations
-        })
-    
-    return flow_data, total_processes, filtered_processes
-
-def create_visualizations(flow_data, nombres_estados):
-    """
-    Build legend and visualization data frames using the helper function.
-    """
-    legend_data = []
-    viz_data = []
-    
-    for idx, flow in enumerate(flow_data, 1):
-        code, states, full_sequence, _ = generate_flow_info(flow, idx, nombres_estados)
-        transitions = [f"{states[i]} → {states[i+1]}" for i in range(len(states) - 1)]
-        
-        legend_data.append({
-            'Code': code,
-            'Sequence': full_sequence,
-            'Percentage': f"{flow['percentage']}%",
-            'Total': flow['count'],
-            'Avg Duration': f"{sum(flow['durations']):.0f} días"
-        })
-        
-        for transition, duration in zip(transitions, flow['durations']):
-            viz_data.append({
-                'Flow': code,
-                'Transition': transition,
-                'Duration': duration,
-                'Percentage': flow['percentage']
-            })
-    
-    return pd.DataFrame(legend_data), pd.DataFrame(viz_data)
+    plotly_chart(fig, use_container_width=False, key=unique_key)
 
-def create_office_visualizations(filtered_processes, flow_data, nombres_estados):
+@cache_data(ttl=TTL_CACHE, max_entries=MAX_ENTRADAS_CACHE)
+def process_flows(_secuencias, _mascara_estados, huella_seleccion):
     """
-    Build DataFrames for office-level visualizations.
-    For each major flow (from flow_data) and for each unidad_tramitadora,
-    compute:
-      - The count and percentage (with respect to that office’s total)
-      - The average durations per transition.
-    We also assign an abbreviated office code (e.g. U1, U2) and create a y_label
-    in the form "Flow (OfficeCode)" so that the order is consistent with the overall chart.
+    Flows of the expedientes selected by _mascara_estados (those reaching the selected
+    final states), computed in analitica.py. Cached on huella_seleccion (see claves_cache.py).
     """
-    # Work with the already filtered processes (which include 'unidad_tramitadora')
-    df = filtered_processes.copy()
-    df['seq_tuple'] = df['all_states'].apply(tuple)
-    # Only keep the major flows (those present in flow_data)
-    major_flow_tuples = {tuple(flow['sequence']) for flow in flow_data}
-    df = df[df['seq_tuple'].isin(major_flow_tuples)]
-    
-    # Build a mapping from flow tuple to flow code (to match the global charts)
-    flow_code_mapping = {}
-    global_flow_order = []
-    for idx, flow in enumerate(flow_data, 1):
-        ft = tuple(flow['sequence'])
-        flow_code = f"F{idx:02d}"
-        flow_code_mapping[ft] = flow_code
-        global_flow_order.append(flow_code)
-    
-    # For each (unidad_tramitadora, flow) group, compute counts and percentages
-    totals_by_office = df.groupby('unidad_tramitadora').size().to_dict()
-    perc_list = []
-    dur_list = []
-    for (office, seq_tuple), group in df.groupby(['unidad_tramitadora', 'seq_tuple']):
-        count = len(group)
-        percentage = round(count / totals_by_office[office] * 100, 1)
-        flow_code = flow_code_mapping.get(seq_tuple, "N/A")    
-        # Compute average durations per transition:
-        seq_len = len(seq_tuple)
-        durations_lists = group['durations'].tolist()
-        aligned = [d[:seq_len - 1] for d in durations_lists] if seq_len > 1 else []
-        avg_durs = np.nanmean(aligned, axis=0).tolist() if aligned and len(aligned[0]) > 0 else []
-        total_duration = sum(avg_durs) if avg_durs else 0
-        perc_list.append({
-            'Flow': flow_code,
-            'Office': office,
-            'percentage': percentage,
-            'count': count,
-            'total_duration': total_duration  # Add total duration
-        })
-        
-        # Get transitions labels from state names
-        states = [str(nombres_estados.get(s, f"S-{s}")) for s in seq_tuple]
-        transitions = [f"{states[i]} → {states[i+1]}" for i in range(len(states)-1)]
-        # Also record the transition index for ordering
-        for i, d in enumerate(avg_durs):
-            dur_list.append({
-                'Flow': flow_code,
-                'Office': office,
-                'Transition': transitions[i],
-                'Duration': d,
-                'transition_index': i
-            })
-    perc_df = pd.DataFrame(perc_list)
-    dur_df = pd.DataFrame(dur_list)
-    
-    # Create abbreviated office codes (so full names don’t clutter the chart)
-    offices_sorted = sorted(df['unidad_tramitadora'].unique())
-    office_code_mapping = {name: f"U{i+1}" for i, name in enumerate(offices_sorted)}
-    perc_df['OfficeCode'] = perc_df['Office'].map(office_code_mapping)
-    dur_df['OfficeCode'] = dur_df['Office'].map(office_code_mapping)
-    
-    # Create a y_label for plotting: "Flow (OfficeCode)"
-    perc_df['y_label'] = perc_df.apply(lambda r: f"{r['Flow']} ({r['OfficeCode']})", axis=1)
-    dur_df['y_label'] = dur_df.apply(lambda r: f"{r['Flow']} ({r['OfficeCode']})", axis=1)
-    
-    # Order the rows by the global flow order and then by OfficeCode
-    perc_df['Flow_order'] = pd.Categorical(perc_df['Flow'], categories=global_flow_order, ordered=True)
-    perc_df = perc_df.sort_values(['Flow_order', 'OfficeCode'])
-    dur_df['Flow_order'] = pd.Categorical(dur_df['Flow'], categories=global_flow_order, ordered=True)
-    dur_df = dur_df.sort_values(['Flow_order', 'OfficeCode', 'transition_index'])
-    
-    return perc_df, dur_df, office_code_mapping
-
-
+    return analitica.process_flows(_secuencias, _mascara_estados)
 
 # ------------------------------------------
 # INTERFACE / USER INTERFACE
@@ -317,12 +86,13 @@ if "datos_filtrados_rango" not in st.session_state:
 nombres_estados = st.session_state.estados.set_index('NUMTRAM')['DENOMINACION_SIMPLE'].to_dict()
 estados_finales_selecc = [int(s) for s in st.session_state.estados_finales_selecc]
 
+secuencias = st.session_state.datos_filtrados_rango['secuencias']
+
 # Process data with caching (MODIFIED to capture filtered_processes)
 flow_data, total, filtered_processes = process_flows(  # Changed to receive 3 values
-    st.session_state.datos_filtrados_rango['tramites'],
-    estados_finales_selecc,
-    st.session_state.proced_seleccionado,
-    st.session_state.rango_fechas
+    secuencias,
+    st.session_state.mascara_estados,
+    st.session_state.huella_seleccion
 )
 
 #st.dataframe(st.session_state.datos_filtrados_rango['tramites'])
@@ -355,49 +125,11 @@ with tab1:
     st.markdown("")
     st.markdown("")
     
-    # Aggregate transitions from the selected flows (similar to the Sankey tab)
-    nodes_set = set()
-    link_counts = {}
-    link_durations = {}
-    
-    for flow in selected_flows_gv:
-        seq = flow['sequence']
-        count = flow['count']
-        for i in range(len(seq) - 1):
-            source = seq[i]
-            target = seq[i + 1]
-            duration = flow['durations'][i] if i < len(flow['durations']) else 0
-            
-            nodes_set.update([source, target])
-            key = (source, target)
-            link_counts[key] = link_counts.get(key, 0) + count
-            link_durations[key] = link_durations.get(key, 0) + (count * duration)
-    
-    # Create a mapping of each node to a DOT-valid identifier.
-    nodes_sorted = sorted(nodes_set)
-    node_ids = {node: f"node{idx}" for idx, node in enumerate(nodes_sorted)}
-    
-    # Build the DOT string.
-    dot_lines = []
-    dot_lines.append("digraph ProcessFlow {")
-    # Set a layout direction (TB = top-to-bottom, LR = left-to-right)
-    dot_lines.append("  rankdir=TB;")
-    
-    # Define nodes with their labels.
-    for node in nodes_sorted:
-        # Use the state name mapping for a nice label.
-        node_label = nombres_estados.get(node, f"S-{node}")
-        dot_lines.append(f'  {node_ids[node]} [label="{node_label}"];')
-    
-    # Define edges with labels that show the count and average duration.
-    for (source, target), count in link_counts.items():
-        avg_duration = link_durations[(source, target)] / count if count else 0
-        # Using "\n" in DOT requires escaping as "\\n" in the string.
-        edge_label = f"Exp: {count}\\nDur: {avg_duration:.1f} días"
-        dot_lines.append(f'  {node_ids[source]} -> {node_ids[target]} [label="{edge_label}"];')
-    
-    dot_lines.append("}")
-    dot_str = "\n".join(dot_lines)
+    # Aggregate transitions of the expedientes following the selected flows
+    selected_flow_ids = [flow['flow_id'] for flow in selected_flows_gv]
+    mask = filtered_processes['flow_id'].isin(selected_flow_ids)
+    matching_ids = filtered_processes[mask]['id_exp'].unique()
+    dot_str = build_dot_for_expedientes(secuencias, matching_ids, nombres_estados)
     
     # Render the Graphviz diagram in Streamlit.
     col_graphviz_1, col_graphviz_2, col_graphviz_3 = st.columns([2,4,2])
@@ -406,14 +138,7 @@ with tab1:
 
     # New checkbox and dataframe display
     if st.checkbox("Mostrar trámites de los flujos seleccionados", key="show_tramites_df"):
-        # Get selected sequences
-        selected_sequences = [tuple(flow['sequence']) for flow in selected_flows_gv]
-        
-        # Find matching expeditions
-        mask = filtered_processes['all_states'].apply(tuple).isin(selected_sequences)
-        matching_ids = filtered_processes[mask]['id_exp'].unique()
-        
-        # Filter and display tramites
+        # Filter and display tramites of the matching expeditions
         tramites_df = st.session_state.datos_filtrados_rango['tramites']
         filtered_tramites = tramites_df[tramites_df['id_exp'].isin(matching_ids)]
         
@@ -455,9 +180,6 @@ with tab1:
         
         st.subheader("Comparación de flujos de proceso de dos Unidades Tramitadoras")
         st.info("Visualiza en los diagramas cuántos expedientes se tramitan en cada unidad y el tiempo que se tarda en cada trámite", icon="👀")
-        # Get the selected flows as tuples (as used earlier)
-        selected_sequences = [tuple(flow['sequence']) for flow in selected_flows_gv]
-        
         # Create two equal-width columns for the comparator
         col1, col2 = st.columns(2)
         
@@ -470,12 +192,12 @@ with tab1:
                 
                 # Filter the data for the selected office and then by selected flows
                 office_df1 = filtered_processes[filtered_processes['unidad_tramitadora'] == selected_office_1]
-                office_df1 = office_df1[office_df1['all_states'].apply(tuple).isin(selected_sequences)]
+                office_df1 = office_df1[office_df1['flow_id'].isin(selected_flow_ids)]
                 
                 if office_df1.empty:
                     st.info("No hay procesos para esta combinación en esta unidad.")
                 else:
-                    dot_str_office_1 = build_dot_for_office(office_df1, nombres_estados)
+                    dot_str_office_1 = build_dot_for_expedientes(secuencias, office_df1['id_exp'], nombres_estados)
                     col_order_1_1, col_order_1_2, col_order_1_3 = st.columns([1,3,1])
                     with col_order_1_2:
                         st.graphviz_chart(dot_str_office_1)
@@ -487,12 +209,12 @@ with tab1:
                 selected_office_2 = st.selectbox("Seleccione la segunda Unidad Tramitadora", options=offices, key="comp_office_2")
                 
                 office_df2 = filtered_processes[filtered_processes['unidad_tramitadora'] == selected_office_2]
-                office_df2 = office_df2[office_df2['all_states'].apply(tuple).isin(selected_sequences)]
+                office_df2 = office_df2[office_df2['flow_id'].isin(selected_flow_ids)]
                 
                 if office_df2.empty:
                     st.info("No hay procesos para esta combinación en esta unidad.")
                 else:
-                    dot_str_office_2 = build_dot_for_office(office_df2, nombres_estados)
+                    dot_str_office_2 = build_dot_for_expedientes(secuencias, office_df2['id_exp'], nombres_estados)
                     col_order_2_1, col_order_2_2, col_order_2_3 = st.columns([1,3,1])
                     with col_order_2_2:
                         st.graphviz_chart(dot_str_office_2)
@@ -567,7 +289,7 @@ with tab2:
     # --- Right Chart: Duration Stacked Bar Chart ---
     # Create a fixed color map for transitions
     transition_colors = {}
-    color_palette = px.colors.qualitative.D3
+    color_palette = qualitative.D3
     for i, transition in enumerate(viz_df['Transition'].unique()):
         transition_colors[transition] = color_palette[i % len(color_palette)]
     
@@ -604,9 +326,9 @@ with tab2:
         # Display the two charts side-by-side
         col1, col2 = st.columns([1, 3])
         with col1:
-            st.plotly_chart(fig_perc, use_container_width=True, key="percent-global" )
+            plotly_chart(fig_perc, use_container_width=True, key="percent-global" )
         with col2:
-            st.plotly_chart(fig_dur, use_container_width=True, key="time-global")
+            plotly_chart(fig_dur, use_container_width=True, key="time-global")
         
         # Display the legend table
         #st.divider()
@@ -629,11 +351,11 @@ with tab2:
         
         # Generate office-level data
         perc_df, dur_df, office_code_mapping = create_office_visualizations(
-            filtered_processes, flow_data, nombres_estados
+            secuencias, filtered_processes, flow_data, nombres_estados
         )
         
         # Create consistent color mapping for transitions across all offices
-        color_palette = px.colors.qualitative.D3
+        color_palette = qualitative.D3
         all_transitions = dur_df['Transition'].unique()
         transition_colors_office = {
             trans: color_palette[i % len(color_palette)] 
@@ -733,9 +455,9 @@ with tab2:
                 # Display charts side-by-side
                 col1, col2 = st.columns([1, 3])
                 with col1:
-                    st.plotly_chart(fig_perc, use_container_width=True)
+                    plotly_chart(fig_perc, use_container_width=True)
                 with col2:
-                    st.plotly_chart(fig_dur, use_container_width=True)
+                    plotly_chart(fig_dur, use_container_width=True)
     
 
 
@@ -811,7 +533,7 @@ with tab3:
         xaxis=dict(showgrid=True, gridcolor='rgba(0,0,0,0.1)', gridwidth=1)
     )
     # Display the bubble chart in the Streamlit app.
-    st.plotly_chart(fig_bubble, use_container_width=True, key="complexity")
+    plotly_chart(fig_bubble, use_container_width=True, key="complexity")
     
     # Now show the legend table below the bubble plot.
     st.markdown("**Leyenda de Flujos:**")
@@ -911,4 +633,4 @@ with tab3:
 #     )
 #     # col_sankey_1, col_sankey_2, col_sankey_3 = st.columns([1, 6, 1])
 #     # with col_sankey_2:
-#     st.plotly_chart(fig_sankey, use_container_width=True)
+#     plotly_chart(fig_sankey, use_container_width=True)
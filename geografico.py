@@ -1,68 +1,40 @@
 # input_geografico.py
 import streamlit as st
-import json
 import plotly.graph_objects as go
 from datetime import datetime
-import geopandas as gpd
+
+from claves_cache import TTL_CACHE, MAX_ENTRADAS_CACHE
+from instrumentacion import cache_data, cache_resource, plotly_chart
+import analitica
+from mapas import lee_capa, geojson_capa, nivel_para_zoom
+
+ZOOM_PROVINCIAS = 5
+ZOOM_MUNICIPIOS = 6
+
 # ====================
 # CACHED DATA LOADING
 # ====================
 
-@st.cache_data(show_spinner="Cargando mapas")
+@cache_resource(show_spinner="Cargando mapas")
 def carga_datos_geo():
-    """Carga los datos geográficos optimizados"""
-    
-    # Cargar y simplificar provincias
-    gdf_prov = gpd.read_file('data/geo/provincias_id_ine.geojson')
-    gdf_prov["geometry"] = gdf_prov["geometry"].simplify(tolerance=0.05, preserve_topology=True)
-    gdf_prov = gdf_prov[["codigo", "geometry"]]  # Conservar solo la columna 'codigo'
-    prov_geojson = json.loads(gdf_prov.to_json())
-
-    # Cargar y simplificar municipios
-    gdf_mun = gpd.read_file('data/geo/municipios_id_ine_simple.geojson')
-    gdf_mun["geometry"] = gdf_mun["geometry"].simplify(tolerance=0.005, preserve_topology=True)
-    gdf_mun = gdf_mun[["CODIGOINE", "geometry"]]  # Conservar solo la columna 'CODINE'
-    mun_geojson = json.loads(gdf_mun.to_json())
+    """
+    Carga las geometrías simplificadas (python mapas.py) al nivel adecuado para el zoom
+    de cada mapa. Devuelve, por capa, (geojson, clave) o None si la capa no está preparada.
+    """
+    geo_data = {}
+    for capa, zoom in (('provincias', ZOOM_PROVINCIAS), ('municipios', ZOOM_MUNICIPIOS)):
+        datos_capa = lee_capa(capa)
+        if datos_capa is None:
+            geo_data[capa] = None
+            continue
+        tolerancia = nivel_para_zoom(datos_capa['tolerancias'], zoom)
+        geo_data[capa] = (geojson_capa(datos_capa, tolerancia), f"{capa}:{tolerancia}")
+    return geo_data
 
-    return {
-        'provincias': prov_geojson,
-        'municipios': mun_geojson
-    }
-
-@st.cache_data
-def aggregate_data(_expedientes, rango_fechas, proced_seleccionado):
-    """Preprocesa y agrega los datos para visualización"""
-    # Filtrado de columnas
-    df = _expedientes[[ 'id_exp', 'codine_provincia', 'codine', 
-              'es_online', 'es_empresa',
-              'provincia', 'municipio' ]].copy()
-          
-    # Agregación por provincia (manteniendo el nombre)
-    df_prov = df.groupby('codine_provincia', observed=True).agg(
-        provincia=('provincia', 'first'),
-        total=('id_exp', 'count'),
-        online=('es_online', 'sum'),
-        empresas=('es_empresa', 'sum')
-    ).reset_index()
-    
-    # Agregación por municipio (manteniendo el nombre)
-    df_mun = df.groupby(['codine_provincia', 'codine'], observed=True).agg(
-        municipio=('municipio', 'first'),
-        provincia=('provincia', 'first'),
-        total=('id_exp', 'count'),
-        online=('es_online', 'sum'),
-        empresas=('es_empresa', 'sum')
-    ).reset_index()
-
-    # Cálculo de otros porcentajes (relativos a cada área)
-    for df_agg in [df_prov, df_mun]:
-        total_nacional = df_agg['total'].sum()
-        df_agg['%_total'] = (df_agg['total'] / total_nacional * 100).round(1)
-        df_agg['%_online'] = (df_agg['online'] / df_agg['total'] * 100).round(1)
-        df_agg['%_empresas'] = (df_agg['empresas'] / df_agg['total'] * 100).round(1)
-        df_agg['total'] = df_agg['total'].astype('int32')
-    
-    return df_prov, df_mun
+@cache_data(ttl=TTL_CACHE, max_entries=MAX_ENTRADAS_CACHE)
+def aggregate_data(_expedientes, huella_rango):
+    """Preprocesa y agrega los datos para visualización (analitica.py)"""
+    return analitica.aggregate_data(_expedientes)
 
 # ====================
 # GLOBAL SETTINGS
@@ -130,13 +102,14 @@ def create_province_barchart(df_prov, value_col, pct_col):
     
     return fig, df
 
-def create_province_map(df_prov, geojson, value_col, pct_col):
-    """Crea mapa coroplético de provincias"""
+@cache_data(ttl=TTL_CACHE, max_entries=MAX_ENTRADAS_CACHE)
+def create_province_map(df_prov, _geojson, clave_geo, value_col, pct_col):
+    """Crea mapa coroplético de provincias (clave_geo identifica la geometría)"""
     df = df_prov.copy()
     df['codine_provincia'] = df['codine_provincia'].astype(str)
        
     fig = go.Figure(go.Choroplethmapbox(
-        geojson=geojson,
+        geojson=_geojson,
         locations=df['codine_provincia'],
         z=df[pct_col],
         featureidkey="properties.codigo",
@@ -153,7 +126,7 @@ def create_province_map(df_prov, geojson, value_col, pct_col):
         margin=dict(t=60, b=0, l=0, r=0),
         mapbox=dict(
             style="open-street-map",
-            zoom=5,
+            zoom=ZOOM_PROVINCIAS,
             center={"lat": 40.0, "lon": -3.5}
         )
     )
@@ -205,16 +178,17 @@ def create_municipios_barchart(df_mun, value_col, pct_col):
     
     return fig, df
 
-def create_municipio_map(df_mun, geojson, value_col, pct_col):
-    """Crea mapa coroplético de municipios"""
+@cache_data(ttl=TTL_CACHE, max_entries=MAX_ENTRADAS_CACHE)
+def create_municipio_map(df_mun, _geojson, clave_geo, value_col, pct_col):
+    """Crea mapa coroplético de municipios (clave_geo identifica la geometría)"""
     df = df_mun.copy()
     df['codine'] = df['codine'].astype(str)
        
     fig = go.Figure(go.Choroplethmapbox(
-        geojson=geojson,
+        geojson=_geojson,
         locations=df['codine'],
         z=df[pct_col],
-        featureidkey="properties.CODIGOINE",
+        featureidkey="properties.codigo",
         colorscale=colors_map_mun,
         hovertemplate = "%{customdata[0]}<br>" + "%{customdata[2]:.2f}%<br>" + "num: %{customdata[1]}" + \
                         (" de %{customdata[3]}" if value_col in ['online', 'empresas'] else "") + \
@@ -228,7 +202,7 @@ def create_municipio_map(df_mun, geojson, value_col, pct_col):
         margin=dict(t=60, b=0, l=0, r=0),
         mapbox=dict(
             style="open-street-map",
-            zoom=6,
+            zoom=ZOOM_MUNICIPIOS,
             center={"lat": 40.0, "lon": -3.5}
         )
     )
@@ -242,12 +216,8 @@ def create_municipio_map(df_mun, geojson, value_col, pct_col):
 # Carga de datos
 geo_data = carga_datos_geo()
 
-rango_fechas = st.session_state.get('rango_fechas', (None, None))
-proced_seleccionado = st.session_state.proced_seleccionado
-
 df_prov, df_mun = aggregate_data(st.session_state.datos_filtrados_rango['expedientes'],
-                                                  rango_fechas,
-                                                  proced_seleccionado)
+                                 st.session_state.datos_filtrados_rango['huella'])
 
 
 # --- TAB 1: Número de expedientes (usa columna "total" y "%_total") ---
@@ -264,22 +234,28 @@ with tab1:
     
     col_tab1_prov_1, col_tab1_prov_2 = st.columns([0.7, 0.3])
     with col_tab1_prov_1:
-        map_fig_prov = create_province_map(df_prov, geo_data['provincias'], value_col='total', pct_col='%_total')
-        st.plotly_chart(map_fig_prov, use_container_width=True)
+        if geo_data['provincias'] is None:
+            st.info("Mapa no disponible: falta preparar la capa de provincias (python mapas.py)")
+        else:
+            map_fig_prov = create_province_map(df_prov, *geo_data['provincias'], value_col='total', pct_col='%_total')
+            plotly_chart(map_fig_prov, use_container_width=True)
     with col_tab1_prov_2:
         chart, chart_df = create_province_barchart(df_prov, value_col='total', pct_col='%_total')
-        st.plotly_chart(chart, use_container_width=True)
+        plotly_chart(chart, use_container_width=True)
     
     st.divider()
     
     st.subheader("Número de expedientes por Municipio")
     col_tab1_mun_1, col_tab1_mun_2 = st.columns([0.7, 0.3])
     with col_tab1_mun_1:
-        map_fig_mun = create_municipio_map(df_mun, geo_data['municipios'], value_col='total', pct_col='%_total')
-        st.plotly_chart(map_fig_mun, use_container_width=True)
+        if geo_data['municipios'] is None:
+            st.info("Mapa no disponible: falta preparar la capa de municipios (python mapas.py)")
+        else:
+            map_fig_mun = create_municipio_map(df_mun, *geo_data['municipios'], value_col='total', pct_col='%_total')
+            plotly_chart(map_fig_mun, use_container_width=True)
     with col_tab1_mun_2:
         chart_mun, chart_df_mun = create_municipios_barchart(df_mun, value_col='total', pct_col='%_total')
-        st.plotly_chart(chart_mun, use_container_width=True)
+        plotly_chart(chart_mun, use_container_width=True)
 
     st.caption(f"*Los porcentajes se calculan sobre el total de trámites en cada área geográfica. Datos actualizados al {datetime.today().strftime('%d/%m/%Y')}*")
 
@@ -291,22 +267,28 @@ with tab2:
     
     col_tab2_prov_1, col_tab2_prov_2 = st.columns([0.7, 0.3])
     with col_tab2_prov_1:
-        map_fig_prov = create_province_map(df_prov, geo_data['provincias'], value_col='online', pct_col='%_online')
-        st.plotly_chart(map_fig_prov, use_container_width=True)
+        if geo_data['provincias'] is None:
+            st.info("Mapa no disponible: falta preparar la capa de provincias (python mapas.py)")
+        else:
+            map_fig_prov = create_province_map(df_prov, *geo_data['provincias'], value_col='online', pct_col='%_online')
+            plotly_chart(map_fig_prov, use_container_width=True)
     # with col_tab2_prov_2:
     #     chart, chart_df = create_province_barchart(df_prov, value_col='online', pct_col='%_online')
-    #     st.plotly_chart(chart, use_container_width=True)
+    #     plotly_chart(chart, use_container_width=True)
     
     st.divider()
     
     st.subheader("Expedientes telemáticos por Municipio")
     col_tab2_mun_1, col_tab2_mun_2 = st.columns([0.7, 0.3])
     with col_tab2_mun_1:
-        map_fig_mun = create_municipio_map(df_mun, geo_data['municipios'], value_col='online', pct_col='%_online')
-        st.plotly_chart(map_fig_mun, use_container_width=True)
+        if geo_data['municipios'] is None:
+            st.info("Mapa no disponible: falta preparar la capa de municipios (python mapas.py)")
+        else:
+            map_fig_mun = create_municipio_map(df_mun, *geo_data['municipios'], value_col='online', pct_col='%_online')
+            plotly_chart(map_fig_mun, use_container_width=True)
     # with col_tab2_mun_2:
     #     chart_mun, chart_df_mun = create_municipios_barchart(df_mun, value_col='online', pct_col='%_online')
-    #     st.plotly_chart(chart_mun, use_container_width=True)
+    #     plotly_chart(chart_mun, use_container_width=True)
     
     st.caption(f"*Los porcentajes se calculan sobre el total de trámites en cada área geográfica. Datos actualizados al {datetime.today().strftime('%d/%m/%Y')}*")
 
@@ -317,22 +299,28 @@ with tab3:
     
     col_tab3_prov_1, col_tab3_prov_2 = st.columns([0.7, 0.3])
     with col_tab3_prov_1:
-        map_fig_prov = create_province_map(df_prov, geo_data['provincias'], value_col='empresas', pct_col='%_empresas')
-        st.plotly_chart(map_fig_prov, use_container_width=True)
+        if geo_data['provincias'] is None:
+            st.info("Mapa no disponible: falta preparar la capa de provincias (python mapas.py)")
+        else:
+            map_fig_prov = create_province_map(df_prov, *geo_data['provincias'], value_col='empresas', pct_col='%_empresas')
+            plotly_chart(map_fig_prov, use_container_width=True)
     # with col_tab3_prov_2:
     #     chart, chart_df = create_province_barchart(df_prov, value_col='empresas', pct_col='%_empresas')
-    #     st.plotly_chart(chart, use_container_width=True)
+    #     plotly_chart(chart, use_container_width=True)
     
     st.divider()
     
     st.subheader("Expedientes de persona jurídica por Municipio")
     col_tab3_mun_1, col_tab3_mun_2 = st.columns([0.7, 0.3])
     with col_tab3_mun_1:
-        map_fig_mun = create_municipio_map(df_mun, geo_data['municipios'], value_col='empresas', pct_col='%_empresas')
-        st.plotly_chart(map_fig_mun, use_container_width=True)
+        if geo_data['municipios'] is None:
+            st.info("Mapa no disponible: falta preparar la capa de municipios (python mapas.py)")
+        else:
+            map_fig_mun = create_municipio_map(df_mun, *geo_data['municipios'], value_col='empresas', pct_col='%_empresas')
+            plotly_chart(map_fig_mun, use_container_width=True)
     # with col_tab3_mun_2:
     #     chart_mun, chart_df_mun = create_municipios_barchart(df_mun, value_col='empresas', pct_col='%_empresas')
-    #     st.plotly_chart(chart_mun, use_container_width=True)
+    #     plotly_chart(chart_mun, use_container_width=True)
     
     st.caption(f"*Los porcentajes se calculan sobre el total de trámites en cada área geográfica. Datos actualizados al {datetime.today().strftime('%d/%m/%Y')}*")
 
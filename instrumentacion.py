@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentación opcional de la aplicación, para localizar dónde se va el tiempo de
+una página (lectura de parquet, agregaciones, bucles o serialización de Plotly).
+
+Se activa al arrancar con la variable de entorno CUADRO_MANDO_INSTRUMENTACION=1:
+
+    CUADRO_MANDO_INSTRUMENTACION=1 streamlit run app.py
+
+Las páginas usan cache_data, cache_resource y plotly_chart de este módulo en lugar de
+los de streamlit. Sin la variable son exactamente los de streamlit (sin coste). Con
+ella se anota cada llamada:
+
+- funciones cacheadas: tiempo, acierto o fallo de caché (la función solo se ejecuta
+  en los fallos) y filas de los DataFrames de entrada y de salida.
+- cargas del registro de datos (registro_medido): lo mismo para carga_datos_base y
+  filtra_datos_fechas a través de registro().adquiere y registro().rango.
+- gráficos: tamaño en bytes de la figura serializada a JSON, tiempo de serialización
+  y tiempo total de st.plotly_chart.
+
+Las anotaciones son de todo el proceso (todas las sesiones) y se ven en la página
+oculta "Rendimiento" (rendimiento.py, /rendimiento), que también las exporta en JSON.
+Se guardan los totales de cada función y gráfico y las últimas MAX_EVENTOS llamadas.
+"""
+import datetime
+import functools
+import inspect
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from registro_datos import id_sesion
+
+ACTIVA = os.environ.get("CUADRO_MANDO_INSTRUMENTACION", "") not in ("", "0")
+MAX_EVENTOS = 5000
+
+
+def _filas(valor):
+    """Filas de un DataFrame, Series o array, o suma de las de los DataFrames de un dict, tupla o lista"""
+    if isinstance(valor, (pd.DataFrame, pd.Series, np.ndarray)):
+        return len(valor)
+    if isinstance(valor, dict):
+        partes = valor.values()
+    elif isinstance(valor, (tuple, list)):
+        partes = valor
+    else:
+        return None
+    marcos = [len(p) for p in partes if isinstance(p, (pd.DataFrame, pd.Series))]
+    return sum(marcos) if marcos else None
+
+
+def _filas_argumentos(firma, args, kwargs):
+    """{parámetro: filas} de los argumentos con tablas"""
+    try:
+        argumentos = firma.bind(*args, **kwargs).arguments
+    except TypeError:
+        return {}
+    filas = {nombre: _filas(valor) for nombre, valor in argumentos.items()}
+    return {nombre: n for nombre, n in filas.items() if n is not None}
+
+
+class Anotaciones:
+    """Totales por función o gráfico y últimas llamadas, compartidos por todas las sesiones"""
+
+    def __init__(self, max_eventos=MAX_EVENTOS):
+        self._lock = threading.Lock()
+        self._totales = {}
+        self._eventos = deque(maxlen=max_eventos)
+        self.desde = datetime.datetime.now()
+
+    def anota(self, evento):
+        evento = {'momento': datetime.datetime.now().isoformat(timespec='milliseconds'),
+                  'sesion': id_sesion(), **evento}
+        with self._lock:
+            clave = (evento['tipo'], evento['pagina'], evento['nombre'])
+            total = self._totales.setdefault(clave, {
+                'tipo': evento['tipo'], 'pagina': evento['pagina'], 'nombre': evento['nombre'],
+                'llamadas': 0, 'aciertos': 0, 'fallos': 0, 'segundos': 0.0, 'segundos_max': 0.0,
+                'segundos_fallos': 0.0, 'bytes': 0, 'bytes_max': 0, 'filas_max': 0
+            })
+            total['llamadas'] += 1
+            total['segundos'] += evento['segundos']
+            total['segundos_max'] = max(total['segundos_max'], evento['segundos'])
+            if evento.get('acierto') is True:
+                total['aciertos'] += 1
+            elif evento.get('acierto') is False:
+                total['fallos'] += 1
+                total['segundos_fallos'] += evento['segundos']
+            if 'bytes' in evento:
+                total['bytes'] += evento['bytes']
+                total['bytes_max'] = max(total['bytes_max'], evento['bytes'])
+            filas = list(evento.get('filas_entrada', {}).values()) + [evento.get('filas_salida') or 0]
+            total['filas_max'] = max(total['filas_max'], *filas)
+            self._eventos.append(evento)
+
+    def totales(self):
+        with self._lock:
+            return [dict(t) for t in self._totales.values()]
+
+    def eventos(self):
+        with self._lock:
+            return list(self._eventos)
+
+    def reinicia(self):
+        with self._lock:
+            self._totales.clear()
+            self._eventos.clear()
+            self.desde = datetime.datetime.now()
+
+    def exporta(self):
+        """Totales y últimas llamadas como dict serializable a JSON"""
+        return {
+            'fecha': datetime.datetime.now().isoformat(timespec='seconds'),
+            'desde': self.desde.isoformat(timespec='seconds'),
+            'totales': self.totales(),
+            'eventos': self.eventos()
+        }
+
+
+@st.cache_resource
+def anotaciones():
+    """Anotaciones únicas para todo el proceso de streamlit"""
+    return Anotaciones()
+
+
+def _pagina(codigo):
+    return os.path.basename(codigo.co_filename)
+
+
+def _instrumenta(decorador, tipo, funcion, opciones):
+    """Aplica el decorador de caché de streamlit a la función anotando cada llamada"""
+    ejecutada = threading.local()
+    firma = inspect.signature(funcion)
+
+    # Con functools.wraps streamlit ve el nombre, el código y los parámetros de la
+    # función original, así que las claves de caché no cambian
+    @functools.wraps(funcion)
+    def calculo(*args, **kwargs):
+        ejecutada.valor = True
+        return funcion(*args, **kwargs)
+
+    cacheada = decorador(calculo, **opciones)
+
+    @functools.wraps(funcion)
+    def llamada(*args, **kwargs):
+        ejecutada.valor = False
+        inicio = time.perf_counter()
+        resultado = cacheada(*args, **kwargs)
+        anotaciones().anota({
+            'tipo': tipo,
+            'pagina': _pagina(funcion.__code__),
+            'nombre': funcion.__qualname__,
+            'segundos': time.perf_counter() - inicio,
+            'acierto': not ejecutada.valor,
+            'filas_entrada': _filas_argumentos(firma, args, kwargs),
+            'filas_salida': _filas(resultado)
+        })
+        return resultado
+
+    llamada.clear = cacheada.clear
+    return llamada
+
+
+def cache_data(funcion=None, **opciones):
+    """st.cache_data, anotando cada llamada si la instrumentación está activa"""
+    if funcion is None:
+        return functools.partial(cache_data, **opciones)
+    if not ACTIVA:
+        return st.cache_data(funcion, **opciones)
+    return _instrumenta(st.cache_data, 'cache_data', funcion, opciones)
+
+
+def cache_resource(funcion=None, **opciones):
+    """st.cache_resource, anotando cada llamada si la instrumentación está activa"""
+    if funcion is None:
+        return functools.partial(cache_resource, **opciones)
+    if not ACTIVA:
+        return st.cache_resource(funcion, **opciones)
+    return _instrumenta(st.cache_resource, 'cache_resource', funcion, opciones)
+
+
+def registro_medido(metodo, *args):
+    """
+    Llama a un método del registro de datos (registro().adquiere o registro().rango)
+    cuyo último argumento es la función de carga, anotando si se ejecutó la carga
+    """
+    if not ACTIVA:
+        return metodo(*args)
+    *resto, cargador = args
+    cargas = []
+
+    def carga(*a):
+        cargas.append(True)
+        return cargador(*a)
+
+    inicio = time.perf_counter()
+    resultado = metodo(*resto, carga)
+    anotaciones().anota({
+        'tipo': 'registro',
+        'pagina': _pagina(inspect.currentframe().f_back.f_code),
+        'nombre': cargador.__name__,
+        'segundos': time.perf_counter() - inicio,
+        'acierto': not cargas,
+        'filas_entrada': {},
+        'filas_salida': _filas(resultado)
+    })
+    return resultado
+
+
+def plotly_chart(fig, *args, **kwargs):
+    """st.plotly_chart, anotando el tamaño de la figura serializada si la instrumentación está activa"""
+    if not ACTIVA:
+        return st.plotly_chart(fig, *args, **kwargs)
+    llamante = inspect.currentframe().f_back
+    inicio = time.perf_counter()
+    tamano = len(fig.to_json().encode())
+    serializacion = time.perf_counter() - inicio
+    elemento = st.plotly_chart(fig, *args, **kwargs)
+    titulo = fig.layout.title.text
+    anotaciones().anota({
+        'tipo': 'grafico',
+        'pagina': _pagina(llamante.f_code),
+        'nombre': f"línea {llamante.f_lineno}" + (f": {titulo}" if titulo else ""),
+        'segundos': time.perf_counter() - inicio,
+        'segundos_serializacion': serializacion,
+        'bytes': tamano,
+        'trazas': len(fig.data),
+        'puntos': sum(len(t.x) if getattr(t, 'x', None) is not None else 0 for t in fig.data)
+    })
+    return elemento
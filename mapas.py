@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Geometrías simplificadas de provincias y municipios para los mapas.
+
+Preparación (una vez, o cuando cambien las fuentes):
+
+    python mapas.py                      # todas las capas con fuente en data/geo
+    python mapas.py provincias           # solo las indicadas
+
+Para cada capa se lee el GeoJSON fuente, se cuantizan las coordenadas y los anillos
+se parten en arcos compartidos (como en TopoJSON): un límite entre dos provincias
+es un único arco que usan las dos. Cada arco se simplifica una vez por tolerancia
+(Douglas-Peucker con los extremos fijos), así que las fronteras simplificadas siguen
+encajando sin huecos ni solapes. Se guarda en data/geo/<capa>_simplificado.json con
+los arcos de cada tolerancia codificados en deltas enteras, y las features con su
+código INE en 'codigo'.
+
+En la aplicación lee_capa y geojson_capa dan el GeoJSON de una tolerancia sin
+necesitar geopandas, y nivel_para_zoom elige la tolerancia más ligera que no se
+aprecia al zoom del mapa.
+"""
+import json
+import os
+import sys
+
+import numpy as np
+
+RUTA_GEO = "data/geo"
+# Capa -> (fichero fuente, propiedad con el código INE)
+FUENTES = {
+    'provincias': ('provincias_id_ine.geojson', 'codigo'),
+    'municipios': ('municipios_id_ine_simple.geojson', 'CODIGOINE')
+}
+TOLERANCIAS = (0.002, 0.01, 0.04)   # grados
+CUANTIZACION = 1e-5                 # grados (~1 m)
+
+
+def ruta_capa(capa):
+    return f"{RUTA_GEO}/{capa}_simplificado.json"
+
+
+# PREPARACIÓN
+#############
+
+def _anillos(geometria):
+    """Polígonos de una geometría como listas de anillos"""
+    if geometria['type'] == 'Polygon':
+        return [geometria['coordinates']]
+    if geometria['type'] == 'MultiPolygon':
+        return geometria['coordinates']
+    return []
+
+
+def _douglas_peucker(puntos, tolerancia):
+    """Índices de los puntos que se conservan (extremos incluidos)"""
+    conservar = np.zeros(len(puntos), dtype=bool)
+    conservar[0] = conservar[-1] = True
+    pendientes = [(0, len(puntos) - 1)]
+    while pendientes:
+        inicio, fin = pendientes.pop()
+        if fin - inicio < 2:
+            continue
+        a, b = puntos[inicio], puntos[fin]
+        tramo = puntos[inicio + 1:fin]
+        ab = b - a
+        longitud = np.hypot(*ab)
+        if longitud == 0:
+            distancias = np.hypot(*(tramo - a).T)
+        else:
+            distancias = np.abs(ab[0] * (tramo[:, 1] - a[1]) - ab[1] * (tramo[:, 0] - a[0])) / longitud
+        mayor = int(np.argmax(distancias))
+        if distancias[mayor] > tolerancia:
+            medio = inicio + 1 + mayor
+            conservar[medio] = True
+            pendientes += [(inicio, medio), (medio, fin)]
+    # Un arco cerrado (anillo entero) necesita al menos 4 puntos para seguir siendo un anillo
+    if (puntos[0] == puntos[-1]).all() and conservar.sum() < 4 and len(puntos) >= 4:
+        lejanos = np.argsort(np.hypot(*(puntos - puntos[0]).T))[::-1]
+        conservar[[i for i in lejanos if not conservar[i]][:4 - conservar.sum()]] = True
+    return np.flatnonzero(conservar)
+
+
+def construye_topologia(features, propiedad_codigo):
+    """
+    Parte los anillos de las features en arcos compartidos. Devuelve (arcos, features)
+    con arcos como arrays de puntos cuantizados y features como {'codigo', 'poligonos'},
+    donde cada anillo es una lista de índices de arco (~i = arco i recorrido al revés).
+    """
+    anillos = []        # (feature, polígono, anillo, puntos enteros sin repetir el cierre)
+    for i, feature in enumerate(features):
+        for j, poligono in enumerate(_anillos(feature['geometry'])):
+            for anillo in poligono:
+                puntos = np.round(np.asarray(anillo, dtype=float) / CUANTIZACION).astype('int64')
+                # Sin puntos consecutivos repetidos ni el punto de cierre
+                puntos = puntos[np.r_[True, (np.diff(puntos, axis=0) != 0).any(axis=1)]]
+                if len(puntos) > 1 and (puntos[0] == puntos[-1]).all():
+                    puntos = puntos[:-1]
+                if len(puntos) >= 3:
+                    anillos.append((i, j, puntos))
+
+    # Anillos que usan cada arista (sin orientación)
+    duenos = {}
+    for k, (_, _, puntos) in enumerate(anillos):
+        siguientes = np.roll(puntos, -1, axis=0)
+        for p, q in zip(map(tuple, puntos), map(tuple, siguientes)):
+            duenos.setdefault((min(p, q), max(p, q)), set()).add(k)
+
+    arcos, indice_arcos = [], {}
+
+    def registra(puntos):
+        clave = puntos.tobytes()
+        if clave in indice_arcos:
+            return indice_arcos[clave]
+        inverso = puntos[::-1].copy().tobytes()
+        if inverso in indice_arcos:
+            return ~indice_arcos[inverso]
+        indice_arcos[clave] = len(arcos)
+        arcos.append(puntos)
+        return len(arcos) - 1
+
+    resultado = [{'codigo': str(f['properties'].get(propiedad_codigo)), 'poligonos': {}} for f in features]
+    for i, j, puntos in anillos:
+        n = len(puntos)
+        aristas = [duenos[(min(p, q), max(p, q))] for p, q in
+                   zip(map(tuple, puntos), map(tuple, np.roll(puntos, -1, axis=0)))]
+        # Un vértice es unión si cambian los anillos que comparten la arista anterior y la siguiente
+        uniones = [v for v in range(n) if aristas[v - 1] != aristas[v]]
+        if not uniones:
+            # Anillo sin uniones: un solo arco cerrado, empezando en el menor punto para
+            # que el mismo anillo en otra feature dé el mismo arco
+            inicio = int(np.lexsort(puntos.T[::-1])[0])
+            rotado = np.roll(puntos, -inicio, axis=0)
+            indices = [registra(np.vstack([rotado, rotado[:1]]))]
+        else:
+            rotado = np.roll(puntos, -uniones[0], axis=0)
+            cortes = [u - uniones[0] for u in uniones] + [n]
+            cerrado = np.vstack([rotado, rotado[:1]])
+            indices = [registra(cerrado[a:b + 1].copy()) for a, b in zip(cortes[:-1], cortes[1:])]
+        resultado[i]['poligonos'].setdefault(j, []).append(indices)
+
+    for feature in resultado:
+        feature['poligonos'] = [feature['poligonos'][j] for j in sorted(feature['poligonos'])]
+    return arcos, resultado
+
+
+def _codifica(puntos):
+    """Puntos enteros como lista plana de deltas [x0, y0, dx1, dy1, ...]"""
+    return np.diff(puntos, axis=0, prepend=np.zeros((1, 2), dtype='int64')).ravel().tolist()
+
+
+def prepara_capa(capa, tolerancias=TOLERANCIAS):
+    """Genera el fichero simplificado de una capa a partir de su GeoJSON fuente"""
+    fichero, propiedad_codigo = FUENTES[capa]
+    with open(f"{RUTA_GEO}/{fichero}", encoding='utf-8') as f:
+        features = json.load(f)['features']
+    arcos, features = construye_topologia(features, propiedad_codigo)
+    niveles = {}
+    for tolerancia in tolerancias:
+        tolerancia_int = tolerancia / CUANTIZACION
+        niveles[str(tolerancia)] = [_codifica(a[_douglas_peucker(a, tolerancia_int)]) for a in arcos]
+    with open(ruta_capa(capa), "w", encoding='utf-8') as f:
+        json.dump({
+            'cuantizacion': CUANTIZACION,
+            'tolerancias': list(tolerancias),
+            'features': features,
+            'niveles': niveles
+        }, f, separators=(',', ':'))
+    return len(features), len(arcos)
+
+
+# CARGA
+#######
+
+def nivel_para_zoom(tolerancias, zoom):
+    """Tolerancia más ligera que no supera el tamaño de un píxel al zoom indicado"""
+    grados_por_pixel = 360 / (256 * 2 ** zoom)
+    adecuadas = [t for t in tolerancias if t <= grados_por_pixel]
+    return max(adecuadas) if adecuadas else min(tolerancias)
+
+
+def lee_capa(capa):
+    """Contenido del fichero simplificado de una capa, o None si no se ha preparado"""
+    if not os.path.exists(ruta_capa(capa)):
+        return None
+    with open(ruta_capa(capa), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def geojson_capa(datos_capa, tolerancia):
+    """GeoJSON (FeatureCollection con properties.codigo) de una capa a la tolerancia indicada"""
+    escala = datos_capa['cuantizacion']
+    arcos = [
+        (np.cumsum(np.asarray(a, dtype='int64').reshape(-1, 2), axis=0) * escala).round(6)
+        for a in datos_capa['niveles'][str(tolerancia)]
+    ]
+
+    def anillo(indices):
+        partes = [arcos[i] if i >= 0 else arcos[~i][::-1] for i in indices]
+        # Los arcos consecutivos comparten extremo: se omite el primer punto de cada uno salvo el primero
+        return np.vstack([partes[0]] + [p[1:] for p in partes[1:]]).tolist()
+
+    def poligonos(feature):
+        # A tolerancias altas un anillo pequeño puede quedar en menos de 4 puntos: se descarta
+        resultado = []
+        for poligono in feature['poligonos']:
+            anillos = [anillo(a) for a in poligono]
+            if len(anillos[0]) >= 4:
+                resultado.append([a for a in anillos if len(a) >= 4])
+        return resultado
+
+    return {
+        'type': 'FeatureCollection',
+        'features': [
+            {
+                'type': 'Feature',
+                'properties': {'codigo': feature['codigo']},
+                'geometry': {
+                    'type': 'MultiPolygon',
+                    'coordinates': poligonos(feature)
+                }
+            }
+            for feature in datos_capa['features']
+        ]
+    }
+
+
+if __name__ == "__main__":
+    capas = sys.argv[1:] or [c for c, (fichero, _) in FUENTES.items() if os.path.exists(f"{RUTA_GEO}/{fichero}")]
+    for capa in capas:
+        n_features, n_arcos = prepara_capa(capa)
+        print(f"{capa}: {n_features} features, {n_arcos} arcos -> {ruta_capa(capa)}")
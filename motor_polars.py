@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Motor Polars de las agrupaciones pesadas de las páginas de flujos, estados y evolución
+de la tramitación: identificación de flujos y duración media de sus pasos, estadísticas
+de transiciones, cubo de tramitación e inicios frente a completados.
+
+Se activa con la variable de entorno CUADRO_MANDO_MOTOR=polars (por defecto 'pandas').
+Polars es opcional (pip install polars): si no está instalado se avisa y analitica.py y
+cubo_tramitacion.py siguen con pandas. Cada cálculo es una consulta perezosa (LazyFrame)
+sobre los arrays planos del almacén de secuencias o de la tabla de trámites, que Polars
+optimiza y ejecuta en varios hilos (POLARS_MAX_THREADS, por defecto todos los núcleos);
+el resultado se convierte a pandas o numpy al salir, con las mismas columnas, tipos y
+orden que la función pandas equivalente.
+"""
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+
+MOTOR = os.environ.get("CUADRO_MANDO_MOTOR", "pandas")
+if MOTOR not in ("pandas", "polars"):
+    raise ValueError(f"Motor desconocido: {MOTOR} (posibles: pandas, polars)")
+
+# polars solo se importa si se usa: cuesta ~100 ms en el arranque de cada página
+pl = None
+if MOTOR == "polars":
+    try:
+        import polars as pl
+    except ImportError:
+        warnings.warn("polars no está instalado: los cálculos usan pandas")
+ACTIVO = pl is not None
+
+# Frecuencias de las páginas (to_period) como intervalos de dt.truncate
+FRECUENCIAS = {'D': '1d', 'W': '1w', 'M': '1mo'}
+
+
+def _pasos(secuencias):
+    """
+    LazyFrame con una fila por paso del almacén: exp (posición del expediente), paso
+    (posición en su secuencia), ultimo, num_tramite y duration
+    """
+    offsets = secuencias['offsets']
+    n_pasos = np.diff(offsets)
+    paso = np.arange(offsets[-1]) - np.repeat(offsets[:-1], n_pasos)
+    return pl.LazyFrame({
+        'exp': np.repeat(np.arange(len(n_pasos), dtype='int64'), n_pasos),
+        'paso': paso,
+        'ultimo': paso == np.repeat(n_pasos - 1, n_pasos),
+        'num_tramite': secuencias['num_tramite'],
+        'duration': secuencias['duration'].astype('float64')
+    })
+
+
+def identifica_flujos(secuencias):
+    """secuencias.identifica_flujos: flow_id por orden de primera aparición de cada secuencia"""
+    n_expedientes = len(secuencias['expedientes'])
+    por_exp = _pasos(secuencias).group_by('exp', maintain_order=True).agg(pl.col('num_tramite'))
+    flujos = por_exp.select(pl.col('num_tramite').unique(maintain_order=True)).with_row_index('flow_id')
+    por_exp, flujos = pl.collect_all([
+        por_exp.join(flujos, on='num_tramite', how='left', maintain_order='left'),
+        flujos
+    ])
+    flow_id = np.full(n_expedientes, -1, dtype='int64')
+    flow_id[por_exp['exp'].to_numpy()] = por_exp['flow_id'].to_numpy()
+    tuplas = np.empty(len(flujos), dtype=object)
+    tuplas[:] = [tuple(s) for s in flujos['num_tramite'].to_list()]
+    return flow_id, tuplas
+
+
+def duraciones_medias_por_paso(secuencias, claves):
+    """secuencias.duraciones_medias_por_paso: Series con índice (claves..., paso)"""
+    columnas = list(claves.columns)
+    seleccion = pl.from_pandas(claves.reset_index(drop=True)).lazy().with_columns(
+        exp=pl.Series(claves.index.to_numpy().astype('int64'))
+    )
+    medias = (
+        _pasos(secuencias)
+        .filter(~pl.col('ultimo'))
+        .join(seleccion, on='exp', how='inner')
+        .group_by(columnas + ['paso'])
+        .agg(pl.col('duration').mean())
+        .sort(columnas + ['paso'])
+        .collect()
+        .to_pandas()
+    )
+    return medias.set_index(columnas + ['paso'])['duration']
+
+
+def calculate_transition_stats(secuencias, mascara_estados):
+    """
+    analitica.calculate_transition_stats: la transición de cada paso va al siguiente
+    (shift) salvo que cambie el expediente; estadísticas globales y por unidad
+    """
+    codigo_unidad, unidades = pd.factorize(secuencias['expedientes']['unidad_tramitadora'], sort=True)
+    n_pasos = np.diff(secuencias['offsets'])
+    transiciones = (
+        _pasos(secuencias)
+        .with_columns(
+            unidad=pl.Series(np.repeat(codigo_unidad, n_pasos)),
+            seleccionado=pl.Series(np.repeat(np.asarray(mascara_estados, dtype=bool), n_pasos))
+        )
+        .with_columns(tgt=pl.col('num_tramite').shift(-1))
+        .filter(~pl.col('ultimo') & pl.col('seleccionado'))
+        .select(pl.col('num_tramite').alias('src'), 'tgt', 'unidad', 'duration')
+    )
+
+    def estadisticas(claves):
+        return (
+            transiciones.group_by(claves)
+            .agg(
+                count=pl.len().cast(pl.Int64),
+                sum=pl.col('duration').sum(),
+                mean=pl.col('duration').mean(),
+                median=pl.col('duration').median(),
+                p90=pl.col('duration').quantile(0.9, interpolation='linear')
+            )
+            .sort(claves)
+        )
+
+    stats, stats_grouped = (
+        df.to_pandas() for df in pl.collect_all([estadisticas(['src', 'tgt']), estadisticas(['src', 'tgt', 'unidad'])])
+    )
+    stats_grouped['unidad'] = unidades.take(stats_grouped['unidad'].to_numpy())
+    return stats, stats_grouped
+
+
+def cuenta_tramites(tramites, firma):
+    """
+    Agrupación del cubo de cubo_tramitacion.construye_cubo_tramitacion: trámites por
+    (fecha, num_tramite, unidad_tramitadora, firma) en 'count'
+    """
+    cubo = (
+        pl.LazyFrame({
+            'fecha': tramites['fecha_tramite'].to_numpy(),
+            'num_tramite': tramites['num_tramite'].to_numpy(),
+            'unidad_tramitadora': tramites['unidad_tramitadora'].cat.codes.to_numpy(),
+            'firma': np.asarray(firma, dtype='int64')
+        })
+        .filter(pl.col('unidad_tramitadora') >= 0)
+        .group_by(pl.col('fecha').dt.truncate('1d'), 'num_tramite', 'unidad_tramitadora', 'firma')
+        .agg(count=pl.len().cast(pl.Int64))
+        .sort('fecha', 'num_tramite', 'unidad_tramitadora', 'firma')
+        .collect()
+        .to_pandas()
+    )
+    cubo['unidad_tramitadora'] = pd.Categorical.from_codes(
+        cubo['unidad_tramitadora'].to_numpy(), dtype=tramites['unidad_tramitadora'].dtype
+    )
+    return cubo
+
+
+def process_starts_vs_completed(tramites_df, ids_completados, hay_seleccion, freq):
+    """
+    analitica.process_starts_vs_completed con freq en FRECUENCIAS ('completed' es siempre
+    entero; en pandas pasa a float cuando algún periodo no tiene completados)
+    """
+    completados = pl.Series(np.asarray(ids_completados if hay_seleccion else [], dtype='int64'))
+    starts = (
+        pl.LazyFrame({
+            'id_exp': tramites_df['id_exp'].to_numpy().astype('int64'),
+            'fecha': tramites_df['fecha_tramite'].to_numpy(),
+            'num_tramite': tramites_df['num_tramite'].to_numpy()
+        })
+        .with_row_index('position')
+        .filter(pl.col('num_tramite') == 0)
+        .with_columns(pl.col('fecha').dt.truncate(FRECUENCIAS[freq]), completado=pl.col('id_exp').is_in(completados))
+    )
+    merged, not_completed = pl.collect_all([
+        starts.group_by('fecha').agg(
+            total_starts=pl.col('id_exp').n_unique().cast(pl.Int64),
+            completed=pl.col('id_exp').filter(pl.col('completado')).n_unique().cast(pl.Int64)
+        ).sort('fecha'),
+        # Inicios no completados agrupados por periodo, en su orden original dentro de cada uno
+        starts.filter(~pl.col('completado')).sort('fecha', maintain_order=True).select('fecha', 'position')
+    ])
+    merged = merged.to_pandas()
+
+    periods, counts = np.unique(not_completed['fecha'].to_numpy(), return_counts=True)
+    offsets = np.zeros(len(periods) + 1, dtype='int64')
+    np.cumsum(counts, out=offsets[1:])
+    period_index = {
+        'periods': periods,
+        'offsets': offsets,
+        'positions': not_completed['position'].to_numpy().astype('int64')
+    }
+    return merged, period_index
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+Particiones mensuales de los expedientes y trámites de un procedimiento.
+
+En lugar de un único expedientes.parquet y tramites.parquet, cada tabla se puede guardar
+en un fichero por mes de registro del expediente, en directorios al estilo hive:
+
+    data/tratados/<codigo>/expedientes/mes=2023-05/datos.parquet
+    data/tratados/<codigo>/tramites/mes=2023-05/datos.parquet
+    data/tratados/<codigo>/particiones.json            manifiesto: filas, fechas y bytes de cada mes
+    data/tratados/<codigo>/particiones_indice.parquet  mes de cada id_exp
+
+Los trámites van en la partición del mes de registro de su expediente, así que un rango
+de fechas de registro se lee solo con los ficheros de los meses que lo solapan
+(ficheros(codigo, tabla, rango_fechas)). Los expedientes sin fecha de registro van en
+mes=sin_fecha, que solo se lee con la tabla completa. Los procedimientos sin manifiesto
+siguen usando los ficheros únicos.
+
+    python particiones.py 884                      # parte expedientes.parquet y tramites.parquet
+    python particiones.py 884 --ingesta carpeta    # añade o sustituye los expedientes de una exportación
+
+La ingesta recibe expedientes completos: la fila del expediente y todos sus trámites.
+Cada expediente sustituye al que hubiera con el mismo id_exp (esté en el mes que esté) y
+solo se reescriben los meses afectados. Los trámites de un expediente sin fila en la
+exportación sustituyen a todos los trámites de ese expediente, que ya debe existir.
+Las particiones se escriben antes que el índice y el manifiesto: si la ingesta se
+interrumpe, basta con repetirla.
+
+Todos los ficheros (particiones o únicos) se escriben ordenados, los expedientes por
+fecha de registro y los trámites por id_exp, en grupos de FILAS_GRUPO filas, con zstd y
+diccionarios. Así las estadísticas mínimo/máximo de cada grupo permiten a lee_tabla
+saltarse los grupos que no cumplen los filtros (fecha de registro en los expedientes,
+id_exp en los trámites) sin leerlos. Los ficheros escritos antes se reescriben con
+
+    python particiones.py 884 --ordena
+"""
+import argparse
+import json
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+RUTA_TRATADOS = "data/tratados"
+TABLAS = ("expedientes", "tramites")
+FICHERO_MANIFIESTO = "particiones.json"
+FICHERO_INDICE = "particiones_indice.parquet"
+SIN_FECHA = "sin_fecha"
+# Columna por la que se ordena cada tabla: la de los filtros de carga_datos.py
+ORDEN = {'expedientes': 'fecha_registro_exp', 'tramites': 'id_exp'}
+# Grupos pequeños para que los rangos de unos meses se salten el resto del fichero
+# incluso en los procedimientos medianos (unas decenas de miles de expedientes)
+FILAS_GRUPO = 16384
+COMPRESION = "zstd"
+
+
+def ruta_particion(codigo, tabla, mes):
+    return f"{RUTA_TRATADOS}/{codigo}/{tabla}/mes={mes}/datos.parquet"
+
+
+def lee_manifiesto(codigo):
+    """{'meses': {mes: {...}}} del procedimiento, o None si no está particionado"""
+    try:
+        with open(f"{RUTA_TRATADOS}/{codigo}/{FICHERO_MANIFIESTO}", encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def meses_rango(meses, rango_fechas):
+    """Meses (AAAA-MM, ordenados) que solapan el rango [inicio, fin] de fechas de registro"""
+    desde, hasta = (f"{fecha:%Y-%m}" for fecha in rango_fechas)
+    return sorted(m for m in meses if m != SIN_FECHA and desde <= m <= hasta)
+
+
+def ficheros(codigo, tabla, rango_fechas=None):
+    """
+    Ficheros parquet de una tabla ('expedientes' o 'tramites'): las particiones de los
+    meses que solapan rango_fechas (todas si es None) o el fichero único si el
+    procedimiento no está particionado. Si ningún mes solapa el rango se devuelve el
+    primero: los filtros de fechas lo dejan vacío y, como con el fichero único, el rango
+    da tablas vacías con sus columnas y tipos en lugar de un error.
+    """
+    manifiesto = lee_manifiesto(codigo)
+    if manifiesto is None:
+        return [f"{RUTA_TRATADOS}/{codigo}/{tabla}.parquet"]
+    meses = sorted(manifiesto['meses'])
+    if rango_fechas is not None:
+        meses = meses_rango(meses, rango_fechas) or meses[:1]
+    return [ruta_particion(codigo, tabla, mes) for mes in meses]
+
+
+def lee_tabla(rutas, columns=None, filters=None):
+    """
+    Lee y concatena los ficheros de una tabla. Los filtros (formato de pd.read_parquet)
+    se resuelven en el lector: los grupos de filas que no pueden cumplirlos según sus
+    estadísticas no se leen.
+    """
+    if not rutas:
+        raise FileNotFoundError("No hay particiones para el rango indicado")
+    return pd.read_parquet(rutas if len(rutas) > 1 else rutas[0], columns=columns, filters=filters)
+
+
+def bytes_lectura(rutas, columns=None, filters=None):
+    """Bytes (comprimidos) de las columnas y grupos de filas que lee lee_tabla con esos filtros"""
+    filtro = pq.filters_to_expression(filters) if filters else None
+    total = 0
+    for fragmento in ds.dataset(rutas, format="parquet").get_fragments():
+        metadatos = fragmento.metadata
+        nombres = metadatos.schema.names
+        indices = [nombres.index(c) for c in columns] if columns else range(len(nombres))
+        grupos = fragmento.subset(filtro).row_groups if filtro is not None else fragmento.row_groups
+        total += sum(metadatos.row_group(g.id).column(i).total_compressed_size for g in grupos for i in indices)
+    return total
+
+
+def escribe_tabla(ruta, tabla, nombre):
+    """Escribe una tabla de Arrow ('expedientes' o 'tramites') ordenada por su columna de ORDEN"""
+    columna = ORDEN[nombre]
+    # sort_indices es estable: el orden previo se mantiene dentro de cada valor
+    tabla = tabla.take(pc.sort_indices(tabla, sort_keys=[(columna, 'ascending')]))
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    pq.write_table(
+        tabla, f"{ruta}.tmp",
+        row_group_size=FILAS_GRUPO,
+        compression=COMPRESION,
+        use_dictionary=True,
+        sorting_columns=[pq.SortingColumn(tabla.schema.get_field_index(columna))]
+    )
+    os.replace(f"{ruta}.tmp", ruta)
+
+
+def _mes(fechas):
+    return pd.Series(fechas).dt.strftime('%Y-%m').fillna(SIN_FECHA).to_numpy(dtype=object)
+
+
+def _lee_indice(codigo):
+    """Serie id_exp -> mes de las particiones actuales"""
+    ruta = f"{RUTA_TRATADOS}/{codigo}/{FICHERO_INDICE}"
+    if not os.path.exists(ruta):
+        return pd.Series([], index=pd.Index([], dtype='uint32', name='id_exp'), dtype=object, name='mes')
+    indice = pd.read_parquet(ruta)
+    return pd.Series(indice['mes'].astype(object).to_numpy(), index=indice['id_exp'], name='mes')
+
+
+def _esquema(codigo, tabla, df):
+    """Esquema de Arrow de las particiones existentes (o del fichero único), para que todas coincidan"""
+    for ruta in ficheros(codigo, tabla) + [f"{RUTA_TRATADOS}/{codigo}/{tabla}.parquet"]:
+        if os.path.exists(ruta):
+            return pq.read_schema(ruta).remove_metadata()
+    return pa.Schema.from_pandas(df, preserve_index=False).remove_metadata()
+
+
+def ingesta(codigo, expedientes, tramites):
+    """
+    Añade o sustituye expedientes completos (fila y trámites) en las particiones del
+    procedimiento. Devuelve los meses reescritos.
+    """
+    base_path = f"{RUTA_TRATADOS}/{codigo}"
+    manifiesto = lee_manifiesto(codigo) or {'meses': {}}
+    indice = _lee_indice(codigo)
+    esquemas = {'expedientes': _esquema(codigo, 'expedientes', expedientes),
+                'tramites': _esquema(codigo, 'tramites', tramites)}
+
+    # Mes de cada expediente nuevo y, para los trámites sin fila de expediente, el de su partición
+    mes_expediente = pd.Series(_mes(expedientes['fecha_registro_exp']), index=expedientes['id_exp'].to_numpy())
+    ids_solo_tramites = pd.Index(tramites['id_exp'].unique()).difference(mes_expediente.index)
+    mes_solo_tramites = indice.reindex(ids_solo_tramites)
+    if mes_solo_tramites.isna().any():
+        raise ValueError(f"Trámites de expedientes que no existen: {list(mes_solo_tramites.index[mes_solo_tramites.isna()][:10])}")
+    mes_tramite = pd.concat([mes_expediente, mes_solo_tramites])
+    mes_tramite = mes_tramite[~mes_tramite.index.duplicated()].reindex(tramites['id_exp'].to_numpy()).to_numpy()
+
+    # Meses afectados: los de los expedientes nuevos y aquellos de donde salen los sustituidos
+    sustituidos = indice.reindex(mes_expediente.index).dropna()
+    afectados = sorted(set(mes_expediente) | set(sustituidos) | set(mes_solo_tramites))
+    ids_expedientes = mes_expediente.index
+    ids_tramites = ids_expedientes.union(ids_solo_tramites)
+
+    for mes in afectados:
+        filas = {}
+        for tabla, nuevos, ids, mes_nuevos in (
+            ('expedientes', expedientes, ids_expedientes, mes_expediente.to_numpy()),
+            ('tramites', tramites, ids_tramites, mes_tramite)
+        ):
+            ruta = ruta_particion(codigo, tabla, mes)
+            partes = [nuevos[mes_nuevos == mes]]
+            if os.path.exists(ruta):
+                previos = pd.read_parquet(ruta)
+                partes.insert(0, previos[~previos['id_exp'].isin(ids)])
+            df = pd.concat(partes, ignore_index=True)
+            filas[tabla] = df
+        if filas['expedientes'].empty:
+            for tabla in TABLAS:
+                if os.path.exists(ruta_particion(codigo, tabla, mes)):
+                    os.remove(ruta_particion(codigo, tabla, mes))
+            manifiesto['meses'].pop(mes, None)
+            continue
+        for tabla in TABLAS:
+            escribe_tabla(ruta_particion(codigo, tabla, mes),
+                          pa.Table.from_pandas(filas[tabla], schema=esquemas[tabla], preserve_index=False), tabla)
+        fechas = filas['expedientes']['fecha_registro_exp']
+        manifiesto['meses'][mes] = {
+            'expedientes': len(filas['expedientes']),
+            'tramites': len(filas['tramites']),
+            'fecha_min': None if fechas.isna().all() else str(fechas.min()),
+            'fecha_max': None if fechas.isna().all() else str(fechas.max()),
+            'bytes': sum(os.path.getsize(ruta_particion(codigo, tabla, mes)) for tabla in TABLAS)
+        }
+
+    # Índice y manifiesto al final
+    indice = pd.concat([indice[~indice.index.isin(ids_expedientes)], mes_expediente])
+    pd.DataFrame({'id_exp': indice.index.to_numpy(), 'mes': indice.to_numpy()}).astype({'mes': 'category'}).to_parquet(
+        f"{base_path}/{FICHERO_INDICE}", index=False
+    )
+    _guarda_manifiesto(codigo, manifiesto)
+    return afectados
+
+
+def _guarda_manifiesto(codigo, manifiesto):
+    ruta = f"{RUTA_TRATADOS}/{codigo}/{FICHERO_MANIFIESTO}"
+    manifiesto['meses'] = dict(sorted(manifiesto['meses'].items()))
+    with open(f"{ruta}.tmp", "w", encoding='utf-8') as f:
+        json.dump(manifiesto, f, indent=1)
+    os.replace(f"{ruta}.tmp", ruta)
+
+
+def particiona(codigo):
+    """Parte los ficheros únicos de un procedimiento en particiones mensuales"""
+    if lee_manifiesto(codigo) is not None:
+        raise ValueError(f"El procedimiento {codigo} ya está particionado")
+    base_path = f"{RUTA_TRATADOS}/{codigo}"
+    return ingesta(codigo, pd.read_parquet(f"{base_path}/expedientes.parquet"),
+                   pd.read_parquet(f"{base_path}/tramites.parquet"))
+
+
+def ordena(codigo):
+    """
+    Reescribe los ficheros de un procedimiento (particiones o únicos) ordenados y en
+    grupos de filas (escribe_tabla). Devuelve los bytes (antes, después).
+    """
+    antes = despues = 0
+    for tabla in TABLAS:
+        for ruta in ficheros(codigo, tabla):
+            antes += os.path.getsize(ruta)
+            escribe_tabla(ruta, pq.read_table(ruta), tabla)
+            despues += os.path.getsize(ruta)
+    manifiesto = lee_manifiesto(codigo)
+    if manifiesto is not None:
+        for mes, datos in manifiesto['meses'].items():
+            datos['bytes'] = sum(os.path.getsize(ruta_particion(codigo, tabla, mes)) for tabla in TABLAS)
+        _guarda_manifiesto(codigo, manifiesto)
+    return antes, despues
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Particiones mensuales de expedientes y trámites")
+    parser.add_argument("codigos", nargs="+", help="procedimientos")
+    parser.add_argument("--ingesta", help="carpeta con expedientes.parquet y/o tramites.parquet a añadir")
+    parser.add_argument("--ordena", action="store_true", help="reescribe los ficheros ordenados y en grupos de filas")
+    args = parser.parse_args()
+
+    for codigo in args.codigos:
+        if args.ordena:
+            antes, despues = ordena(codigo)
+            print(f"{codigo}: {antes / 2 ** 20:.1f} MB -> {despues / 2 ** 20:.1f} MB")
+            continue
+        if args.ingesta:
+            def lee(tabla):
+                ruta = f"{args.ingesta}/{tabla}.parquet"
+                return pd.read_parquet(ruta) if os.path.exists(ruta) else pd.read_parquet(
+                    ficheros(codigo, tabla)[0]).iloc[:0]
+            meses = ingesta(codigo, lee('expedientes'), lee('tramites'))
+        else:
+            meses = particiona(codigo)
+        print(f"{codigo}: {len(meses)} meses escritos ({', '.join(meses[:3])}{', ...' if len(meses) > 3 else ''})")
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Perfil de arranque: coste de importación de app.py y de cada página.
+
+Un worker nuevo importa lo que importa app.py y, al visitar cada página, lo que
+importa esa página. Para cada script se toman sus importaciones de nivel superior
+(las que se ejecutan siempre; las que están dentro de funciones o bloques se cargan
+solo cuando hacen falta) y se ejecutan en un intérprete nuevo con -X importtime.
+Las páginas se miden después de las importaciones de app.py, que ya están cargadas.
+
+    python perfil_arranque.py                    # app.py y todas las páginas
+    python perfil_arranque.py flujo.py           # solo las indicadas
+    python perfil_arranque.py --modulos 15       # módulos más costosos de cada script
+    python perfil_arranque.py --presupuesto 300  # falla si un script supera 300 ms
+
+El coste de streamlit, que ya está cargado al ejecutar cualquier script, no se cuenta.
+"""
+import argparse
+import ast
+import re
+import subprocess
+import sys
+
+APP = "app.py"
+PRESUPUESTO_MS = 1000
+LINEA_IMPORTTIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def paginas_app(ruta_app=APP):
+    """Scripts de las páginas declaradas con st.Page en app.py"""
+    with open(ruta_app, encoding='utf-8') as f:
+        arbol = ast.parse(f.read())
+    return [
+        nodo.args[0].value for nodo in ast.walk(arbol)
+        if isinstance(nodo, ast.Call) and getattr(nodo.func, 'attr', None) == 'Page'
+        and nodo.args and isinstance(nodo.args[0], ast.Constant)
+    ]
+
+
+def importaciones(ruta):
+    """Sentencias import de nivel superior de un script, como código fuente"""
+    with open(ruta, encoding='utf-8') as f:
+        fuente = f.read()
+    return [ast.get_source_segment(fuente, nodo) for nodo in ast.parse(fuente).body
+            if isinstance(nodo, (ast.Import, ast.ImportFrom))]
+
+
+def mide(sentencias, previas=()):
+    """
+    Ejecuta las sentencias en un intérprete nuevo, tras importar streamlit y las previas.
+    Devuelve {módulo: (propio_us, acumulado_us)} de los módulos de primer nivel cargados
+    por las sentencias.
+    """
+    codigo = "\n".join(["import streamlit", *previas, "import sys; sys.stderr.write('##\\n')", *sentencias])
+    resultado = subprocess.run([sys.executable, "-X", "importtime", "-c", codigo],
+                               capture_output=True, text=True)
+    if resultado.returncode != 0:
+        raise RuntimeError(resultado.stderr.strip().splitlines()[-1])
+    salida = resultado.stderr.split("##\n", 1)[1]
+    modulos = {}
+    for linea in salida.splitlines():
+        encontrado = LINEA_IMPORTTIME.match(linea)
+        if encontrado and len(encontrado.group(3)) == 1:
+            modulos[encontrado.group(4)] = (int(encontrado.group(1)), int(encontrado.group(2)))
+    return modulos
+
+
+def perfil(scripts, n_modulos):
+    """Coste en ms de cada script y sus módulos más costosos, por orden"""
+    previas = importaciones(APP)
+    informe = []
+    for script in scripts:
+        modulos = mide(importaciones(script), () if script == APP else previas)
+        total = sum(acumulado for _, acumulado in modulos.values()) / 1000
+        mayores = sorted(modulos.items(), key=lambda m: -m[1][1])[:n_modulos]
+        informe.append((script, total, [(nombre, acumulado / 1000) for nombre, (_, acumulado) in mayores]))
+    return informe
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Coste de importación de app.py y sus páginas")
+    parser.add_argument("scripts", nargs="*", help="scripts a medir (por defecto app.py y todas las páginas)")
+    parser.add_argument("--modulos", type=int, default=5, help="módulos más costosos a mostrar por script")
+    parser.add_argument("--presupuesto", type=float, default=PRESUPUESTO_MS, help="ms máximos por script")
+    args = parser.parse_args()
+
+    excedidos = []
+    for script, total, mayores in perfil(args.scripts or [APP] + paginas_app(), args.modulos):
+        marca = "" if total <= args.presupuesto else "  > presupuesto"
+        print(f"{script:<28}{total:>9.1f} ms{marca}")
+        for nombre, ms in mayores:
+            print(f"    {nombre:<24}{ms:>9.1f} ms")
+        if marca:
+            excedidos.append(script)
+    sys.exit(1 if excedidos else 0)
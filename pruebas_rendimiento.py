@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas de rendimiento de los cálculos de las páginas sobre los procedimientos de
+data/tratados, sin streamlit (carga_datos.py y analitica.py).
+
+    python pruebas_rendimiento.py                              # todos, factores 1, 10 y 100
+    python pruebas_rendimiento.py 884 216 --factores 1 10      # solo los indicados
+    python pruebas_rendimiento.py --salida nuevo.json --compara anterior.json
+
+Para cada procedimiento y factor se mide cada paso (lectura, carga, filtro de fechas, flujos,
+transiciones, agregación geográfica, cubos, inicios vs completados, detalle de no
+completados y carga de trabajo) con el rango de fechas completo y los estados finales
+por defecto de la aplicación. Con factor > 1 los expedientes y trámites se copian
+factor veces con id_exp distintos y las mismas fechas, y la carga mide la preparación
+en memoria de los datos base (secuencias e índices) en lugar de la lectura del disco.
+Con factor 1 se mide además la lectura y limpieza de los parquet sin la caché en disco,
+completa y de los últimos MESES_LECTURA_RANGO meses, con los bytes que se leen (grupos
+de filas que no se saltan los filtros de fechas, ver particiones.py).
+
+El resultado se guarda en JSON: segundos (mejor de las repeticiones), pico de memoria
+reservada durante el paso (tracemalloc, en una ejecución aparte) y filas por segundo.
+Con --compara se listan los pasos que tardan más de UMBRAL_REGRESION veces lo que
+tardaban en el fichero anterior, y el programa termina con error si hay alguno, y las
+lecturas antes y después (tiempo y bytes). Para ver el efecto de reescribir los ficheros:
+
+    python pruebas_rendimiento.py --factores 1 --salida antes.json
+    python particiones.py 884 216 --ordena
+    python pruebas_rendimiento.py --factores 1 --compara antes.json
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import analitica
+from carga_datos import (carga_datos_base, carga_datos_limpios, limpia_datos_base, prepara_datos_base,
+                         ordena_por_registro, filtra_datos_fechas, filtros_expedientes, filtros_tramites,
+                         COLUMNAS_EXPEDIENTES, COLUMNAS_TRAMITES)
+from filtro_estados import mascara_indice
+from particiones import ficheros, lee_tabla, bytes_lectura
+from secuencias import RUTA_TRATADOS, secuencias_en_memoria
+
+FACTORES = (1, 10, 100)
+REPETICIONES = 3
+UMBRAL_REGRESION = 1.25
+# Por debajo de este tiempo las diferencias son ruido y no se comparan
+SEGUNDOS_MINIMOS_COMPARACION = 0.02
+FRECUENCIA_INICIOS = 'M'
+FILAS_POR_PAGINA = 200
+MESES_LECTURA_RANGO = 3
+SALIDA = "data/cache/rendimiento.json"
+
+
+def procedimientos():
+    """Procedimientos de data/tratados con expedientes y trámites"""
+    return sorted(
+        (c for c in os.listdir(RUTA_TRATADOS)
+         if all(os.path.exists(r) for tabla in ("expedientes", "tramites") for r in ficheros(c, tabla))),
+        key=lambda c: (len(c), c)
+    )
+
+
+def escala_datos(datos_limpios, factor):
+    """Expedientes y trámites copiados factor veces con id_exp distintos, ordenados por registro"""
+    salto = int(datos_limpios['expedientes']['id_exp'].max()) + 1
+
+    def copias(df):
+        return pd.concat(
+            [df.assign(id_exp=df['id_exp'].astype('int64') + k * salto) for k in range(factor)],
+            ignore_index=True
+        )
+
+    return ordena_por_registro(copias(datos_limpios['expedientes']), copias(datos_limpios['tramites']))
+
+
+def lecturas(codigo, fecha_max):
+    """
+    Lecturas a medir: lista de (nombre, función, bytes leídos), completa y de los últimos
+    MESES_LECTURA_RANGO meses hasta fecha_max
+    """
+    desde = (pd.Timestamp(fecha_max) - pd.DateOffset(months=MESES_LECTURA_RANGO)).date()
+    lista = []
+    for paso, rango in (('lectura', None), ('lectura_rango', (desde, fecha_max))):
+        rutas_expedientes = ficheros(codigo, 'expedientes', rango)
+        rutas_tramites = ficheros(codigo, 'tramites', rango)
+        ids = lee_tabla(rutas_expedientes, columns=['id_exp'], filters=filtros_expedientes(rango))['id_exp']
+        leidos = (bytes_lectura(rutas_expedientes, COLUMNAS_EXPEDIENTES, filtros_expedientes(rango))
+                  + bytes_lectura(rutas_tramites, COLUMNAS_TRAMITES, filtros_tramites(ids)))
+        lista.append((paso, lambda e=rutas_expedientes, t=rutas_tramites, r=rango: limpia_datos_base(e, t, r), leidos))
+    return lista
+
+
+def mide(funcion, repeticiones):
+    """(segundos, pico_mb): mejor tiempo de las repeticiones y pico de memoria de una ejecución aparte"""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        funcion()
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(tiempos), pico / 2 ** 20
+
+
+def pasos(datos_base):
+    """Pasos a medir sobre unos datos base: lista de (nombre, filas de entrada, función)"""
+    expedientes = datos_base['expedientes']
+    fechas = expedientes['fecha_registro_exp']
+    rango = (fechas.min().date(), fechas.max().date())
+    estados = datos_base['estados']
+    estados_finales = estados.loc[estados['FINAL'] == 1, 'NUMTRAM'].drop_duplicates().astype(int).tolist()
+    nombres_estados = estados.set_index('NUMTRAM')['DENOMINACION_SIMPLE'].to_dict()
+
+    filtrados = filtra_datos_fechas(datos_base, rango)
+    secuencias = filtrados['secuencias']
+    tramites = filtrados['tramites']
+    mascara = mascara_indice(filtrados['indice_estados'], estados_finales)
+    ids_completados = secuencias['expedientes']['id_exp'][mascara]
+    cubo_demanda = analitica.construye_cubo_demanda(filtrados['expedientes'])
+    cubo_tramitacion = analitica.construye_cubo_tramitacion(tramites)
+    _, indice_periodos = analitica.process_starts_vs_completed(
+        tramites, ids_completados, bool(estados_finales), FRECUENCIA_INICIOS
+    )
+    n_expedientes, n_tramites = len(filtrados['expedientes']), len(tramites)
+
+    def demanda():
+        for regla in ('D', 'W-MON', 'MS'):
+            analitica.compute_agregado(cubo_demanda, regla)
+            analitica.compute_provincia(cubo_demanda, regla)
+        analitica.compute_heatmap_data(cubo_demanda)
+
+    lista = [
+        ('filtro_fechas', n_expedientes, lambda: filtra_datos_fechas(datos_base, rango)),
+        ('flujos', n_expedientes, lambda: analitica.process_flows(secuencias, mascara)),
+        ('transiciones', n_expedientes, lambda: analitica.build_transition_dataframes(
+            *analitica.calculate_transition_stats(secuencias, mascara), nombres_estados)),
+        ('geografico', n_expedientes, lambda: analitica.aggregate_data(filtrados['expedientes'])),
+        ('cubo_demanda', n_expedientes, lambda: analitica.construye_cubo_demanda(filtrados['expedientes'])),
+        ('demanda', n_expedientes, demanda),
+        ('inicios_completados', n_tramites, lambda: analitica.process_starts_vs_completed(
+            tramites, ids_completados, bool(estados_finales), FRECUENCIA_INICIOS)),
+        ('cubo_tramitacion', n_tramites, lambda: analitica.construye_cubo_tramitacion(tramites)),
+        ('tramitacion', n_tramites, lambda: analitica.process_tramites_data(
+            cubo_tramitacion, estados_finales, FRECUENCIA_INICIOS, nombres_estados)),
+        ('carga_trabajo', len(datos_base['tramites']), lambda: analitica.construye_acumulado(datos_base['tramites'])),
+    ]
+    if len(indice_periodos['periods']):
+        # Detalle del periodo con más expedientes no completados (primera página)
+        periodo = indice_periodos['periods'][np.argmax(np.diff(indice_periodos['offsets']))]
+        lista.append(('no_completados', n_tramites, lambda: analitica.get_not_completed_expedientes(
+            tramites, filtrados['expedientes'], indice_periodos, periodo, 0, FILAS_POR_PAGINA, nombres_estados)))
+    return lista
+
+
+def mide_procedimiento(codigo, factor, repeticiones):
+    """Resultados de todos los pasos de un procedimiento con un factor de escala"""
+    if factor == 1:
+        def carga():
+            return carga_datos_base(codigo)
+    else:
+        datos_limpios, _ = carga_datos_limpios(codigo)
+        expedientes, tramites = escala_datos(datos_limpios, factor)
+        estados = pd.read_csv(f"{RUTA_TRATADOS}/{codigo}/estados_finales.csv", sep=";", encoding='utf-8')
+
+        def carga():
+            return prepara_datos_base(expedientes, tramites, secuencias_en_memoria(tramites), estados,
+                                      f"{codigo}x{factor}")
+    datos_base = carga()
+    medidas = [('carga', len(datos_base['tramites']), carga, None)] + [
+        (paso, filas, funcion, None) for paso, filas, funcion in pasos(datos_base)
+    ]
+    if factor == 1:
+        fecha_max = datos_base['expedientes']['fecha_registro_exp'].max().date()
+        medidas = [(paso, len(funcion()['tramites']), funcion, leidos)
+                   for paso, funcion, leidos in lecturas(codigo, fecha_max)] + medidas
+
+    resultados = []
+    for paso, filas, funcion, leidos in medidas:
+        segundos, pico_mb = mide(funcion, repeticiones)
+        resultado = {
+            'procedimiento': str(codigo),
+            'factor': factor,
+            'paso': paso,
+            'segundos': round(segundos, 6),
+            'pico_mb': round(pico_mb, 2),
+            'filas': int(filas),
+            'filas_por_segundo': round(filas / segundos) if segundos > 0 else None
+        }
+        if leidos is not None:
+            resultado['bytes_leidos'] = int(leidos)
+        resultados.append(resultado)
+        print(f"{codigo:>6} x{factor:<4}{paso:<22}{segundos:>10.4f} s{pico_mb:>10.1f} MB{filas:>10} filas"
+              + (f"{leidos / 2 ** 20:>10.2f} MB leídos" if leidos is not None else ""), flush=True)
+    return resultados
+
+
+def compara(resultados, anteriores, umbral=UMBRAL_REGRESION):
+    """Pasos más lentos que en los resultados anteriores: (procedimiento, factor, paso, antes, ahora)"""
+    previos = {(r['procedimiento'], r['factor'], r['paso']): r['segundos'] for r in anteriores}
+    regresiones = []
+    for r in resultados:
+        antes = previos.get((r['procedimiento'], r['factor'], r['paso']))
+        if antes is not None and r['segundos'] >= SEGUNDOS_MINIMOS_COMPARACION and r['segundos'] > antes * umbral:
+            regresiones.append((r['procedimiento'], r['factor'], r['paso'], antes, r['segundos']))
+    return regresiones
+
+
+def compara_lecturas(resultados, anteriores):
+    """Lecturas de ambos resultados: (procedimiento, paso, segundos antes, ahora, bytes antes, ahora)"""
+    previos = {(r['procedimiento'], r['paso']): r for r in anteriores if 'bytes_leidos' in r}
+    return [
+        (r['procedimiento'], r['paso'], previo['segundos'], r['segundos'], previo['bytes_leidos'], r['bytes_leidos'])
+        for r in resultados
+        if 'bytes_leidos' in r and (previo := previos.get((r['procedimiento'], r['paso']))) is not None
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pruebas de rendimiento de los cálculos de las páginas")
+    parser.add_argument("codigos", nargs="*", help="procedimientos (por defecto todos los de data/tratados)")
+    parser.add_argument("--factores", type=int, nargs="+", default=list(FACTORES), help="factores de escala")
+    parser.add_argument("--repeticiones", type=int, default=REPETICIONES)
+    parser.add_argument("--salida", default=SALIDA, help="fichero JSON de resultados")
+    parser.add_argument("--compara", help="fichero JSON de una ejecución anterior")
+    parser.add_argument("--umbral", type=float, default=UMBRAL_REGRESION, help="cociente de tiempo que es regresión")
+    args = parser.parse_args()
+
+    resultados = []
+    for codigo in args.codigos or procedimientos():
+        for factor in args.factores:
+            resultados += mide_procedimiento(codigo, factor, args.repeticiones)
+            gc.collect()
+
+    os.makedirs(os.path.dirname(args.salida) or ".", exist_ok=True)
+    with open(args.salida, "w", encoding='utf-8') as f:
+        json.dump({
+            'fecha': datetime.datetime.now().isoformat(timespec='seconds'),
+            'entorno': {
+                'python': platform.python_version(),
+                'pandas': pd.__version__,
+                'numpy': np.__version__,
+                'plataforma': platform.platform()
+            },
+            'repeticiones': args.repeticiones,
+            'resultados': resultados
+        }, f, indent=1, ensure_ascii=False)
+    print(f"Resultados en {args.salida}")
+
+    if args.compara:
+        with open(args.compara, encoding='utf-8') as f:
+            anteriores = json.load(f)['resultados']
+        for codigo, paso, antes, ahora, bytes_antes, bytes_ahora in compara_lecturas(resultados, anteriores):
+            print(f"{codigo:>6} {paso:<14}{antes:>9.4f} s -> {ahora:.4f} s"
+                  f"{bytes_antes / 2 ** 20:>9.2f} MB -> {bytes_ahora / 2 ** 20:.2f} MB leídos")
+        regresiones = compara(resultados, anteriores, args.umbral)
+        for codigo, factor, paso, antes, ahora in regresiones:
+            print(f"REGRESIÓN {codigo} x{factor} {paso}: {antes:.4f} s -> {ahora:.4f} s ({ahora / antes:.2f}x)")
+        if not regresiones:
+            print(f"Sin regresiones respecto a {args.compara} (umbral {args.umbral}x)")
+        sys.exit(1 if regresiones else 0)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Registro de datos compartido entre sesiones.
+
+st.cache_data devuelve a cada sesión (y en cada ejecución) una copia nueva de los
+DataFrames, así que con muchos usuarios sobre el mismo procedimiento la memoria
+crece con el número de sesiones. El registro guarda una única copia de los datos
+de cada procedimiento, y de sus filtrados por rango de fechas, para todo el
+proceso; las sesiones solo guardan referencias a esas tablas y sus propias máscaras.
+
+Los datos del registro son de solo lectura: los arrays de numpy se marcan como no
+escribibles y las páginas no deben asignar columnas sobre los DataFrames compartidos
+(con copy-on-write de pandas cualquier tabla derivada es independiente).
+
+Cada procedimiento cuenta las sesiones que lo están usando: al cambiar de procedimiento
+la sesión deja el anterior (adquiere) y las sesiones cerradas se descuentan al desalojar.
+Cuando hay más de MAX_PROCEDIMIENTOS cargados se descargan los menos usados
+recientemente que no tengan ninguna sesión activa.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import streamlit as st
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+MAX_PROCEDIMIENTOS = 4
+MAX_RANGOS = 8
+
+
+def _solo_lectura(datos):
+    """Marca como no escribibles los arrays de numpy (también dentro de dicts anidados)"""
+    if isinstance(datos, np.ndarray):
+        datos.flags.writeable = False
+    elif isinstance(datos, dict):
+        for valor in datos.values():
+            _solo_lectura(valor)
+    return datos
+
+
+def _sesion_activa(sesion):
+    # Fuera del servidor de streamlit (tests, scripts) no se puede saber: se da por activa
+    if not Runtime.exists():
+        return True
+    return Runtime.instance().is_active_session(sesion)
+
+
+class RegistroDatos:
+    """Tablas de cada procedimiento compartidas por todas las sesiones, con desalojo LRU"""
+
+    def __init__(self, max_procedimientos=MAX_PROCEDIMIENTOS, max_rangos=MAX_RANGOS, sesion_activa=_sesion_activa):
+        self.max_procedimientos = max_procedimientos
+        self.max_rangos = max_rangos
+        self._sesion_activa = sesion_activa
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()   # codigo -> {'datos', 'rangos', 'sesiones', 'lock'}
+        self._sesiones = {}              # sesion -> codigo en uso
+
+    def _entrada(self, codigo):
+        with self._lock:
+            entrada = self._entradas.get(codigo)
+            if entrada is None:
+                entrada = {'datos': None, 'rangos': OrderedDict(), 'sesiones': set(), 'lock': threading.Lock()}
+                self._entradas[codigo] = entrada
+            self._entradas.move_to_end(codigo)
+            return entrada
+
+    def adquiere(self, codigo, sesion, cargador):
+        """
+        Devuelve los datos base del procedimiento, cargándolos con cargador(codigo) si no
+        están en el registro, y anota que la sesión los usa (liberando el que usase antes).
+        """
+        entrada = self._entrada(codigo)
+        # La carga se hace con el lock del procedimiento: otras sesiones esperan a esta
+        # carga pero pueden seguir trabajando con los demás procedimientos
+        with entrada['lock']:
+            if entrada['datos'] is None:
+                entrada['datos'] = _solo_lectura(cargador(codigo))
+        with self._lock:
+            anterior = self._sesiones.get(sesion)
+            if anterior is not None and anterior != codigo and anterior in self._entradas:
+                self._entradas[anterior]['sesiones'].discard(sesion)
+            self._sesiones[sesion] = codigo
+            entrada['sesiones'].add(sesion)
+            self._desaloja()
+        return entrada['datos']
+
+    def rango(self, codigo, datos_base, rango_fechas, filtrador):
+        """Datos del procedimiento filtrados por rango de fechas, compartidos entre sesiones"""
+        entrada = self._entrada(codigo)
+        with entrada['lock']:
+            # Si el procedimiento se desalojó entre medias se vuelve a registrar con los datos de la sesión
+            if entrada['datos'] is None:
+                entrada['datos'] = datos_base
+            filtrados = entrada['rangos'].get(rango_fechas)
+            if filtrados is None:
+                filtrados = _solo_lectura(filtrador(entrada['datos'], rango_fechas))
+                entrada['rangos'][rango_fechas] = filtrados
+                if len(entrada['rangos']) > self.max_rangos:
+                    entrada['rangos'].popitem(last=False)
+            else:
+                entrada['rangos'].move_to_end(rango_fechas)
+        return filtrados
+
+    def _desaloja(self):
+        # Las sesiones cerradas no avisan: se descuentan aquí
+        for sesion in [s for s in self._sesiones if not self._sesion_activa(s)]:
+            codigo = self._sesiones.pop(sesion)
+            if codigo in self._entradas:
+                self._entradas[codigo]['sesiones'].discard(sesion)
+        sobrantes = len(self._entradas) - self.max_procedimientos
+        for codigo in list(self._entradas):
+            if sobrantes <= 0:
+                break
+            if not self._entradas[codigo]['sesiones']:
+                del self._entradas[codigo]
+                sobrantes -= 1
+
+
+@st.cache_resource
+def registro():
+    """Registro único para todo el proceso de streamlit"""
+    return RegistroDatos()
+
+
+def id_sesion():
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else None
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Hidden page with the timings recorded by instrumentacion.py (CUADRO_MANDO_INSTRUMENTACION=1)
+"""
+
+import json
+
+import streamlit as st
+import pandas as pd
+
+import instrumentacion
+from registro_datos import id_sesion
+
+st.header("Rendimiento")
+
+if not instrumentacion.ACTIVA:
+    st.info("La instrumentación no está activa. Arranca la aplicación con "
+            "`CUADRO_MANDO_INSTRUMENTACION=1 streamlit run app.py`.", icon="⏱️")
+    st.stop()
+
+anotaciones = instrumentacion.anotaciones()
+totales = pd.DataFrame(anotaciones.totales())
+eventos = pd.DataFrame(anotaciones.eventos())
+
+st.caption(f"Llamadas de todas las sesiones desde {anotaciones.desde:%d-%m-%Y %H:%M:%S}. "
+           f"Se conservan las últimas {instrumentacion.MAX_EVENTOS} para el detalle.")
+
+col1, col2, _ = st.columns([1, 1, 4])
+col1.download_button(
+    "Exportar JSON",
+    data=json.dumps(anotaciones.exporta(), ensure_ascii=False, indent=1, default=str),
+    file_name="rendimiento.json",
+    mime="application/json"
+)
+if col2.button("Reiniciar"):
+    anotaciones.reinicia()
+    st.rerun()
+
+if totales.empty:
+    st.info("Todavía no hay llamadas anotadas: visita alguna página.")
+    st.stop()
+
+totales['ms_medio'] = 1000 * totales['segundos'] / totales['llamadas']
+
+# Cached functions and registry loads: where the time goes on cache misses
+funciones = totales[totales['tipo'] != 'grafico'].copy()
+if not funciones.empty:
+    st.subheader("Funciones cacheadas")
+    funciones['% aciertos'] = 100 * funciones['aciertos'] / funciones['llamadas']
+    funciones['ms_medio_fallo'] = (1000 * funciones['segundos_fallos'] / funciones['fallos']).where(funciones['fallos'] > 0)
+    funciones['ms_max'] = 1000 * funciones['segundos_max']
+    st.dataframe(
+        funciones.sort_values('segundos', ascending=False)[[
+            'pagina', 'nombre', 'tipo', 'llamadas', 'aciertos', 'fallos', '% aciertos',
+            'ms_medio', 'ms_medio_fallo', 'ms_max', 'segundos', 'filas_max'
+        ]],
+        hide_index=True,
+        use_container_width=True,
+        column_config={
+            '% aciertos': st.column_config.NumberColumn(format="%.0f"),
+            'ms_medio': st.column_config.NumberColumn("ms medio", format="%.1f"),
+            'ms_medio_fallo': st.column_config.NumberColumn("ms medio fallo", format="%.1f"),
+            'ms_max': st.column_config.NumberColumn("ms máx.", format="%.1f"),
+            'segundos': st.column_config.NumberColumn("s totales", format="%.2f"),
+            'filas_max': st.column_config.NumberColumn("filas máx."),
+        }
+    )
+
+# Plotly figures: serialized payload sent to the browser on every run
+graficos = totales[totales['tipo'] == 'grafico'].copy()
+if not graficos.empty:
+    st.subheader("Gráficos")
+    graficos['kb_medio'] = graficos['bytes'] / graficos['llamadas'] / 1024
+    graficos['kb_max'] = graficos['bytes_max'] / 1024
+    st.dataframe(
+        graficos.sort_values('bytes', ascending=False)[[
+            'pagina', 'nombre', 'llamadas', 'kb_medio', 'kb_max', 'ms_medio', 'segundos'
+        ]],
+        hide_index=True,
+        use_container_width=True,
+        column_config={
+            'kb_medio': st.column_config.NumberColumn("KB medio", format="%.1f"),
+            'kb_max': st.column_config.NumberColumn("KB máx.", format="%.1f"),
+            'ms_medio': st.column_config.NumberColumn("ms medio", format="%.1f"),
+            'segundos': st.column_config.NumberColumn("s totales", format="%.2f"),
+        }
+    )
+
+st.subheader("Últimas llamadas")
+if st.checkbox("Solo esta sesión"):
+    eventos = eventos[eventos['sesion'] == id_sesion()]
+st.dataframe(
+    eventos.iloc[::-1].assign(ms=lambda df: 1000 * df['segundos']).drop(columns=['segundos']),
+    hide_index=True,
+    use_container_width=True,
+    column_config={'ms': st.column_config.NumberColumn(format="%.1f")}
+)
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Almacén de secuencias por expediente.
+
+Para cada procedimiento se guarda, junto a data/tratados/<codigo>/tramites.parquet
+(o sus particiones mensuales, particiones.py), una tabla compacta con una fila por expediente (fechas de inicio y fin, unidad
+tramitadora y número de pasos) y una tabla plana con los pasos de todos los
+expedientes (estado y duración de cada paso) en formato CSR: los pasos del
+expediente i ocupan el rango [offsets[i], offsets[i+1]) de los arrays planos.
+
+Se puede regenerar desde la línea de comandos:
+
+    python secuencias.py            # todos los procedimientos
+    python secuencias.py 884 1033   # solo los indicados
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from particiones import RUTA_TRATADOS, ficheros, lee_tabla
+
+FICHERO_EXPEDIENTES = "secuencias.parquet"
+FICHERO_PASOS = "secuencias_pasos.parquet"
+UNIDAD_NO_ESPECIFICADA = 'No especificada'
+
+
+def construye_secuencias(tramites):
+    """Agrupa los trámites por expediente en arrays planos (estado y duración de cada paso)"""
+    tramites_sorted = tramites[['id_exp', 'fecha_tramite', 'num_tramite', 'unidad_tramitadora']].sort_values(
+        ['id_exp', 'fecha_tramite'], kind='stable'
+    )
+    ids = tramites_sorted['id_exp'].to_numpy()
+    fechas = tramites_sorted['fecha_tramite'].to_numpy(dtype='datetime64[ns]')
+
+    # Posición del primer paso de cada expediente
+    es_inicio = np.ones(len(ids), dtype=bool)
+    es_inicio[1:] = ids[1:] != ids[:-1]
+    inicios = np.flatnonzero(es_inicio)
+    n_pasos = np.diff(np.append(inicios, len(ids)))
+
+    # Duración de cada paso hasta el siguiente trámite del mismo expediente (0 en el último)
+    duracion = np.zeros(len(ids), dtype='float32')
+    if len(ids) > 1:
+        duracion[:-1] = (fechas[1:] - fechas[:-1]) / np.timedelta64(1, 'D')
+    duracion[inicios + n_pasos - 1] = 0
+    duracion = np.nan_to_num(duracion, nan=0.0)
+
+    fechas_exp = tramites_sorted.groupby('id_exp', sort=True)['fecha_tramite'].agg(['min', 'max'])
+    unidades = tramites_sorted['unidad_tramitadora'].fillna(UNIDAD_NO_ESPECIFICADA).to_numpy()
+
+    expedientes = pd.DataFrame({
+        'id_exp': ids[inicios],
+        'first_date': fechas_exp['min'].to_numpy(),
+        'last_date': fechas_exp['max'].to_numpy(),
+        'unidad_tramitadora': unidades[inicios],
+        'n_pasos': n_pasos.astype('int32')
+    })
+    pasos = pd.DataFrame({
+        'num_tramite': tramites_sorted['num_tramite'].to_numpy().astype('int16'),
+        'duration': duracion
+    })
+    return expedientes, pasos
+
+
+def _rutas(codigo):
+    base_path = f"{RUTA_TRATADOS}/{codigo}"
+    return (ficheros(codigo, 'tramites'),
+            f"{base_path}/{FICHERO_EXPEDIENTES}",
+            f"{base_path}/{FICHERO_PASOS}")
+
+
+def guarda_secuencias(codigo):
+    """Genera los ficheros de secuencias de un procedimiento a partir de sus trámites"""
+    rutas_tramites, ruta_expedientes, ruta_pasos = _rutas(codigo)
+    tramites = lee_tabla(
+        rutas_tramites,
+        columns=['id_exp', 'fecha_tramite', 'num_tramite', 'unidad_tramitadora']
+    )
+    expedientes, pasos = construye_secuencias(tramites)
+    expedientes.to_parquet(ruta_expedientes, index=False)
+    pasos.to_parquet(ruta_pasos, index=False)
+    return len(expedientes), len(pasos)
+
+
+def _empaqueta(expedientes, pasos):
+    offsets = np.zeros(len(expedientes) + 1, dtype='int64')
+    np.cumsum(expedientes['n_pasos'].to_numpy(), out=offsets[1:])
+    return {
+        'expedientes': expedientes.reset_index(drop=True),
+        'offsets': offsets,
+        'num_tramite': pasos['num_tramite'].to_numpy(),
+        'duration': pasos['duration'].to_numpy()
+    }
+
+
+def carga_secuencias(codigo):
+    """
+    Carga el almacén de secuencias de un procedimiento. Si no existe o es más antiguo
+    que los ficheros de trámites se construye en memoria a partir de los trámites.
+    """
+    rutas_tramites, ruta_expedientes, ruta_pasos = _rutas(codigo)
+    actualizado = (
+        os.path.exists(ruta_expedientes) and os.path.exists(ruta_pasos)
+        and min(os.path.getmtime(ruta_expedientes), os.path.getmtime(ruta_pasos))
+        >= max(os.path.getmtime(r) for r in rutas_tramites)
+    )
+    if actualizado:
+        expedientes = pd.read_parquet(ruta_expedientes)
+        pasos = pd.read_parquet(ruta_pasos)
+    else:
+        tramites = lee_tabla(
+            rutas_tramites,
+            columns=['id_exp', 'fecha_tramite', 'num_tramite', 'unidad_tramitadora']
+        )
+        expedientes, pasos = construye_secuencias(tramites)
+    return _empaqueta(expedientes, pasos)
+
+
+def secuencias_en_memoria(tramites):
+    """Almacén de secuencias construido en memoria a partir de unos trámites"""
+    return _empaqueta(*construye_secuencias(tramites))
+
+
+def ordena_secuencias(secuencias, id_exps):
+    """
+    Reordena el almacén siguiendo el orden de id_exps (p. ej. por fecha de registro), de
+    modo que cualquier tramo contiguo de esos expedientes es también un tramo del almacén.
+    Los expedientes sin secuencia se omiten; devuelve el almacén y una máscara de cuáles
+    de id_exps tienen secuencia.
+    """
+    posiciones = pd.Index(secuencias['expedientes']['id_exp']).get_indexer(id_exps)
+    presente = posiciones >= 0
+    posiciones = posiciones[presente]
+    n_pasos = np.diff(secuencias['offsets'])[posiciones]
+    # Índices de los pasos de cada expediente, concatenados en el nuevo orden
+    inicio_destino = np.cumsum(n_pasos) - n_pasos
+    idx = np.repeat(secuencias['offsets'][posiciones] - inicio_destino, n_pasos) + np.arange(n_pasos.sum())
+    pasos = pd.DataFrame({
+        'num_tramite': secuencias['num_tramite'][idx],
+        'duration': secuencias['duration'][idx]
+    })
+    return _empaqueta(secuencias['expedientes'].iloc[posiciones], pasos), presente
+
+
+def corta_secuencias(secuencias, inicio, fin):
+    """Tramo [inicio, fin) de expedientes del almacén, sin copiar los arrays de pasos"""
+    offsets = secuencias['offsets']
+    return {
+        'expedientes': secuencias['expedientes'].iloc[inicio:fin].reset_index(drop=True),
+        'offsets': offsets[inicio:fin + 1] - offsets[inicio],
+        'num_tramite': secuencias['num_tramite'][offsets[inicio]:offsets[fin]],
+        'duration': secuencias['duration'][offsets[inicio]:offsets[fin]]
+    }
+
+
+def secuencias_a_listas(secuencias):
+    """
+    Expande el almacén a un DataFrame con una fila por expediente y las columnas
+    'all_states' y 'durations' como listas, tal y como las usan las páginas.
+    """
+    corte = secuencias['offsets'][1:-1]
+    df = secuencias['expedientes'].drop(columns=['n_pasos']).copy()
+    df['all_states'] = [s.tolist() for s in np.split(secuencias['num_tramite'], corte)] if len(df) else []
+    df['durations'] = [d.tolist() for d in np.split(secuencias['duration'].astype('float64'), corte)] if len(df) else []
+    return df
+
+
+
+def identifica_flujos(secuencias):
+    """
+    Asigna a cada expediente un flow_id entero (mismo id <=> misma secuencia de estados).
+    Devuelve el array de flow_id y el array con la secuencia (tupla) de cada flow_id.
+    """
+    n_expedientes = len(secuencias['expedientes'])
+    tuplas = np.empty(n_expedientes, dtype=object)
+    if n_expedientes:
+        tuplas[:] = [tuple(s.tolist()) for s in np.split(secuencias['num_tramite'], secuencias['offsets'][1:-1])]
+    flow_id, flujos = pd.factorize(tuplas)
+    return flow_id, flujos
+
+
+def duraciones_medias_por_paso(secuencias, claves):
+    """
+    Duración media de cada paso (salvo el último) en una sola agrupación.
+    claves es un DataFrame indexado por la posición del expediente en el almacén (el índice
+    que devuelve secuencias_a_listas); solo se usan esos expedientes y se agrupa por sus
+    columnas más la posición del paso ('paso'). Devuelve una Series con índice (claves..., paso).
+    """
+    posiciones = claves.index.to_numpy()
+    n_transiciones = np.diff(secuencias['offsets'])[posiciones] - 1
+    exp_paso = np.repeat(np.arange(len(posiciones)), n_transiciones)
+    paso = np.arange(len(exp_paso)) - np.repeat(np.cumsum(n_transiciones) - n_transiciones, n_transiciones)
+    idx = secuencias['offsets'][posiciones][exp_paso] + paso
+
+    pasos = claves.iloc[exp_paso].reset_index(drop=True)
+    pasos['paso'] = paso
+    pasos['duration'] = secuencias['duration'][idx].astype('float64')
+    return pasos.groupby(list(claves.columns) + ['paso'], sort=True)['duration'].mean()
+
+
+if __name__ == "__main__":
+    codigos = sys.argv[1:] or sorted(
+        c for c in os.listdir(RUTA_TRATADOS)
+        if all(os.path.exists(r) for r in ficheros(c, 'tramites'))
+    )
+    for codigo in codigos:
+        n_exp, n_pasos = guarda_secuencias(codigo)
+        print(f"{codigo}: {n_exp} expedientes, {n_pasos} pasos")
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+Procedimientos sintéticos del tamaño que se quiera a partir de uno real.
+
+    python sinteticos.py 884 2000000                         # data/tratados/sintetico_884
+    python sinteticos.py 884 2000000 --destino 884_grande --semilla 1
+
+aprende_modelo lee data/tratados/<codigo> y resume:
+- los días de registro (frecuencia de cada día) y el desfase hasta el alta;
+- la mezcla de municipios (con su provincia), de unidades tramitadoras y las tasas de
+  presentación telemática y de empresas (nif);
+- la cadena de estados: estado inicial, matriz de transiciones entre num_tramite
+  (con un estado final FIN) y la distribución de la duración de cada transición
+  (percentiles 0-100), y el desfase del primer trámite desde el registro.
+
+genera escribe expedientes.parquet, tramites.parquet y estados_finales.csv con el mismo
+esquema que los originales (los que lee carga_datos_base), por lotes para que millones
+de filas no tengan que estar a la vez en memoria. Los expedientes sintéticos son
+independientes entre sí: reproducen las frecuencias y distribuciones del original,
+no sus correlaciones entre expedientes.
+"""
+import argparse
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from particiones import RUTA_TRATADOS, ficheros, lee_tabla
+
+FIN = -1
+PERCENTILES = np.linspace(0, 100, 101)
+TAMANO_LOTE = 100_000
+COLUMNAS_MUNICIPIO = ['codine_provincia', 'codine', 'municipio', 'provincia']
+COLUMNAS_TEXTOS = ['codigo_procedimiento', 'denominacion', 'descripcion', 'consejeria', 'org_instructor']
+
+
+def _frecuencias(serie):
+    """(valores, probabilidades) de una serie, incluidos los nulos"""
+    cuentas = serie.value_counts(dropna=False)
+    return cuentas.index.to_numpy(), (cuentas / cuentas.sum()).to_numpy()
+
+
+def _segundos(delta):
+    return delta.dt.total_seconds().to_numpy()
+
+
+def aprende_modelo(codigo):
+    """Modelo estadístico de un procedimiento de data/tratados"""
+    expedientes = lee_tabla(ficheros(codigo, 'expedientes'))
+    tramites = lee_tabla(
+        ficheros(codigo, 'tramites'),
+        columns=['id_exp', 'fecha_tramite', 'num_tramite', 'orden_tramite', 'desc_tramite', 'unidad_tramitadora']
+    ).sort_values(['id_exp', 'fecha_tramite', 'orden_tramite'], kind='stable')
+    tramites = tramites[tramites['id_exp'].isin(expedientes['id_exp'])]
+
+    # Pasos consecutivos de cada expediente
+    ids = tramites['id_exp'].to_numpy()
+    estados = tramites['num_tramite'].to_numpy().astype('int64')
+    fechas = tramites['fecha_tramite']
+    es_inicio = np.ones(len(ids), dtype=bool)
+    es_inicio[1:] = ids[1:] != ids[:-1]
+    es_ultimo = np.append(es_inicio[1:], True)
+    pasos = pd.DataFrame({
+        'src': estados[:-1], 'tgt': estados[1:],
+        'segundos': _segundos(fechas.diff().iloc[1:])
+    })[~es_inicio[1:]]
+
+    # Transiciones (con FIN tras el último estado) y duración de cada una
+    transiciones = pd.concat([
+        pasos[['src', 'tgt']],
+        pd.DataFrame({'src': estados[es_ultimo], 'tgt': FIN})
+    ]).value_counts()
+    cadena = {}
+    for src, grupo in transiciones.groupby(level='src'):
+        destinos = grupo.index.get_level_values('tgt').to_numpy()
+        cadena[int(src)] = (destinos, (grupo / grupo.sum()).to_numpy())
+    duraciones = {
+        (int(src), int(tgt)): np.percentile(np.clip(grupo['segundos'].to_numpy(), 0, None), PERCENTILES)
+        for (src, tgt), grupo in pasos.groupby(['src', 'tgt'])
+    }
+
+    primeros = tramites[es_inicio].set_index('id_exp')
+    registro = expedientes.set_index('id_exp')['fecha_registro_exp']
+    desfase_primero = _segundos(primeros['fecha_tramite'] - registro.reindex(primeros.index))
+    dias_registro = expedientes['fecha_registro_exp'].dt.normalize()
+
+    return {
+        'dias_registro': _frecuencias(dias_registro),
+        'desfase_alta': np.percentile(
+            np.clip(_segundos(expedientes['fecha_alta_exp'] - expedientes['fecha_registro_exp']), 0, None), PERCENTILES
+        ),
+        'desfase_primer_tramite': np.percentile(np.clip(desfase_primero[~np.isnan(desfase_primero)], 0, None), PERCENTILES),
+        'municipios': expedientes[COLUMNAS_MUNICIPIO].value_counts(dropna=False, normalize=True),
+        'unidades': _frecuencias(primeros['unidad_tramitadora']),
+        'tasa_telematica': float(expedientes['es_telematica'].fillna(False).mean()),
+        'tasa_empresa': float(expedientes['nif'].notna().mean()),
+        'estado_inicial': _frecuencias(pd.Series(estados[es_inicio])),
+        'cadena': cadena,
+        'duraciones': duraciones,
+        'max_pasos': int(np.diff(np.append(np.flatnonzero(es_inicio), len(ids))).max()),
+        'desc_tramite': tramites.groupby('num_tramite', observed=True)['desc_tramite'].agg(
+            lambda s: s.mode().iloc[0] if s.notna().any() else None).to_dict(),
+        'textos': expedientes[COLUMNAS_TEXTOS].iloc[0].to_dict(),
+        'esquemas': {f: pq.read_schema(ficheros(codigo, f)[0]) for f in ('expedientes', 'tramites')},
+        'codigo': codigo
+    }
+
+
+def _muestra_percentiles(percentiles, rng, n):
+    """n valores de la distribución dada por sus percentiles 0-100 (interpolación lineal)"""
+    posicion = rng.random(n) * (len(percentiles) - 1)
+    abajo = posicion.astype('int64')
+    arriba = np.minimum(abajo + 1, len(percentiles) - 1)
+    return percentiles[abajo] + (percentiles[arriba] - percentiles[abajo]) * (posicion - abajo)
+
+
+def _secuencias(modelo, rng, n):
+    """Estados de n expedientes como (expediente, estado) de cada trámite en orden"""
+    valores, probs = modelo['estado_inicial']
+    actual = rng.choice(valores.astype('int64'), size=n, p=probs)
+    vivos = np.arange(n)
+    exp_pasos, estado_pasos = [vivos], [actual]
+    for _ in range(modelo['max_pasos'] - 1):
+        siguiente = np.full(len(vivos), FIN, dtype='int64')
+        for estado in np.unique(actual):
+            en_estado = np.flatnonzero(actual == estado)
+            destinos, probs = modelo['cadena'].get(int(estado), (np.array([FIN]), np.array([1.0])))
+            siguiente[en_estado] = rng.choice(destinos, size=len(en_estado), p=probs)
+        sigue = siguiente != FIN
+        vivos, actual = vivos[sigue], siguiente[sigue]
+        if not len(vivos):
+            break
+        exp_pasos.append(vivos)
+        estado_pasos.append(actual)
+    # Orden por expediente y, dentro de cada uno, por paso
+    exp = np.concatenate(exp_pasos)
+    paso = np.concatenate([np.full(len(v), k) for k, v in enumerate(exp_pasos)])
+    orden = np.lexsort((paso, exp))
+    return exp[orden], np.concatenate(estado_pasos)[orden], paso[orden]
+
+
+def _duraciones(modelo, rng, src, tgt):
+    """Segundos de cada transición src -> tgt según su distribución (o la de todas si no se vio)"""
+    segundos = np.zeros(len(src))
+    claves = pd.MultiIndex.from_arrays([src, tgt])
+    todas = np.concatenate(list(modelo['duraciones'].values()))
+    for (s, t), filas in pd.Series(np.arange(len(src)), index=claves).groupby(level=[0, 1]):
+        percentiles = modelo['duraciones'].get((int(s), int(t)))
+        if percentiles is None:
+            percentiles = np.percentile(todas, PERCENTILES)
+        segundos[filas.to_numpy()] = _muestra_percentiles(percentiles, rng, len(filas))
+    return segundos
+
+
+def genera_lote(modelo, rng, n, primer_id):
+    """DataFrames (expedientes, tramites) de n expedientes con id_exp desde primer_id"""
+    dias, probs = modelo['dias_registro']
+    registro = pd.to_datetime(rng.choice(dias, size=n, p=probs)).as_unit('us')
+    municipios = modelo['municipios']
+    municipio = municipios.index.to_frame(index=False).iloc[
+        rng.choice(len(municipios), size=n, p=municipios.to_numpy())
+    ].reset_index(drop=True)
+    unidades, probs_unidad = modelo['unidades']
+    es_empresa = rng.random(n) < modelo['tasa_empresa']
+    identificador = rng.integers(1, 2 ** 31 - 1, size=n)
+
+    expedientes = pd.DataFrame({
+        'id_exp': np.arange(primer_id, primer_id + n, dtype='uint32'),
+        'dni': pd.array(np.where(es_empresa, None, identificador), dtype='Int32'),
+        'nif': pd.array(np.where(es_empresa, identificador, None), dtype='Int32'),
+        'fecha_alta_exp': registro + pd.to_timedelta(np.round(_muestra_percentiles(modelo['desfase_alta'], rng, n)), unit='s'),
+        'fecha_registro_exp': registro,
+        **{c: municipio[c].to_numpy() for c in COLUMNAS_MUNICIPIO},
+        'unidad_tramitadora': rng.choice(unidades, size=n, p=probs_unidad),
+        **{c: modelo['textos'][c] for c in COLUMNAS_TEXTOS},
+        'es_telematica': rng.random(n) < modelo['tasa_telematica']
+    })
+
+    # Trámites: fecha del primero desde el registro y de los siguientes sumando la duración de cada transición
+    exp, estado, paso = _secuencias(modelo, rng, n)
+    segundos = np.empty(len(exp))
+    es_primero = paso == 0
+    segundos[es_primero] = _muestra_percentiles(modelo['desfase_primer_tramite'], rng, es_primero.sum())
+    siguientes = np.flatnonzero(~es_primero)
+    segundos[siguientes] = _duraciones(modelo, rng, estado[siguientes - 1], estado[siguientes])
+    inicio_exp = np.maximum.accumulate(np.where(es_primero, np.arange(len(exp)), 0))
+    acumulado = np.cumsum(segundos)
+    desde_registro = acumulado - acumulado[inicio_exp] + segundos[inicio_exp]
+
+    columnas_exp = ['id_exp', 'dni', 'nif'] + COLUMNAS_MUNICIPIO + ['unidad_tramitadora'] + COLUMNAS_TEXTOS + ['es_telematica']
+    tramites = expedientes[columnas_exp].iloc[exp].reset_index(drop=True)
+    tramites['desc_tramite'] = pd.Series(estado).map(modelo['desc_tramite']).to_numpy()
+    tramites['fecha_tramite'] = (
+        registro[exp] + pd.to_timedelta(np.round(desde_registro), unit='s')
+    ).to_numpy()
+    tramites['num_tramite'] = estado.astype('uint16')
+    tramites['cod_procedimiento'] = float(modelo['textos']['codigo_procedimiento'])
+    tramites['orden_tramite'] = paso.astype('uint16')
+    return expedientes, tramites
+
+
+def genera(modelo, n_expedientes, destino, semilla=0, tamano_lote=TAMANO_LOTE):
+    """Escribe en data/tratados/<destino> un procedimiento sintético de n_expedientes"""
+    rng = np.random.default_rng(semilla)
+    ruta = f"{RUTA_TRATADOS}/{destino}"
+    os.makedirs(ruta, exist_ok=True)
+    escritores = {
+        f: pq.ParquetWriter(f"{ruta}/{f}.parquet", modelo['esquemas'][f]) for f in ('expedientes', 'tramites')
+    }
+    n_tramites = 0
+    try:
+        for primer_id in range(1, n_expedientes + 1, tamano_lote):
+            n = min(tamano_lote, n_expedientes + 1 - primer_id)
+            for f, df in zip(('expedientes', 'tramites'), genera_lote(modelo, rng, n, primer_id)):
+                escritores[f].write_table(pa.Table.from_pandas(df, schema=modelo['esquemas'][f], preserve_index=False))
+                n_tramites += len(df) if f == 'tramites' else 0
+    finally:
+        for escritor in escritores.values():
+            escritor.close()
+    shutil.copyfile(f"{RUTA_TRATADOS}/{modelo['codigo']}/estados_finales.csv", f"{ruta}/estados_finales.csv")
+    return n_expedientes, n_tramites
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera un procedimiento sintético a partir de uno real")
+    parser.add_argument("codigo", help="procedimiento de data/tratados que se toma como modelo")
+    parser.add_argument("n_expedientes", type=int)
+    parser.add_argument("--destino", help="carpeta en data/tratados (por defecto sintetico_<codigo>)")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--lote", type=int, default=TAMANO_LOTE, help="expedientes generados a la vez")
+    args = parser.parse_args()
+
+    destino = args.destino or f"sintetico_{args.codigo}"
+    n_exp, n_tram = genera(aprende_modelo(args.codigo), args.n_expedientes, destino, args.semilla, args.lote)
+    print(f"{n_exp} expedientes, {n_tram} trámites -> {RUTA_TRATADOS}/{destino}")
@@ -5,46 +5,38 @@ Created on Fri Feb 14 19:49:30 2025
 @author: flipe
 """
 import streamlit as st
-import pandas as pd
 import plotly.graph_objects as go
 
+from claves_cache import TTL_CACHE, MAX_ENTRADAS_CACHE
+from instrumentacion import cache_data, plotly_chart
+from carga_trabajo import construye_acumulado, tabla_carga, unidades_con_carga
+
 # Get parameters from session state
 rango_fechas = st.session_state.get('rango_fechas', (None, None))
-proced_seleccionado = st.session_state.get('proced_seleccionado', None)
 nombres_estados = st.session_state.estados.set_index('NUMTRAM')['DENOMINACION_SIMPLE'].to_dict()
 
 
-# Cache function to load accumulated data
-@st.cache_data(show_spinner="Cargando datos acumulados")
-def carga_datos_acumulados(_codigo_procedimiento, rango_fechas):
-    base_path = f"data/tratados/{_codigo_procedimiento}"
-    _datos_acumulados = pd.read_parquet(
-        f"{base_path}/tramites_acumulado.parquet"
-    )
-    _datos_acumulados["fecha_tramite"] = pd.to_datetime(_datos_acumulados["fecha_tramite"]).dt.date
-    # Filtra los datos según el rango de fechas
-    start_date, end_date = rango_fechas
-    df_filtrado = _datos_acumulados[
-        (_datos_acumulados["fecha_tramite"] >= start_date) & (_datos_acumulados["fecha_tramite"] <= end_date)
-    ]
-    return df_filtrado
+# Carga acumulada de todo el histórico del procedimiento (carga_trabajo.py): se calcula
+# una vez sobre los datos base y el rango de fechas solo recorta los días a mostrar
+@cache_data(ttl=TTL_CACHE, max_entries=MAX_ENTRADAS_CACHE, show_spinner="Calculando carga de trabajo acumulada")
+def calcula_acumulado(_tramites, huella_base):
+    return construye_acumulado(_tramites)
 
 
-df_acumulados = carga_datos_acumulados(proced_seleccionado, rango_fechas)
+acumulado = calcula_acumulado(st.session_state.datos_base['tramites'], st.session_state.datos_base['huella'])
+start_date, end_date = rango_fechas
 
 st.subheader("Acumulación de expedientes en cada estado a lo largo del tiempo")
-st.info("Permite visualizar acumulaciones de carga de trabajo, expedientes que se acumulan en determinados trámites. La gráfica se presenta inicialmente con el primer estado marcado, selecciona los estados que te interese visualizar.", icon="💡")
+st.info("Permite visualizar acumulaciones de carga de trabajo, expedientes que se acumulan en determinados trámites. Cada día cuenta los expedientes que siguen en cada estado al final del día: los que salen de un estado ese mismo día ya no cuentan en él. La gráfica se presenta inicialmente con el primer estado marcado, selecciona los estados que te interese visualizar.", icon="💡")
 
 nombres_estados_str = {str(k): v for k, v in nombres_estados.items()}
-state_cols = [col for col in df_acumulados.columns if col in nombres_estados_str]
+df_agg = tabla_carga(acumulado, start_date, end_date)
+state_cols = [col for col in df_agg.columns if col in nombres_estados_str]
 
 # ---------------------------
 # Plot 1: Datos agregados (todas las unidades)
 # ---------------------------
 
-# Agrupa los datos por fecha, sumando los procesos por cada estado
-df_agg = df_acumulados.groupby("fecha_tramite")[state_cols].sum().reset_index()
-
 # Crea la figura con Plotly
 fig = go.Figure()
 
@@ -85,19 +77,18 @@ for state in state_cols:
         xaxis=dict(showgrid=True, gridcolor='rgba(0,0,0,0.1)', gridwidth=1)
     )
 
-st.plotly_chart(fig, use_container_width=True)
+plotly_chart(fig, use_container_width=True)
 
 # ---------------------------
 # Plot 2: Filtrado por unidad tramitadora (si hay más de una)
 # ---------------------------
-unidades = sorted(df_acumulados["unidad_tramitadora"].unique())
+unidades = unidades_con_carga(acumulado, start_date, end_date)
 if len(unidades) > 1:
     st.markdown("")
     st.subheader("GRáfica de estados acumulados para una Unidad específica")
     st.info("Compara la carga de trabajo acumulada de una Unidad en particular, posibles diferencias en tiempos o cantidad de expedientes acumulados en determinados estados", icon = "👬")
     unidad_seleccionada = st.selectbox("Selecciona la unidad tramitadora", unidades)
-    df_unidad = df_acumulados[df_acumulados["unidad_tramitadora"] == unidad_seleccionada]
-    df_agg_unidad = df_unidad.groupby("fecha_tramite")[state_cols].sum().reset_index()
+    df_agg_unidad = tabla_carga(acumulado, start_date, end_date, unidad=unidad_seleccionada)
     
     fig2 = go.Figure()
     for state in state_cols:
@@ -133,7 +124,7 @@ if len(unidades) > 1:
         yaxis=dict(showgrid=True, gridcolor='rgba(0,0,0,0.1)', gridwidth=1),
         xaxis=dict(showgrid=True, gridcolor='rgba(0,0,0,0.1)', gridwidth=1)
     )
-    st.plotly_chart(fig2, use_container_width=True)
+    plotly_chart(fig2, use_container_width=True)
 
 
 st.markdown("")
@@ -6,69 +6,48 @@ Created on Thu Jan 30 19:19:18 2025
 """
 
 import streamlit as st
-import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
-import datetime 
-import numpy as np
+import plotly.express as px
+
+from claves_cache import TTL_CACHE, MAX_ENTRADAS_CACHE
+from instrumentacion import cache_data, plotly_chart
+import analitica
+from cubo_demanda import construye_cubo_demanda
 
 ##########################
 # CARGA DE DATOS DE SESSION STATE
 ##########################
-# Get filtered expedientes
+# Get filtered expedientes (shared read-only frame, fecha_registro_exp is already datetime)
 expedientes = st.session_state.datos_filtrados_rango['expedientes']
-# Ensure datetime type
-expedientes['fecha_registro_exp'] = pd.to_datetime(expedientes['fecha_registro_exp'])
+huella_rango = st.session_state.datos_filtrados_rango['huella']
 
 ##########################
 # FUNCIONES CACHEADAS
 ##########################
-@st.cache_data
-def compute_agregado(_expedientes, freq, rango_fechas, proced_seleccionado):
+freq_map = {'Diaria': 'D', 'Semanal': 'W-MON', 'Mensual': 'MS'}
+
+@cache_data(ttl=TTL_CACHE, max_entries=MAX_ENTRADAS_CACHE, show_spinner="Agregando solicitudes por día")
+def compute_cubo(_expedientes, huella_rango):
+    """Daily cube (date x provincia x es_online x es_empresa) shared by every tab (cubo_demanda.py)"""
+    return construye_cubo_demanda(_expedientes)
+
+@cache_data(ttl=TTL_CACHE, max_entries=MAX_ENTRADAS_CACHE)
+def compute_agregado(_cubo, freq, huella_rango):
     """Compute aggregated data for Tab1"""
-    freq_map = {'Diaria': 'D', 'Semanal': 'W-MON', 'Mensual': 'MS'}
-    return _expedientes.set_index('fecha_registro_exp').resample(freq_map[freq]).agg(
-        total_exp=('id_exp', 'count')
-    ).reset_index()
+    return analitica.compute_agregado(_cubo, freq_map[freq])
 
-@st.cache_data
-def compute_provincia(_expedientes, freq, rango_fechas, proced_seleccionado):
+@cache_data(ttl=TTL_CACHE, max_entries=MAX_ENTRADAS_CACHE)
+def compute_provincia(_cubo, freq, huella_rango):
     """Compute province data for Tab2 and Tab4"""
-    freq_map = {'Diaria': 'D', 'Semanal': 'W-MON', 'Mensual': 'MS'}
-    df = _expedientes.groupby(
-        [pd.Grouper(key='fecha_registro_exp', freq=freq_map[freq]), 'provincia']
-    ).agg(total_exp=('id_exp', 'count')).reset_index()
-    
-    province_totals = df.groupby('provincia')['total_exp'].sum().sort_values(ascending=False)
-    df['provincia'] = pd.Categorical(
-        df['provincia'],
-        categories=province_totals.index.tolist(),
-        ordered=True
-    )
-    return df
+    return analitica.compute_provincia(_cubo, freq_map[freq])
 
-@st.cache_data
-def compute_heatmap_data(_expedientes, rango_fechas, proced_seleccionado):
+@cache_data(ttl=TTL_CACHE, max_entries=MAX_ENTRADAS_CACHE)
+def compute_heatmap_data(_cubo, huella_rango):
     """Compute heatmap data for Tab3"""
-    df_week = _expedientes.set_index('fecha_registro_exp').resample('W-MON').agg(
-        total_exp=('id_exp', 'count')
-    )
-    # Extract ISO year and week to avoid calendar year conflicts
-    iso_calendar = df_week.index.isocalendar()
-    df_week['year'] = iso_calendar['year']  # Use ISO year instead of calendar year
-    df_week['week'] = iso_calendar['week']
-    df_week['start_date'] = df_week.index.strftime('%Y-%m-%d')
-    df_week['month'] = df_week.index.strftime('%B')
-    
-    # Handle duplicates by aggregating (though resample should prevent this)
-    heatmap_data = df_week.groupby(['year', 'week'])['total_exp'].sum().unstack(fill_value=0)
-    
-    # Similarly pivot start_date and month using first occurrence
-    start_date_pivot = df_week.groupby(['year', 'week'])['start_date'].first().unstack()
-    month_pivot = df_week.groupby(['year', 'week'])['month'].first().unstack()
-    custom_data = np.dstack([start_date_pivot.values, month_pivot.values])
-    
-    return df_week, heatmap_data, custom_data
+    return analitica.compute_heatmap_data(_cubo)
+
+# Daily cube built once per date slice; every tab and frequency is a roll-up of it
+cubo = compute_cubo(expedientes, huella_rango)
 
 ##########################
 # INTERFAZ DE USUARIO
@@ -82,7 +61,6 @@ tab1, tab2, tab3, tab4 = st.tabs([
 
 
 rango_fechas = st.session_state.get('rango_fechas', (None, None))
-proced_seleccionado = st.session_state.proced_seleccionado
 # Determine frequency based on the date range
 start_date, end_date = rango_fechas
 if start_date is not None and end_date is not None:
@@ -102,7 +80,7 @@ with tab1:
     st.info("Identifica patrones de mayor entrada de solicitudes y posibles relaciones con eventos relacionados con el procedimiento",  icon="🕵️‍♂️")
 
 
-    df_agregado = compute_agregado(expedientes, freq, rango_fechas, proced_seleccionado)
+    df_agregado = compute_agregado(cubo, freq, huella_rango)
     
     # Checkbox to include rolling mean
     include_rolling_mean = st.checkbox("Ver media móvil")
@@ -164,14 +142,14 @@ with tab1:
     fig.update_yaxes(range=[0, max_total_1])
     
     #fig.update_layout(height=plot_height)
-    st.plotly_chart(fig, use_container_width=True)
+    plotly_chart(fig, use_container_width=True)
 
 with tab2:
     st.subheader("Evolución mensual por provincia")
     st.info("¿hay diferencias entre provincias en los tiempos de presentación de solicitudes?. Haz doble click en una provincia para aislar esos datos",  icon="🕵️‍♂️")
 
 
-    df_provincia = compute_provincia(expedientes, freq, rango_fechas, proced_seleccionado)
+    df_provincia = compute_provincia(cubo, freq, huella_rango)
     
     # Create dynamic labels for the x-axis
     tick_format = '%b %Y' if freq == 'Mensual' else '%Y-%m-%d'
@@ -214,7 +192,7 @@ with tab2:
     max_total = df_provincia.groupby('fecha_registro_exp')['total_exp'].sum().max()
     fig_prov.update_yaxes(range=[0, max_total])
     
-    st.plotly_chart(fig_prov, use_container_width=True)
+    plotly_chart(fig_prov, use_container_width=True)
 
     # fig_area = px.area(
     #     df_provincia,
@@ -225,14 +203,14 @@ with tab2:
     # )
     # fig_area.update_xaxes(tickformat=tick_format)
     # fig_area.update_layout(height=plot_height)
-    # st.plotly_chart(fig_area, use_container_width=True)
+    # plotly_chart(fig_area, use_container_width=True)
 
 with tab3:
     st.subheader("Mapa de calor con demanda semanal a lo largo del año")
     st.info("El mapa de calor permite visualizar posibles semanas o periodos anuales en que se presentan más solicitudes",  icon="🕵️‍♂️")
 
 
-    df_week, heatmap_data, custom_data = compute_heatmap_data(expedientes, rango_fechas, proced_seleccionado)
+    df_week, heatmap_data, custom_data = compute_heatmap_data(cubo, huella_rango)
     
     fig_heatmap = go.Figure(data=go.Heatmap(
         x=heatmap_data.columns,
@@ -261,14 +239,14 @@ with tab3:
         tickvals=heatmap_data.index,
         ticktext=[str(int(year)) for year in heatmap_data.index]
     )
-    st.plotly_chart(fig_heatmap, use_container_width=True)
+    plotly_chart(fig_heatmap, use_container_width=True)
 
 with tab4:
     st.subheader("Datos completos agrupados por mes y provincia")
     
     # Usamos los datos cacheados de tab2
     freq = 'Mensual'
-    df_provincia = compute_provincia(expedientes, freq, rango_fechas, proced_seleccionado)
+    df_provincia = compute_provincia(cubo, freq, huella_rango)
     
     df_subset = df_provincia[['fecha_registro_exp', 'provincia', 'total_exp']].rename(columns={
         'fecha_registro_exp': 'Fecha inicio mes',
@@ -3,12 +3,29 @@ import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
 
+from claves_cache import TTL_CACHE, MAX_ENTRADAS_CACHE
+from instrumentacion import cache_data, plotly_chart
+import analitica
+from cubo_tramitacion import construye_cubo_tramitacion
+
 
 # Get parameters from session state
 rango_fechas = st.session_state.get('rango_fechas', (None, None))
-proced_seleccionado = st.session_state.get('proced_seleccionado', None)
 estados_finales_selecc = [int(s) for s in st.session_state.estados_finales_selecc]
 nombres_estados = st.session_state.estados.set_index('NUMTRAM')['DENOMINACION_SIMPLE'].to_dict()
+huella_seleccion = st.session_state.huella_seleccion
+huella_rango = st.session_state.datos_filtrados_rango['huella']
+hay_seleccion = len(estados_finales_selecc) > 0
+
+# Shared read-only frames of the selected date range
+tramites_df = st.session_state.datos_filtrados_rango['tramites']
+expedientes_df = st.session_state.datos_filtrados_rango['expedientes']
+# Expedientes that reach the selected final states (mask computed in app.py)
+secuencias_exp = st.session_state.datos_filtrados_rango['secuencias']['expedientes']
+ids_seleccionados = secuencias_exp['id_exp'][st.session_state.mascara_estados]
+
+# Rows of the not completed table sent to the browser at once
+ROWS_PER_PAGE = 200
 
 # Initialize session state variable to store the selected date
 if 'selected_date' not in st.session_state:
@@ -16,86 +33,20 @@ if 'selected_date' not in st.session_state:
     
     
 # Add this function for tab1 data processing
-@st.cache_data(show_spinner="Procesando datos de inicio vs completados...")
-def process_starts_vs_completed(estados_finales_selecc, freq):
-    #cogemos directamente de session state para evitar problemas de actualizacion
-    _tramites_df= st.session_state.datos_filtrados_rango['tramites'].copy()
-    # Get all process starts (num_tramite=0)
-    starts_df = _tramites_df[_tramites_df['num_tramite'] == 0].copy()
-    
-    # Group starts by month
-    starts_df['fecha'] = starts_df['fecha_tramite'].dt.to_period(freq).dt.to_timestamp()
-    monthly_starts = starts_df.groupby('fecha')['id_exp'].nunique().reset_index(name='total_starts')
-    
-    if estados_finales_selecc:
-        # Find processes that reached final states
-        completed_procs = _tramites_df[
-            _tramites_df['num_tramite'].isin(estados_finales_selecc)
-        ]['id_exp'].unique()
-        
-        # Filter starts that were completed
-        completed_starts = starts_df[
-            starts_df['id_exp'].isin(completed_procs)
-        ].groupby('fecha')['id_exp'].nunique().reset_index(name='completed')
-        
-        # Merge data
-        merged = monthly_starts.merge(completed_starts, on='fecha', how='left')
-    else:
-        merged = monthly_starts.assign(completed=0)
-    
-    return merged.fillna(0)
+@cache_data(ttl=TTL_CACHE, max_entries=MAX_ENTRADAS_CACHE, show_spinner="Procesando datos de inicio vs completados...")
+def process_starts_vs_completed(_tramites_df, _ids_completados, huella_seleccion, hay_seleccion, freq):
+    """
+    Starts and completed starts per period for the chart, plus the period -> not completed
+    starts index used by the drill-down (analitica.py)
+    """
+    return analitica.process_starts_vs_completed(_tramites_df, _ids_completados, hay_seleccion, freq)
 
-# Cached helper function to precompute not completed expedientes by start month
-@st.cache_data(show_spinner="Calculando expedientes no completados...")
-def get_not_completed_expedientes(estados_finales_selecc, freq):
-    tramites_df = st.session_state.datos_filtrados_rango['tramites'].copy()
-    expedientes = st.session_state.datos_filtrados_rango['expedientes'].copy()
-    
-    # Get all process starts
-    starts_df = tramites_df[tramites_df['num_tramite'] == 0].copy()
-    # Compute start month
-    starts_df['fecha'] = starts_df['fecha_tramite'].dt.to_period(freq).dt.to_timestamp()
-    
-    if estados_finales_selecc:
-        # Determine which processes reached final states
-        completed_procs = tramites_df[
-            tramites_df['num_tramite'].isin(estados_finales_selecc)
-        ]['id_exp'].unique()
-    else:
-        completed_procs = []
-    
-    # Filter to get only not completed processes
-    not_completed = starts_df[~starts_df['id_exp'].isin(completed_procs)].copy()
-    # Join with expedientes to get detailed info (assuming matching on 'id_exp')
-    not_completed_expedientes = not_completed.merge(expedientes, on='id_exp', how='left')
-    
-    not_completed_expedientes = not_completed_expedientes[['fecha', 'id_exp','unidad_tramitadora','fecha_registro_exp','municipio_x','provincia_x','es_online_x','es_empresa_x']]
-    # Convert 'fecha_registro_exp' to datetime and format it as 'YYYY-MM-DD'
-    not_completed_expedientes['fecha_registro_exp'] = pd.to_datetime(not_completed_expedientes['fecha_registro_exp']).dt.strftime('%Y-%m-%d')
-    
-    state_sequences = tramites_df.groupby('id_exp').apply(
-        lambda g: ' → '.join(
-            g.sort_values('num_tramite').apply(
-                lambda row: f"({pd.to_datetime(row['fecha_tramite']).strftime('%Y-%m-%d')}) {nombres_estados.get(row['num_tramite'], str(row['num_tramite']))}",
-                axis=1
-            )
-        )
-    ).reset_index(name='Secuencia')
-    # Merge the state sequence into the not_completed_expedientes DataFrame.
-    not_completed_expedientes = not_completed_expedientes.merge(state_sequences, on='id_exp', how='left')
-    
-    not_completed_expedientes = not_completed_expedientes.rename(columns={
-        'id_exp': 'ID Expediente',
-        'unidad_tramitadora': 'Unidad Tramitadora',
-        'fecha_registro_exp': 'Fecha Registro',
-        'municipio_x': 'Municipio',
-        'provincia_x': 'Provincia',
-        'es_online_x': 'Online',
-        'es_empresa_x': 'Empresa'
-    })
-
- 
-    return not_completed_expedientes
+# Drill-down: one page of the not completed expedientes of one start period
+@cache_data(ttl=TTL_CACHE, max_entries=MAX_ENTRADAS_CACHE, show_spinner="Calculando expedientes no completados...")
+def get_not_completed_expedientes(_tramites_df, _expedientes, _period_index, huella_seleccion, freq, period, page):
+    return analitica.get_not_completed_expedientes(
+        _tramites_df, _expedientes, _period_index, period, page, ROWS_PER_PAGE, nombres_estados
+    )
 
 # Add this new plot function
 def create_start_completion_plot(data, freq):
@@ -165,32 +116,16 @@ def create_start_completion_plot(data, freq):
     return fig
 
 
-@st.cache_data(show_spinner="Procesando datos de trámites...")
-def process_tramites_data(_tramites_df, estados_finales_selecc, rango_fechas, proced_seleccionado, freq):
-    # Filter processes that passed through selected final states
-    # mask = _tramites_df.groupby('id_exp')['num_tramite'].transform(
-    #     lambda x: x.isin(estados_finales_selecc).any()
-    # )
-    # filtered_df = _tramites_df[mask]
-    # Filter processes that passed through selected final states
-    if not estados_finales_selecc:
-        filtered_df = _tramites_df
-    else:
-        mask = _tramites_df.groupby('id_exp')['num_tramite'].transform(
-            lambda x: x.isin(estados_finales_selecc).any()
-        )
-        filtered_df = _tramites_df[mask]
-    
-    # Group by month, state, and processing unit
-    filtered_df['fecha'] = filtered_df['fecha_tramite'].dt.to_period(freq).dt.to_timestamp()
-    grouped = filtered_df.groupby(
-        ['fecha', 'num_tramite', 'unidad_tramitadora']
-    ).size().reset_index(name='count')
-    
-    # Add state names
-    grouped['estado'] = grouped['num_tramite'].map(nombres_estados)
-    
-    return grouped
+@cache_data(ttl=TTL_CACHE, max_entries=MAX_ENTRADAS_CACHE, show_spinner="Agregando trámites por día...")
+def compute_tramites_cube(_tramites_df, huella_rango):
+    """Sparse (day, num_tramite, unidad, state signature) count cube of the date slice (cubo_tramitacion.py)"""
+    return construye_cubo_tramitacion(_tramites_df)
+
+@cache_data(ttl=TTL_CACHE, max_entries=MAX_ENTRADAS_CACHE, show_spinner="Procesando datos de trámites...")
+def process_tramites_data(_cubo, huella_rango, estados_finales_selecc, freq):
+    # Processes that passed through selected final states are a mask over the cube signatures,
+    # and the period view is a roll-up of the daily cube (analitica.py)
+    return analitica.process_tramites_data(_cubo, estados_finales_selecc, freq, nombres_estados)
 
 def create_evolution_plot(data , freq):
     fig = go.Figure()
@@ -269,13 +204,15 @@ with tab1:
     st.subheader("Progreso de procesos iniciados")
     st.info("Muestra la cantidad de procesos iniciados y cuántos alcanzaron alguno de los estados finales seleccionados", icon='📈')
     
-    # Process data for tab1
-    start_complete_data = process_starts_vs_completed(estados_finales_selecc, freq)
+    # Process data for tab1 (chart data and period -> not completed expedientes index)
+    start_complete_data, period_index = process_starts_vs_completed(
+        tramites_df, ids_seleccionados, huella_seleccion, hay_seleccion, freq
+    )
     
     # Create plot and capture click events
     progress_fig = create_start_completion_plot(start_complete_data, freq)
-    #st.plotly_chart(progress_fig, use_container_width=True)
-    event = st.plotly_chart(progress_fig, use_container_width=True, on_select="rerun")
+    #plotly_chart(progress_fig, use_container_width=True)
+    event = plotly_chart(progress_fig, use_container_width=True, on_select="rerun")
     # Check if an event occurred and process it
     
     st.markdown("")
@@ -289,12 +226,18 @@ with tab1:
             clicked_date = pd.to_datetime(clicked_date_str).to_period(freq).to_timestamp()
             st.subheader(f"Expedientes de {clicked_date.strftime('%b %Y')} no completados")
             st.markdown("Estos expedientes no han alcanzado ninguno de los estados finales seleccionados")
-            # Get precomputed not completed expedientes
-            not_completed_expedientes = get_not_completed_expedientes(estados_finales_selecc, freq)
-            # Filter for the selected month
-            df_filtered = not_completed_expedientes[not_completed_expedientes['fecha'] == clicked_date]
+            # Not completed expedientes of the clicked period only, one page at a time
+            start, stop = analitica.period_rows(period_index, clicked_date)
+            n_pages = max(1, -(-(stop - start) // ROWS_PER_PAGE))
+            page = 1
+            if n_pages > 1:
+                page = st.number_input(f"Página (de {n_pages})", min_value=1, max_value=n_pages, value=1, step=1)
+            st.caption(f"{stop - start:,} expedientes no completados")
+            not_completed_expedientes = get_not_completed_expedientes(
+                tramites_df, expedientes_df, period_index, huella_seleccion, freq, clicked_date, page - 1
+            )
             # Drop the 'fecha' column
-            df_filtered = df_filtered.drop(columns=['fecha'])
+            df_filtered = not_completed_expedientes.drop(columns=['fecha'])
 
             st.dataframe(df_filtered, 
                     hide_index = True,
@@ -308,22 +251,16 @@ with tab2:
     # Page Start
     st.subheader("Evolución de la tramitación a lo largo del tiempo")
     st.info("La gráfica permite ver cuántos trámites de cada tipo ocurren a lo largo del tiempo", icon='🏔️')
-    # Update the tab1 section
-    tramites_df = st.session_state.datos_filtrados_rango['tramites'].copy()
-    # Prepare data
-    tramites_df['unidad_tramitadora'] = tramites_df['unidad_tramitadora'].fillna('No especificada')
-    
-    # Process data once
-    processed_data = process_tramites_data(
-        tramites_df, estados_finales_selecc, rango_fechas, proced_seleccionado, freq
-    )
+    # Process data once from the daily cube (unidad_tramitadora already comes filled with 'No especificada')
+    tramites_cube = compute_tramites_cube(tramites_df, huella_rango)
+    processed_data = process_tramites_data(tramites_cube, huella_rango, estados_finales_selecc, freq)
     
     # Main plot (sum across all units)
     main_plot_data = processed_data.groupby(
         ['fecha', 'num_tramite', 'estado']
     )['count'].sum().reset_index()
     main_fig = create_evolution_plot(main_plot_data, freq)
-    st.plotly_chart(main_fig, use_container_width=True)
+    plotly_chart(main_fig, use_container_width=True)
     
     # Unit-specific plots
     unique_units = processed_data['unidad_tramitadora'].unique()
@@ -333,5 +270,5 @@ with tab2:
         
         unit_data = processed_data[processed_data['unidad_tramitadora'] == selected_unit]
         unit_fig = create_evolution_plot(unit_data, freq)
-        st.plotly_chart(unit_fig, use_container_width=True)
+        plotly_chart(unit_fig, use_container_width=True)
 
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Estadísticas de transiciones entre estados.
+
+Trabaja directamente sobre los arrays planos del almacén de secuencias
+(secuencias.py), que ya están ordenados por expediente y fecha: la transición
+del paso i va al paso i+1 salvo que i sea el último paso de su expediente.
+Devuelve DataFrames con las columnas (src, tgt, [unidad], count, sum, mean,
+median, p90) que usan directamente las gráficas y los diagramas DOT.
+"""
+import numpy as np
+import pandas as pd
+
+
+def transiciones_secuencias(secuencias, mascara=None):
+    """Una fila por transición (src, tgt, unidad, duration) de los expedientes seleccionados en mascara"""
+    offsets = secuencias['offsets']
+    estados = secuencias['num_tramite']
+    n_pasos = np.diff(offsets)
+
+    valida = np.ones(len(estados), dtype=bool)
+    valida[offsets[1:] - 1] = False
+    if mascara is not None:
+        valida &= np.repeat(np.asarray(mascara, dtype=bool), n_pasos)
+    idx = np.flatnonzero(valida)
+
+    unidad_paso = np.repeat(secuencias['expedientes']['unidad_tramitadora'].to_numpy(), n_pasos)
+    return pd.DataFrame({
+        'src': estados[idx],
+        'tgt': estados[idx + 1],
+        'unidad': unidad_paso[idx],
+        'duration': secuencias['duration'][idx].astype('float64')
+    })
+
+
+def estadisticas_transiciones(transiciones, por_unidad=False):
+    """Agrega las transiciones por (src, tgt) o por (src, tgt, unidad)"""
+    claves = ['src', 'tgt', 'unidad'] if por_unidad else ['src', 'tgt']
+    agrupado = transiciones.groupby(claves, sort=True)['duration']
+    stats = agrupado.agg(['count', 'sum', 'mean', 'median']).reset_index()
+    stats['p90'] = agrupado.quantile(0.9).to_numpy()
+    return stats
+
+
+def build_dot(stats, nombres_estados):
+    """
+    Build a DOT string from aggregated transitions (columns src, tgt, count, mean):
+    one node per state and one edge per transition labelled with count and mean duration.
+    """
+    dot_lines = []
+    dot_lines.append("digraph ProcessFlow {")
+    # Set a layout direction (TB = top-to-bottom, LR = left-to-right)
+    dot_lines.append("  rankdir=TB;")
+
+    # Create node IDs
+    sorted_nodes = sorted(set(stats['src'].tolist()) | set(stats['tgt'].tolist()))
+    node_ids = {node: f"node{idx}" for idx, node in enumerate(sorted_nodes)}
+
+    # Define nodes with their labels (using nombres_estados mapping)
+    for node in sorted_nodes:
+        node_label = nombres_estados.get(node, f"S-{node}")
+        dot_lines.append(f'  {node_ids[node]} [label="{node_label}"];')
+
+    # Define edges with aggregated counts and average durations.
+    # Using "\n" in DOT requires escaping as "\\n" in the string.
+    for source, target, count, avg_duration in zip(
+        stats['src'].tolist(), stats['tgt'].tolist(), stats['count'].tolist(), stats['mean'].tolist()
+    ):
+        edge_label = f"Exp: {count}\\nDur: {avg_duration:.1f} días"
+        dot_lines.append(f'  {node_ids[source]} -> {node_ids[target]} [label="{edge_label}"];')
+
+    dot_lines.append("}")
+    return "\n".join(dot_lines)